@@ -0,0 +1,347 @@
+"""
+Validation helpers shared by the ok-nok Glue jobs (wk-glue-job-bronze-ok-nok-*),
+shipped to the jobs with --extra-py-files: the source rule configs (see jenji.json,
+shipped with --extra-files), declarative rules compiled to Spark SQL, typed output,
+event date partitions, the output file sizing and the job metrics.
+"""
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from pyspark.sql import functions as F
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+ISO_DATE_REGEX = "^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])"
+VALID_COLUMN = "_is_valid"
+REJECTED_RULES_COLUMN = "rejected_rules"
+EVENT_DATE_COLUMN = "event_date"
+# Output partition columns: (position, length) in EVENT_DATE_COLUMN yyyy-MM-dd
+PARTITION_COLUMNS = {"event_date": (1, 10), "year": (1, 4), "month": (6, 2), "day": (9, 2)}
+# Columns of repartition_for_write: number of files of the output partition, number of
+# its first file and number of the file of the row
+PARTITION_FILES_COLUMN = "_partition_files"
+FILE_OFFSET_COLUMN = "_file_offset"
+FILE_NUMBER_COLUMN = "_file_number"
+# CloudWatch namespace of the job metrics (same as the API metrics of the S3 trigger Lambda)
+METRICS_NAMESPACE = "DataLake/ArrivalHub"
+PUT_METRIC_DATA_MAX_METRICS = 1000  # AWS limit of metrics per PutMetricData call
+# Glue job run states of the runs not finished yet, see get_active_job_run_ids
+GLUE_JOB_RUN_ACTIVE_STATES = ("STARTING", "RUNNING", "STOPPING", "WAITING")
+
+# Source rule config keys, see jenji.json next to this module for a full example
+SOURCE_CONFIG_REQUIRED_KEYS = (
+    "source_id",
+    "database",
+    "table_name",
+    "rules",
+    "validated_path",
+    "rejected_path",
+)
+SOURCE_CONFIG_DEFAULTS = {
+    "drop_fields": [],
+    "target_schema": {},
+    "event_date_columns": [],
+    "partition_keys": [EVENT_DATE_COLUMN],
+    "catalog_table_name": None,  # Catalog table of the validated output, None skips the update
+    "ingestion_partition_column": None,  # Ingestion date partition of the catalog table
+    "push_down_predicate": None,  # Explicit partition predicate of the catalog table
+}
+
+
+def get_job_argument(name, default=None):
+    """Optional Glue job argument --name value (getResolvedOptions fails on missing ones)"""
+    option = "--" + name
+    if option in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(option) + 1]
+    return default
+
+
+def parse_source_configs(config_text, config_name=""):
+    """
+    Parse rule configs: a JSON (or YAML when config_name ends with .yaml/.yml)
+    source config, list of source configs, or {"sources": [source configs]}
+    :return: list of source configs with the defaults set
+    """
+    if config_name.endswith((".yaml", ".yml")):
+        import yaml  # pylint: disable=C0415 (only needed for YAML configs)
+
+        configs = yaml.safe_load(config_text)
+    else:
+        configs = json.loads(config_text)
+    if isinstance(configs, dict):
+        configs = configs.get("sources", [configs])
+
+    source_configs = []
+    for config in configs:
+        missing_keys = [key for key in SOURCE_CONFIG_REQUIRED_KEYS if key not in config]
+        if missing_keys:
+            raise ValueError(
+                "Source config %s misses %s" % (config.get("source_id", config_name), missing_keys)
+            )
+        source_configs.append({**SOURCE_CONFIG_DEFAULTS, **config})
+    return source_configs
+
+
+def load_source_configs(config_location):
+    """
+    Load the rule configs from:
+      ssm:/path/ - every SSM parameter under the path holds one config
+      s3://bucket/key - one config file in S3
+      any other value - one local config file (e.g. passed with --extra-files)
+    :return: list of source configs
+    """
+    source_configs = []
+    if config_location.startswith("ssm:"):
+        ssm_client = boto3.client("ssm")  # Systems Manager
+        paginator = ssm_client.get_paginator("get_parameters_by_path")
+        for page in paginator.paginate(
+            Path=config_location[len("ssm:"):], Recursive=True, WithDecryption=True
+        ):
+            for parameter in page["Parameters"]:
+                source_configs += parse_source_configs(parameter["Value"], parameter["Name"])
+    elif config_location.startswith("s3://"):
+        bucket_name, object_key = config_location[len("s3://"):].split("/", 1)
+        s3_client = boto3.client("s3")  # Simple Storage Service
+        config_text = s3_client.get_object(Bucket=bucket_name, Key=object_key)["Body"].read()
+        source_configs += parse_source_configs(config_text.decode("utf-8"), object_key)
+    else:
+        with open(config_location, encoding="utf-8") as config_file:
+            source_configs += parse_source_configs(config_file.read(), config_location)
+    return source_configs
+
+
+def load_source_config(config_location, source_id):
+    """Load the rule config of one source (see load_source_configs)"""
+    for source_config in load_source_configs(config_location):
+        if source_config["source_id"] == source_id:
+            return source_config
+    raise ValueError("No source config %s in %s" % (source_id, config_location))
+
+
+def get_active_job_run_ids(job_name):
+    """
+    Ids of the runs of a Glue job not finished yet, e.g. so that the jobs rewriting
+    the same partitions (merge, compaction) never run at the same time
+    """
+    glue_client = boto3.client("glue")
+    job_runs = glue_client.get_job_runs(JobName=job_name, MaxResults=50)["JobRuns"]
+    return [
+        job_run["Id"]
+        for job_run in job_runs
+        if job_run["JobRunState"] in GLUE_JOB_RUN_ACTIVE_STATES
+    ]
+
+
+def path_exists(spark, path):
+    """The path exists in the Hadoop file system of its scheme (s3, file)"""
+    jvm_path = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    return jvm_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration()).exists(jvm_path)
+
+
+def delete_path(spark, path):
+    """Delete a path recursively through the Hadoop file system of its scheme (s3, file)"""
+    jvm_path = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    jvm_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration()).delete(jvm_path, True)
+
+
+def compile_rule(rule):
+    """
+    Compile a rule spec into a Spark SQL boolean column, a null value fails the rule.
+    The cast check is the cast of cast_frame: the values it would turn into null, or fail
+    on with ANSI mode (e.g. 2023-13-45 as a timestamp), fail the rule instead
+    """
+    column = F.col(rule["column"])
+    checks = []
+    if rule.get("not_null"):
+        checks.append(column.isNotNull())
+    if "rlike" in rule:
+        checks.append(column.rlike(rule["rlike"]))
+    if "between" in rule:
+        checks.append(column.between(*rule["between"]))
+    if "cast" in rule:
+        checks.append(F.expr("try_cast(`%s` AS %s)" % (rule["column"], rule["cast"])).isNotNull())
+    if not checks:
+        raise ValueError("Rule %s has no check" % rule["id"])
+    return F.coalesce(reduce(lambda left, right: left & right, checks), F.lit(False))
+
+
+def compile_rules(rules):
+    """Compile all the rules into one Spark SQL array column of the failed rule ids"""
+    return F.filter(
+        F.array(*[F.when(~compile_rule(rule), F.lit(rule["id"])) for rule in rules]),
+        lambda rule_id: rule_id.isNotNull(),
+    )
+
+
+def validate_frame(source_DF, rules):
+    """
+    Evaluate all the rules once per row into the REJECTED_RULES_COLUMN array
+    of failed rule ids, and the VALID_COLUMN boolean column derived from it
+    """
+    return source_DF.withColumn(REJECTED_RULES_COLUMN, compile_rules(rules)).withColumn(
+        VALID_COLUMN, F.size(F.col(REJECTED_RULES_COLUMN)) == 0
+    )
+
+
+def count_rule_failures(validated_DF, rules, metric_dimensions=None, source_id=None):
+    """
+    Count the rows failing each rule in one pass, reported as job metrics
+    and published to CloudWatch with the metric_dimensions (None does not publish),
+    plus the Source dimension when source_id is set
+    """
+    rule_counts = validated_DF.agg(
+        *[
+            F.sum(F.array_contains(F.col(REJECTED_RULES_COLUMN), rule["id"]).cast("long")).alias(
+                rule["id"]
+            )
+            for rule in rules
+        ]
+    ).collect()[0]
+    rule_failures = {rule["id"]: rule_counts[rule["id"]] or 0 for rule in rules}
+    source_text = "source=%s " % source_id if source_id else ""
+    for rule_id, rows in rule_failures.items():
+        print("METRIC RuleFailures %srule=%s rows=%d" % (source_text, rule_id, rows))
+    if metric_dimensions is not None:
+        put_count_metrics(
+            "RuleFailures",
+            {**metric_dimensions, **({"Source": source_id} if source_id else {})},
+            "Rule",
+            rule_failures,
+        )
+    return rule_failures
+
+
+def cast_frame(source_DF, target_schema):
+    """
+    Cast the columns of the target schema (column: Spark SQL type) in one projection,
+    the other columns are kept as is
+    """
+    missing_columns = set(target_schema) - set(source_DF.columns)
+    if missing_columns:
+        raise ValueError("Target schema columns not found: %s" % sorted(missing_columns))
+    return source_DF.select(
+        *[
+            F.col(column).cast(target_schema[column]).alias(column)
+            if column in target_schema
+            else F.col(column)
+            for column in source_DF.columns
+        ]
+    )
+
+
+def build_push_down_predicate(partition_column, lookback_days, utc_today=None):
+    """
+    Partition predicate reading only the ingestion date partitions (yyyy-MM-dd)
+    of the last lookback_days days, None reads all the partitions
+    """
+    if not partition_column or not lookback_days:
+        return None
+    utc_today = utc_today or datetime.now(timezone.utc).date()
+    from_date = utc_today - timedelta(days=int(lookback_days))
+    return "%s >= '%s'" % (partition_column, from_date.isoformat())
+
+
+def add_event_date_column(source_DF, event_date_columns):
+    """
+    Event date (yyyy-MM-dd) used as output partition: from the first of the
+    event_date_columns holding an existing ISO date, else the processing date
+    """
+    return source_DF.withColumn(
+        EVENT_DATE_COLUMN,
+        F.coalesce(
+            *[
+                F.when(
+                    F.col(column).rlike(ISO_DATE_REGEX)
+                    & F.expr("try_cast(substring(`%s`, 1, 10) AS date)" % column).isNotNull(),
+                    F.substring(F.col(column), 1, 10),
+                )
+                for column in event_date_columns
+            ],
+            F.date_format(F.current_date(), "yyyy-MM-dd"),
+        ),
+    )
+
+
+def add_partition_columns(source_DF, partition_keys):
+    """Add the output partition columns (see PARTITION_COLUMNS) derived from the event date"""
+    for partition_key in partition_keys:
+        if partition_key not in PARTITION_COLUMNS:
+            raise ValueError("Unknown partition key %s" % partition_key)
+        if partition_key != EVENT_DATE_COLUMN:
+            source_DF = source_DF.withColumn(
+                partition_key,
+                F.substring(F.col(EVENT_DATE_COLUMN), *PARTITION_COLUMNS[partition_key]),
+            )
+    return source_DF
+
+
+def repartition_for_write(source_DF, partition_keys, row_count, rows_per_file):
+    """
+    Repartition so that each output partition gets files of about rows_per_file rows,
+    neither one small file per Spark task nor one file whatever the partition size:
+    the rows of a partition are spread round robin over ceil(partition rows / rows_per_file)
+    files, numbered across the partitions so that the range repartition gives each file
+    its own task
+    """
+    if not partition_keys:
+        return source_DF.repartition(max(1, -(-row_count // rows_per_file)))
+    partition_files = (
+        source_DF.groupBy(*partition_keys)
+        .agg(F.ceil(F.count(F.lit(1)) / rows_per_file).alias(PARTITION_FILES_COLUMN))
+        .collect()
+    )
+    file_offsets = []  # Number of the first file of each partition
+    num_files = 0
+    for partition_row in partition_files:
+        file_offsets.append((*partition_row, num_files))
+        num_files += partition_row[PARTITION_FILES_COLUMN]
+    file_offsets_DF = source_DF.sparkSession.createDataFrame(
+        file_offsets,
+        source_DF.select(*partition_keys)
+        .schema.add(PARTITION_FILES_COLUMN, "long")
+        .add(FILE_OFFSET_COLUMN, "long"),
+    )
+    return (
+        source_DF.join(F.broadcast(file_offsets_DF), partition_keys)
+        .withColumn(
+            FILE_NUMBER_COLUMN,
+            F.col(FILE_OFFSET_COLUMN)
+            + F.pmod(F.monotonically_increasing_id(), F.col(PARTITION_FILES_COLUMN)),
+        )
+        .repartitionByRange(max(1, num_files), FILE_NUMBER_COLUMN)
+        .select(*source_DF.columns)
+    )
+
+
+def put_count_metrics(metric_name, dimensions, dimension_name, counts, namespace=METRICS_NAMESPACE):
+    """
+    Publish row counts to CloudWatch from the driver (the Glue logs are not extracted as EMF):
+    one Count per key of counts, dimensioned by dimensions plus dimension_name: key.
+    A failure is only logged, the data is already written
+    :param metric_name: e.g. RuleFailures
+    :param dimensions: dict of dimension name: value, e.g. {"JobName": ...}
+    :param dimension_name: Dimension of the counts keys, e.g. Rule
+    :param counts: dict of key: rows
+    """
+    metric_data = [
+        {
+            "MetricName": metric_name,
+            "Dimensions": [
+                {"Name": name, "Value": str(value)}
+                for name, value in {**dimensions, dimension_name: key}.items()
+            ],
+            "Value": rows,
+            "Unit": "Count",
+        }
+        for key, rows in counts.items()
+    ]
+    try:
+        cloudwatch_client = boto3.client("cloudwatch")
+        for idx in range(0, len(metric_data), PUT_METRIC_DATA_MAX_METRICS):
+            cloudwatch_client.put_metric_data(
+                Namespace=namespace, MetricData=metric_data[idx : idx + PUT_METRIC_DATA_MAX_METRICS]
+            )
+    except (BotoCoreError, ClientError) as exception_handler:
+        print("WARNING: Cannot publish the %s metrics: %s" % (metric_name, exception_handler))
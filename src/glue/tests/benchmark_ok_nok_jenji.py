@@ -0,0 +1,89 @@
+"""
+Benchmark of the ok-nok Jenji validation on synthetic transactions with the local Glue
+stand-ins, e.g. for 2 million rows: python benchmark_ok_nok_jenji.py --rows 2
+Reports the rows/sec of the validation stage (rules, labels and group counts) and of
+the split stage (valid rows typed and written as Parquet, rejected rows as JSON).
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pyspark.sql import functions as F
+import local_glue
+
+JOB_NAME = 'wk-glue-job-bronze-ok-nok-jenji-v1'
+SYNTHETIC_EPOCH_SEC = 1682899200  # 2023-05-01T00:00:00Z
+
+
+def generate_transactions(spark, rows, invalid_ratio=0.1, days=30):
+    """
+    Synthetic raw Jenji transactions spread over days, the invalid ones (one every
+    round(1 / invalid_ratio) rows) have no seller and a non numeric total
+    """
+    row_id = F.col('id')
+    invalid = (row_id % max(1, round(1 / invalid_ratio)) == 0) if invalid_ratio else F.lit(False)
+    timestamp = F.date_format(F.timestamp_seconds(F.lit(SYNTHETIC_EPOCH_SEC) + row_id % (days * 86400)),
+                              "yyyy-MM-dd'T'HH:mm:ss.SSS'Z'")
+    total = (row_id % 100000 / 100).cast('string')
+    return spark.range(rows).select(
+        F.concat(F.lit('4970XXXXXXXX'), F.lpad((row_id % 10000).cast('string'), 4, '0')).alias('cardprivatepan'),
+        F.concat(F.lit('ctx-'), row_id.cast('string')).alias('cardprotransactionid'),
+        F.element_at(F.array(*[F.lit(category) for category in ('restaurant', 'hotel', 'fuel', 'train')]),
+                     (row_id % 4 + 1).cast('int')).alias('category'),
+        timestamp.alias('createdat'),
+        F.lit('EUR').alias('currency'),
+        F.lit('EXPENSE_CREATED').alias('eventtype'),
+        F.concat(F.lit('exp-'), row_id.cast('string')).alias('jenjiexpenseid'),
+        timestamp.alias('lastupdatedat'),
+        F.when(~invalid, F.lit('Le Bistrot')).alias('seller'),
+        F.lit('VALIDATED').alias('state'),
+        (row_id % 2).alias('taxrecoverable'),
+        timestamp.alias('time'),
+        F.when(invalid, F.lit('n/a')).otherwise(total).alias('total'),
+        total.alias('totalwithouttax'),
+    )
+
+
+def run_benchmark(rows, invalid_ratio, partition_keys):
+    job = local_glue.load_glue_job(JOB_NAME)
+    source_config = job.load_source_config(local_glue.JENJI_RULES_CONFIG, job.JENJI_SOURCE_ID)
+    glue_ctx = local_glue.GlueContext()
+    output_dir = tempfile.mkdtemp()
+    try:
+        source_DF = generate_transactions(glue_ctx.spark_session, rows, invalid_ratio).persist()
+        source_DF.count()  # The generation is not measured
+
+        validation_start_tm = time.monotonic()
+        labelled_DF, group_counts, routed_frames = job.validate_transactions(glue_ctx, source_DF, partition_keys,
+                                                                             source_config)
+        validation_elapsed_sec = max(time.monotonic() - validation_start_tm, 1e-6)
+
+        split_start_tm = time.monotonic()
+        valid_sink = glue_ctx.getSink(path=output_dir + '/Validated', partitionKeys=partition_keys)
+        valid_DF = job.repartition_for_write(routed_frames.select('good_records').toDF(), partition_keys,
+                                             group_counts['good_records'],
+                                             job.TARGET_FILE_SIZE_MB * 1024 * 1024 // job.ESTIMATED_ROW_BYTES)
+        valid_sink.writeFrame(local_glue.DynamicFrame.fromDF(valid_DF, glue_ctx, 'good_records'))
+        glue_ctx.write_dynamic_frame.from_options(
+            frame=routed_frames.select('default_group'), connection_type='s3', format='json',
+            connection_options={'path': output_dir + '/Rejected', 'partitionKeys': partition_keys})
+        split_elapsed_sec = max(time.monotonic() - split_start_tm, 1e-6)
+        labelled_DF.unpersist()
+        source_DF.unpersist()
+    finally:
+        shutil.rmtree(output_dir)
+
+    print(f"Rows: {rows} Groups: {group_counts}")
+    print(f"Validation: {validation_elapsed_sec:.1f} sec Rows/sec: {rows / validation_elapsed_sec:.0f}")
+    print(f"Split: {split_elapsed_sec:.1f} sec Rows/sec: {rows / split_elapsed_sec:.0f}")
+    return {'validation_rows_per_sec': rows / validation_elapsed_sec,
+            'split_rows_per_sec': rows / split_elapsed_sec}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=float, default=1.0, help='Millions of synthetic transactions')
+    arg_parser.add_argument('--invalid-ratio', type=float, default=0.1, help='Share of rejected transactions')
+    arg_parser.add_argument('--partition-keys', default='event_date', help='e.g. event_date or year,month,day')
+    cli_args = arg_parser.parse_args()
+    run_benchmark(int(cli_args.rows * 1000000), cli_args.invalid_ratio, cli_args.partition_keys.split(','))
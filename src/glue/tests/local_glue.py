@@ -0,0 +1,249 @@
+"""
+Local stand-ins of the awsglue modules, so that the Glue job scripts run on a local
+Spark session without AWS: the catalog tables are read from local JSON files and
+the sinks write to local directories (s3://bucket/key paths are mapped under s3_root).
+"""
+import importlib.util
+import os
+import shutil
+import sys
+import types
+
+try:
+    from pyspark.sql import SparkSession
+    from pyspark.sql import functions as F
+    from pyspark.sql.types import StructType
+except ImportError:  # The Glue tests are skipped without PySpark
+    SparkSession = None
+
+GLUE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# Rule config of Jenji, shipped to the ok-nok jobs with --extra-files
+JENJI_RULES_CONFIG = os.path.join(GLUE_DIR, 'common', 'jenji.json')
+# Directories of the modules and packages shipped to the jobs with --extra-py-files
+EXTRA_PY_FILES_DIRS = (os.path.join(GLUE_DIR, 'common'),
+                       os.path.join(os.path.dirname(GLUE_DIR), 'lambda', 'wk-xdp-datalake-dlv-s3-trigger'))
+
+
+def is_spark_available():
+    """PySpark is installed and a Java runtime is found"""
+    return SparkSession is not None and bool(os.environ.get('JAVA_HOME') or shutil.which('java'))
+
+
+def get_spark_session():
+    """Local Spark session shared by the tests and benchmarks"""
+    return SparkSession.builder.master('local[*]') \
+        .config('spark.ui.showConsoleProgress', 'false') \
+        .config('spark.sql.shuffle.partitions', '4') \
+        .getOrCreate()
+
+
+class DynamicFrame:
+    """DynamicFrame stand-in wrapping a DataFrame"""
+
+    def __init__(self, data_frame, glue_ctx, name):
+        self.data_frame = data_frame
+        self.glue_ctx = glue_ctx
+        self.name = name
+
+    @classmethod
+    def fromDF(cls, data_frame, glue_ctx, name):
+        return cls(data_frame, glue_ctx, name)
+
+    def toDF(self):
+        return self.data_frame
+
+    def count(self):
+        return self.data_frame.count()
+
+
+class DynamicFrameCollection:
+    """DynamicFrameCollection stand-in: DynamicFrames by name"""
+
+    def __init__(self, dynamic_frames, glue_ctx):
+        self.dynamic_frames = dynamic_frames
+        self.glue_ctx = glue_ctx
+
+    def keys(self):
+        return self.dynamic_frames.keys()
+
+    def select(self, key, transformation_ctx=''):
+        return self.dynamic_frames[key]
+
+
+class DropFields:
+    """DropFields stand-in: top level columns and struct fields (parent.child)"""
+
+    @staticmethod
+    def apply(frame, paths, transformation_ctx=''):
+        data_frame = frame.toDF()
+        for path in paths:
+            parent, _, child = path.partition('.')
+            if parent not in data_frame.columns:
+                continue
+            parent_type = data_frame.schema[parent].dataType
+            if not child or (isinstance(parent_type, StructType) and parent_type.names == [child]):
+                data_frame = data_frame.drop(parent)  # A struct without fields is dropped too
+            elif isinstance(parent_type, StructType):
+                data_frame = data_frame.withColumn(parent, F.col(parent).dropFields(child))
+        return DynamicFrame(data_frame, frame.glue_ctx, frame.name)
+
+
+class SelectFromCollection:
+    """SelectFromCollection stand-in"""
+
+    @staticmethod
+    def apply(dfc, key, transformation_ctx=''):
+        return dfc.select(key, transformation_ctx)
+
+
+class LocalSink:
+    """Glue S3 sink stand-in appending Parquet files to a local directory"""
+
+    def __init__(self, glue_ctx, path, partitionKeys=(), **kwargs):
+        self.glue_ctx = glue_ctx
+        self.path = path
+        self.partition_keys = list(partitionKeys)
+        self.options = kwargs
+        self.catalog_info = None
+        self.format = None
+
+    def setCatalogInfo(self, **catalog_info):
+        self.catalog_info = catalog_info
+
+    def setFormat(self, format_name, **kwargs):
+        self.format = format_name
+
+    def writeFrame(self, dynamic_frame):
+        self.glue_ctx.write_data_frame(dynamic_frame.toDF(), self.path, 'parquet',
+                                       self.partition_keys)
+        return dynamic_frame
+
+
+class _CreateDynamicFrame:
+
+    def __init__(self, glue_ctx):
+        self.glue_ctx = glue_ctx
+
+    def from_catalog(self, database, table_name, transformation_ctx='', push_down_predicate=None,
+                     additional_options=None, **kwargs):
+        """
+        Read the local JSON lines file of the table, an empty frame when there is none,
+        with the attachFilename column of the additional_options
+        """
+        spark = self.glue_ctx.spark_session
+        table_path = self.glue_ctx.catalog_tables.get((database, table_name))
+        if not table_path or not os.path.exists(table_path):
+            data_frame = spark.createDataFrame([], StructType([]))
+        else:
+            data_frame = spark.read.json(table_path)
+            if push_down_predicate:
+                data_frame = data_frame.filter(push_down_predicate)
+            if (additional_options or {}).get('attachFilename'):
+                data_frame = data_frame.withColumn(additional_options['attachFilename'], F.input_file_name())
+        self.glue_ctx.read_tables.append((database, table_name, transformation_ctx))
+        return DynamicFrame(data_frame, self.glue_ctx, table_name)
+
+
+class _WriteDynamicFrame:
+
+    def __init__(self, glue_ctx):
+        self.glue_ctx = glue_ctx
+
+    def from_options(self, frame, connection_type='s3', format='json',
+                     connection_options=None, transformation_ctx='', **kwargs):
+        connection_options = connection_options or {}
+        self.glue_ctx.write_data_frame(frame.toDF(), connection_options['path'], format,
+                                       connection_options.get('partitionKeys', []))
+        return frame
+
+
+class GlueContext:
+    """GlueContext stand-in on a local Spark session"""
+
+    def __init__(self, spark_context=None, catalog_tables=None, s3_root=None):
+        self.spark_session = get_spark_session()
+        self.catalog_tables = dict(catalog_tables or {})  # (database, table_name): JSON path
+        self.s3_root = s3_root
+        self.read_tables = []  # (database, table_name, transformation_ctx)
+        self.written_paths = []  # (local path, format)
+        self.create_dynamic_frame = _CreateDynamicFrame(self)
+        self.write_dynamic_frame = _WriteDynamicFrame(self)
+
+    def get_local_path(self, path):
+        """Local directory of an s3://bucket/key path, other paths are kept"""
+        if path.startswith('s3://'):
+            if not self.s3_root:
+                raise ValueError(f'No s3_root to write {path} locally')
+            return os.path.join(self.s3_root, path[len('s3://'):])
+        return path
+
+    def getSink(self, path, connection_type='s3', **kwargs):
+        return LocalSink(self, path, **kwargs)
+
+    def write_data_frame(self, data_frame, path, format_name, partition_keys):
+        local_path = self.get_local_path(path)
+        writer = data_frame.write.mode('append')
+        if partition_keys:
+            writer = writer.partitionBy(*partition_keys)
+        writer.format('json' if format_name == 'json' else 'parquet').save(local_path)
+        self.written_paths.append((local_path, format_name))
+
+
+class Job:
+    """Job stand-in, job bookmarks are not kept"""
+
+    def __init__(self, glue_ctx):
+        self.glue_ctx = glue_ctx
+        self.committed = False
+
+    def init(self, job_name, args):
+        self.committed = False
+
+    def commit(self):
+        self.committed = True
+
+
+def getResolvedOptions(argv, options):
+    """Resolve the --option value arguments, a missing one fails as with awsglue"""
+    resolved = {}
+    for option in options:
+        if '--' + option not in argv[:-1]:
+            raise ValueError(f'Missing argument --{option}')
+        resolved[option] = argv[argv.index('--' + option) + 1]
+    return resolved
+
+
+def install_awsglue():
+    """Register the stand-ins as the awsglue modules imported by the job scripts"""
+    modules = {
+        'awsglue': {},
+        'awsglue.transforms': {'DropFields': DropFields,
+                               'SelectFromCollection': SelectFromCollection,
+                               '__all__': ['DropFields', 'SelectFromCollection']},
+        'awsglue.utils': {'getResolvedOptions': getResolvedOptions},
+        'awsglue.context': {'GlueContext': GlueContext},
+        'awsglue.job': {'Job': Job},
+        'awsglue.dynamicframe': {'DynamicFrame': DynamicFrame,
+                                 'DynamicFrameCollection': DynamicFrameCollection},
+    }
+    for module_name, attributes in modules.items():
+        module = types.ModuleType(module_name)
+        module.__dict__.update(attributes)
+        sys.modules[module_name] = module
+
+
+def load_glue_job(job_name):
+    """
+    Import a Glue job script (src/glue/<job_name>/<job_name>.py) as a module,
+    its main() is not run, the --extra-py-files packages are importable
+    """
+    install_awsglue()
+    for extra_py_files_dir in EXTRA_PY_FILES_DIRS:
+        if extra_py_files_dir not in sys.path:
+            sys.path.append(extra_py_files_dir)
+    spec = importlib.util.spec_from_file_location(
+        job_name.replace('-', '_'), os.path.join(GLUE_DIR, job_name, job_name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import local_glue
+
+JOB_NAME = 'wk-glue-job-bronze-backfill-jenji-v2'
+
+
+# -----------------------------------------------------------------------------
+@unittest.skipUnless(local_glue.is_spark_available(), 'PySpark and Java are required')
+class TestBackfillJenji(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job = local_glue.load_glue_job(JOB_NAME)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.v1_path = os.path.join(self.tmp_dir, 'Validated', 'v1')
+        self.rejected_path = os.path.join(self.tmp_dir, 'Rejected')
+        self.source_config = {**self.job.load_source_config(local_glue.JENJI_RULES_CONFIG, self.job.JENJI_SOURCE_ID),
+                              'validated_path': os.path.join(self.tmp_dir, 'Validated', 'v2')}
+        self.glue_ctx = local_glue.GlueContext()
+        self.spark = self.glue_ctx.spark_session
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_v1(self):
+        """
+        v1 layout of the valid fixture rows, as strings: 6466a1 and 6466a2 unpartitioned at the root,
+        6466a5 and 6466a6 in event date partitions, with an impossible date in 6466a2
+        """
+        with open(os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json'), encoding='utf-8') as fixture:
+            rows = [json.loads(row) for row in fixture]
+        for row in rows:
+            if row['_id']['oid'] == '6466a2':
+                row['lastupdatedat'] = '2023-02-30T10:00:00.000Z'
+        rows_path = os.path.join(self.tmp_dir, 'rows.json')
+        with open(rows_path, 'w', encoding='utf-8') as rows_file:
+            rows_file.writelines(json.dumps(row) + '\n' for row in rows)
+        v1_DF = self.spark.read.json(rows_path)
+        v1_DF = v1_DF.withColumn('taxrecoverable', v1_DF['taxrecoverable'].cast('string'))
+        v1_DF.filter("_id.oid IN ('6466a1', '6466a2')").drop('_id').write.parquet(self.v1_path)
+        v1_DF.filter("_id.oid IN ('6466a5', '6466a6')").drop('_id') \
+            .withColumn('event_date', v1_DF['createdat'].substr(1, 10)) \
+            .write.mode('append').partitionBy('event_date').parquet(self.v1_path)
+
+    def test_run_job(self):
+        self.write_v1()
+        row_counts = self.job.run_job(self.glue_ctx, self.source_config, self.v1_path, self.rejected_path)
+        self.assertEqual({'valid_records': 3, 'rejected_records': 1}, row_counts)
+
+        validated_path = self.source_config['validated_path']
+        self.assertEqual(['event_date=2023-05-01', 'event_date=2023-05-03'],
+                         sorted(name for name in os.listdir(validated_path) if not name.startswith(('_', '.'))))
+        v2_DF = self.spark.read.parquet(validated_path)
+        self.assertEqual(3, v2_DF.count())
+        self.assertEqual('timestamp', dict(v2_DF.dtypes)['lastupdatedat'])
+        self.assertEqual('decimal(18,4)', dict(v2_DF.dtypes)['total'])
+        rejected_rows = self.spark.read.json(self.rejected_path).collect()
+        self.assertEqual([['lastupdatedat_iso_timestamp']], [row['rejected_rules'] for row in rejected_rows])
+
+    def test_run_job_existing_v2_refused(self):
+        self.write_v1()
+        self.job.run_job(self.glue_ctx, self.source_config, self.v1_path, self.rejected_path)
+        with self.assertRaises(Exception):
+            self.job.run_job(self.glue_ctx, self.source_config, self.v1_path, self.rejected_path)
+        self.assertEqual(3, self.spark.read.parquet(self.source_config['validated_path']).count())
@@ -0,0 +1,115 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import local_glue
+
+JOB_NAME = 'wk-glue-job-bronze-compact-jenji-v1'
+TARGET_FILE_SIZE = 128 * 1024 * 1024
+
+
+# -----------------------------------------------------------------------------
+@unittest.skipUnless(local_glue.is_spark_available(), 'PySpark and Java are required')
+class TestCompactJenji(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job = local_glue.load_glue_job(JOB_NAME)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.table_path = os.path.join(self.tmp_dir, 'Validated') + '/'
+        self.staging_path = os.path.join(self.tmp_dir, 'Compacting') + '/'
+        self.spark = local_glue.get_spark_session()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_rows(self, event_date, rows, num_files):
+        """Append rows to the event_date partition as num_files small files"""
+        self.spark.createDataFrame([(f'exp-{event_date}-{idx}', event_date) for idx in range(rows)],
+                                   ['jenjiexpenseid', 'event_date']) \
+            .repartition(num_files).write.mode('append').partitionBy('event_date').parquet(self.table_path)
+
+    def list_parquet_files(self, event_date):
+        partition_path = os.path.join(self.table_path, f'event_date={event_date}')
+        return sorted(name for name in os.listdir(partition_path) if name.endswith('.parquet'))
+
+    def test_select_partitions_to_compact(self):
+        partition_files = {
+            's3://bucket/t/event_date=2023-05-01/': [('f', 10)] * 5,
+            's3://bucket/t/event_date=2023-05-03/': [('f', 10)] * 5,  # Still open
+            's3://bucket/t/year=2023/month=05/day=01/': [('f', 10)] * 5,
+            's3://bucket/t/event_date=2023-04-30/': [('f', TARGET_FILE_SIZE)] * 5,  # Large files
+            's3://bucket/t/region=eu/': [('f', 10)] * 5,  # No date
+        }
+        self.assertEqual({'s3://bucket/t/event_date=2023-05-01/': 1,
+                          's3://bucket/t/year=2023/month=05/day=01/': 1},
+                         self.job.select_partitions_to_compact(partition_files, TARGET_FILE_SIZE, 4,
+                                                               datetime.date(2023, 5, 2)))
+
+    def test_run_job_closed_partitions_only(self):
+        self.write_rows('2023-05-01', 20, 4)
+        self.write_rows('2023-05-03', 20, 4)
+        compacted = self.job.run_job(self.spark, self.table_path, self.staging_path, TARGET_FILE_SIZE, 1,
+                                     datetime.date(2023, 5, 2))
+
+        self.assertEqual([1], list(compacted.values()))
+        self.assertEqual(1, len(self.list_parquet_files('2023-05-01')))
+        self.assertEqual(4, len(self.list_parquet_files('2023-05-03')))
+        self.assertEqual(40, self.spark.read.parquet(self.table_path).count())
+        self.assertFalse(os.path.exists(os.path.join(self.staging_path, 'event_date=2023-05-01')))
+
+    def test_compact_partition_keeps_files_written_meanwhile(self):
+        self.write_rows('2023-05-01', 20, 4)
+        partition_path, files = next(iter(self.job.list_partition_files(self.spark, self.table_path).items()))
+        self.write_rows('2023-05-01', 5, 1)  # Written by another job after the listing
+
+        self.job.compact_partition(self.spark, partition_path, [file_path for file_path, _ in files],
+                                   self.staging_path, 1)
+        self.assertEqual(2, len(self.list_parquet_files('2023-05-01')))
+        self.assertEqual(25, self.spark.read.parquet(self.table_path).count())
+
+    def stage_partition(self, event_date, num_files):
+        """Stage the compaction of a partition with its manifest, as a run interrupted before the moves"""
+        partition_path, files = next(iter(self.job.list_partition_files(self.spark, self.table_path).items()))
+        staging_path = self.staging_path + f'event_date={event_date}/'
+        file_paths = [file_path for file_path, _ in files]
+        self.spark.read.parquet(*file_paths).repartition(num_files).write.parquet(staging_path)
+        self.job.write_manifest(self.spark, staging_path, partition_path, file_paths)
+        return staging_path
+
+    def test_run_job_finishes_interrupted_compaction(self):
+        self.write_rows('2023-05-01', 20, 4)
+        staging_path = self.stage_partition('2023-05-01', 2)
+        # Interrupted after moving one of the staged files: its rows are in the table twice
+        staged_name = sorted(name for name in os.listdir(staging_path) if name.endswith('.parquet'))[0]
+        os.rename(os.path.join(staging_path, staged_name),
+                  os.path.join(self.table_path, 'event_date=2023-05-01', staged_name))
+        self.assertLess(20, self.spark.read.parquet(self.table_path).count())
+
+        self.job.run_job(self.spark, self.table_path, self.staging_path, TARGET_FILE_SIZE, 4,
+                         datetime.date(2023, 5, 2))
+        self.assertEqual(2, len(self.list_parquet_files('2023-05-01')))
+        self.assertEqual(20, self.spark.read.parquet(self.table_path).count())
+        self.assertFalse(os.path.exists(self.staging_path))
+
+    def test_run_job_drops_staged_files_without_manifest(self):
+        self.write_rows('2023-05-01', 20, 4)
+        # Interrupted while staging: the table is untouched, the staged copy is dropped
+        self.spark.read.parquet(self.table_path).coalesce(1).write.parquet(self.staging_path + 'event_date=2023-05-01/')
+        self.job.run_job(self.spark, self.table_path, self.staging_path, TARGET_FILE_SIZE, 4,
+                         datetime.date(2023, 5, 2))
+        self.assertEqual(4, len(self.list_parquet_files('2023-05-01')))
+        self.assertEqual(20, self.spark.read.parquet(self.table_path).count())
+        self.assertFalse(os.path.exists(self.staging_path))
+
+    def test_get_active_job_run_ids(self):
+        with patch('ok_nok_common.boto3') as mock_boto:
+            mock_boto.client.return_value.get_job_runs.return_value = {'JobRuns': [
+                {'Id': 'jr_1', 'JobRunState': 'RUNNING'}, {'Id': 'jr_2', 'JobRunState': 'SUCCEEDED'}]}
+            self.assertEqual(['jr_1'], self.job.get_active_job_run_ids(self.job.MERGE_JOB_NAME))
+        mock_boto.client.return_value.get_job_runs.assert_called_once_with(
+            JobName='wk-glue-job-bronze-ok-nok-jenji-v1', MaxResults=50)
@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import local_glue
+
+JOB_NAME = 'wk-glue-job-bronze-mvsel2val-jenji-v1'
+
+
+# -----------------------------------------------------------------------------
+class TestMvSel2ValJenji(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job = local_glue.load_glue_job(JOB_NAME)
+
+    def test_select_keys_from_to(self):
+        source_allow_list = self.job.aws_utils.parse_source_id_list('{"Jenji": {"target_prefix": "JenjiV1"}}')
+        candidate_s3_keys = [
+            {'Key': 'DL/ArrivalHub/PendingSelection/Jenji/1.json', 'Size': 10,
+             'LastModified': datetime(2023, 5, 2, 1, 30, tzinfo=timezone(timedelta(hours=2)))},
+            {'Key': 'DL/ArrivalHub/PendingSelection/Jenji/2.csv', 'Size': 20},
+            {'Key': 'DL/ArrivalHub/PendingSelection/Other/3.json', 'Size': 30},
+        ]
+        selection_stats = self.job.new_selection_stats()
+        expected = [('DL/ArrivalHub/PendingSelection/Jenji/1.json',
+                     'DL/ArrivalHub/PendingValidations/JenjiV1/ingestion_date=2023-05-01/1.json', 10)]
+        self.assertEqual(expected, list(self.job.select_keys_from_to(
+            candidate_s3_keys, source_allow_list, 'bucket_name', 'DL/ArrivalHub/PendingValidations/',
+            selection_stats=selection_stats)))
+        self.assertEqual({'Candidates': 3, 'Selected': 1, 'Ignored': 2,
+                          'Bytes': {'DL/ArrivalHub/PendingSelection/Jenji/1.json': 10}}, selection_stats)
+
+    def test_select_keys_from_to_placeholder_tagged(self):
+        source_allow_list = self.job.aws_utils.parse_source_id_list('Jenji')
+        candidate_s3_keys = [{'Key': 'DL/ArrivalHub/PendingSelection/Jenji/PlaceHolder.json', 'Size': 0}]
+        with patch.object(self.job.aws_utils, 'put_s3_key_tag') as mock_put_s3_key_tag:
+            self.assertEqual([], list(self.job.select_keys_from_to(candidate_s3_keys, source_allow_list,
+                                                                   'bucket_name')))
+        mock_put_s3_key_tag.assert_called_once_with(
+            'bucket_name', 'DL/ArrivalHub/PendingSelection/Jenji/PlaceHolder.json',
+            'ProcessStatus', 'PendingValidations')
+
+    def test_select_keys_from_to_invalid_prefixes(self):
+        source_allow_list = self.job.aws_utils.parse_source_id_list('Jenji')
+        selection_stats = self.job.new_selection_stats()
+        candidate_s3_keys = [{'Key': 'Jenji/1.json'}, {'Key': 'DL/ArrivalHub/PendingSelection/Jenji/2.json'}]
+        self.assertEqual(['DL/ArrivalHub/PendingSelection/Jenji/2.json'],
+                         [key_from for key_from, _, _ in self.job.select_keys_from_to(
+                             candidate_s3_keys, source_allow_list, selection_stats=selection_stats)])
+        self.assertEqual((2, 1, 1), (selection_stats['Candidates'], selection_stats['Selected'],
+                                     selection_stats['Ignored']))
+
+    def test_run_job(self):
+        source_allow_list = self.job.aws_utils.parse_source_id_list('Jenji')
+        candidate_s3_keys = [{'Key': 'DL/ArrivalHub/PendingSelection/Jenji/1.json', 'Size': 10},
+                             {'Key': 'DL/ArrivalHub/PendingSelection/Jenji/2.json', 'Size': 20}]
+
+        def move_s3_keys(bucket_name, keys_from_to, tag_updates=None, max_workers=None):
+            keys_from_to = list(keys_from_to)
+            return [keys_from_to[0][0]], {keys_from_to[1][0]: 'AccessDenied'}
+
+        with patch.object(self.job.aws_utils, 'get_source_allow_list', return_value=source_allow_list), \
+                patch.object(self.job.aws_utils, 'iter_s3_key_older_than_by_prefix',
+                             return_value=iter(candidate_s3_keys)) as mock_iter_s3_keys, \
+                patch.object(self.job.aws_utils, 'move_s3_keys_from_to_location',
+                             side_effect=move_s3_keys) as mock_move_s3_keys:
+            result = self.job.run_job('bucket_name', 'DL/ArrivalHub/PendingSelection/',
+                                      'DL/ArrivalHub/PendingValidations/', minutes_ago=5)
+        mock_iter_s3_keys.assert_called_once_with('bucket_name', 'DL/ArrivalHub/PendingSelection/',
+                                                  minutes_ago=5, max_workers=None, max_keys_per_prefix=None)
+        self.assertEqual({'ProcessStatus': 'PendingValidations'}, mock_move_s3_keys.call_args[1]['tag_updates'])
+        self.assertEqual(['DL/ArrivalHub/PendingSelection/Jenji/1.json'], result['moved_keys'])
+        self.assertEqual({'DL/ArrivalHub/PendingSelection/Jenji/2.json': 'AccessDenied'}, result['failed_keys'])
+        self.assertEqual(2, result['selection_stats']['Selected'])
@@ -0,0 +1,136 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import local_glue
+
+JOB_NAME = 'wk-glue-job-bronze-ok-nok-generic-v1'
+JENJI_CONFIG_PATH = local_glue.JENJI_RULES_CONFIG
+RAW_TABLE = ('wk-glue-data-catalog-arrivalhub', 'tb_transaction_raw_pendval_jenji')
+
+
+# -----------------------------------------------------------------------------
+@unittest.skipUnless(local_glue.is_spark_available(), 'PySpark and Java are required')
+class TestOkNokGenericConfig(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job = local_glue.load_glue_job(JOB_NAME)
+
+    def test_load_source_configs_jenji(self):
+        source_configs = self.job.load_source_configs(JENJI_CONFIG_PATH)
+        self.assertEqual(['jenji'], [config['source_id'] for config in source_configs])
+        self.assertIsNone(source_configs[0]['push_down_predicate'])
+        # The same config drives the Jenji job
+        jenji_job = local_glue.load_glue_job('wk-glue-job-bronze-ok-nok-jenji-v1')
+        self.assertEqual(source_configs[0], jenji_job.load_source_config(JENJI_CONFIG_PATH, jenji_job.JENJI_SOURCE_ID))
+        with self.assertRaises(ValueError):
+            jenji_job.load_source_config(JENJI_CONFIG_PATH, 'expensya')
+
+    def test_parse_source_configs_missing_keys(self):
+        with self.assertRaises(ValueError):
+            self.job.parse_source_configs('[{"source_id": "jenji", "database": "db"}]')
+
+    def test_get_source_push_down_predicate(self):
+        source_configs = self.job.parse_source_configs("""[
+            {"source_id": "a", "database": "db", "table_name": "a", "rules": [], "validated_path": "v",
+             "rejected_path": "r", "ingestion_partition_column": "ingestion_date"},
+            {"source_id": "b", "database": "db", "table_name": "b", "rules": [], "validated_path": "v",
+             "rejected_path": "r", "ingestion_partition_column": "dt"},
+            {"source_id": "c", "database": "db", "table_name": "c", "rules": [], "validated_path": "v",
+             "rejected_path": "r", "push_down_predicate": "region = 'eu'"},
+            {"source_id": "d", "database": "db", "table_name": "d", "rules": [], "validated_path": "v",
+             "rejected_path": "r"}]""")
+        utc_today = datetime.date(2023, 5, 10)
+        self.assertEqual(["ingestion_date >= '2023-05-08'", "dt >= '2023-05-08'", "region = 'eu'", None],
+                         [self.job.get_source_push_down_predicate(config, '2', utc_today)
+                          for config in source_configs])
+
+
+    def test_put_count_metrics_error_logged(self):
+        import ok_nok_common  # pylint: disable=C0415 (importable once the job is loaded)
+        from botocore.exceptions import ClientError  # pylint: disable=C0415
+        with patch('ok_nok_common.boto3') as mock_boto:
+            mock_boto.client.return_value.put_metric_data.side_effect = ClientError(
+                {'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'PutMetricData')
+            ok_nok_common.put_count_metrics('RoutedRows', {'JobName': 'job'}, 'Group', {'ok': 1})
+        mock_boto.client.return_value.put_metric_data.assert_called_once()
+
+# -----------------------------------------------------------------------------
+@unittest.skipUnless(local_glue.is_spark_available(), 'PySpark and Java are required')
+class TestOkNokGeneric(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job = local_glue.load_glue_job(JOB_NAME)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.validated_path = os.path.join(self.tmp_dir, 'Validated')
+        self.rejected_path = os.path.join(self.tmp_dir, 'Rejected')
+        self.processed_files_path = os.path.join(self.tmp_dir, 'ProcessedFiles', 'jenji')
+        self.raw_path = os.path.join(self.tmp_dir, 'Raw')
+        os.makedirs(self.raw_path)
+        shutil.copy(os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json'), self.raw_path)
+        self.glue_ctx = local_glue.GlueContext(catalog_tables={RAW_TABLE: self.raw_path})
+        self.spark = self.glue_ctx.spark_session
+        self.source_config = {**self.job.load_source_configs(JENJI_CONFIG_PATH)[0],
+                              'validated_path': self.validated_path, 'rejected_path': self.rejected_path}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_validate_source_jenji(self):
+        row_counts = self.job.validate_source(self.glue_ctx, self.source_config, rows_per_file=1000)
+        self.assertEqual({'valid_records': 4, 'rejected_records': 2}, row_counts)
+
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(4, valid_DF.count())
+        self.assertEqual('decimal(18,4)', dict(valid_DF.dtypes)['total'])
+        self.assertNotIn('_id', valid_DF.columns)
+        self.assertNotIn('rejected_rules', valid_DF.columns)
+        rejected_DF = self.spark.read.json(self.rejected_path)
+        self.assertEqual(2, rejected_DF.count())
+        self.assertIn('rejected_rules', rejected_DF.columns)
+
+    def test_validate_source_metrics(self):
+        with patch('ok_nok_common.boto3') as mock_boto:
+            self.job.validate_source(self.glue_ctx, self.source_config,
+                                     metric_dimensions={'JobName': 'ok-nok-generic'})
+        metric_data = [datum for call in mock_boto.client.return_value.put_metric_data.call_args_list
+                       for datum in call[1]['MetricData']]
+        self.assertIn({'MetricName': 'RoutedRows', 'Unit': 'Count', 'Value': 2,
+                       'Dimensions': [{'Name': 'JobName', 'Value': 'ok-nok-generic'},
+                                      {'Name': 'Source', 'Value': 'jenji'},
+                                      {'Name': 'Group', 'Value': 'rejected_records'}]}, metric_data)
+        self.assertIn({'MetricName': 'RuleFailures', 'Unit': 'Count', 'Value': 1,
+                       'Dimensions': [{'Name': 'JobName', 'Value': 'ok-nok-generic'},
+                                      {'Name': 'Source', 'Value': 'jenji'},
+                                      {'Name': 'Rule', 'Value': 'seller_not_null'}]}, metric_data)
+
+    def test_validate_source_no_new_data(self):
+        self.glue_ctx.catalog_tables.clear()
+        self.assertEqual({'valid_records': 0, 'rejected_records': 0},
+                         self.job.validate_source(self.glue_ctx, self.source_config))
+
+    def test_validate_source_rerun_skips_processed_files(self):
+        self.job.validate_source(self.glue_ctx, self.source_config,
+                                 processed_files_path=self.processed_files_path)
+        # Rerun before the job bookmarks are committed, e.g. after the failure of another source
+        self.assertEqual({'valid_records': 0, 'rejected_records': 0},
+                         self.job.validate_source(self.glue_ctx, self.source_config,
+                                                  processed_files_path=self.processed_files_path))
+        self.assertEqual(4, self.spark.read.parquet(self.validated_path).count())
+        self.assertEqual(2, self.spark.read.json(self.rejected_path).count())
+
+        # A file delivered meanwhile is still validated by the rerun
+        shutil.copy(os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json'),
+                    os.path.join(self.raw_path, 'jenji_transactions_2.json'))
+        self.assertEqual({'valid_records': 4, 'rejected_records': 2},
+                         self.job.validate_source(self.glue_ctx, self.source_config,
+                                                  processed_files_path=self.processed_files_path))
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(8, valid_DF.count())
+        self.assertNotIn('_input_file', valid_DF.columns)
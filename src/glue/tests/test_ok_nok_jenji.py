@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import local_glue
+
+JOB_NAME = 'wk-glue-job-bronze-ok-nok-jenji-v1'
+RAW_TABLE = ('wk-glue-data-catalog-arrivalhub', 'tb_transaction_raw_pendval_jenji')
+
+
+# -----------------------------------------------------------------------------
+@unittest.skipUnless(local_glue.is_spark_available(), 'PySpark and Java are required')
+class TestOkNokJenji(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job = local_glue.load_glue_job(JOB_NAME)
+        cls.source_config = cls.job.load_source_config(local_glue.JENJI_RULES_CONFIG, cls.job.JENJI_SOURCE_ID)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.validated_path = os.path.join(self.tmp_dir, 'Validated')
+        self.rejected_path = os.path.join(self.tmp_dir, 'Rejected')
+        self.glue_ctx = local_glue.GlueContext(
+            catalog_tables={RAW_TABLE: os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json')})
+        self.spark = self.glue_ctx.spark_session
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_job(self, **kwargs):
+        return self.job.run_job(self.glue_ctx, self.source_config, validated_path=self.validated_path,
+                                rejected_path=self.rejected_path,
+                                merge_staging_path=os.path.join(self.tmp_dir, 'Merging'), **kwargs)
+
+    def write_stale_rows(self):
+        """JSON file of the first version of exp-001, older than the one in the fixture"""
+        with open(os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json'), encoding='utf-8') as fixture:
+            stale_rows = [row for row in fixture if '"exp-001"' in row and 'EXPENSE_CREATED' in row]
+        stale_path = os.path.join(self.tmp_dir, 'stale.json')
+        with open(stale_path, 'w', encoding='utf-8') as stale_file:
+            stale_file.writelines(stale_rows)
+        return stale_path
+
+    def test_validate_frame_rejected_rules(self):
+        source_DF = self.spark.read.json(os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json'))
+        rows = self.job.validate_frame(source_DF, self.source_config['rules']).collect()
+        rejected_rules = {row['_id']['oid']: sorted(row['rejected_rules']) for row in rows}
+        self.assertEqual(['total_decimal'], rejected_rules['6466a3'])
+        self.assertEqual(['seller_not_null', 'taxrecoverable_range'], rejected_rules['6466a4'])
+        self.assertEqual(4, sum(row['_is_valid'] for row in rows))
+
+    def write_invalid_date_rows(self):
+        """JSON file of the fixture, with impossible dates in two valid rows (6466a2 and 6466a6)"""
+        with open(os.path.join(local_glue.FIXTURES_DIR, 'jenji_transactions.json'), encoding='utf-8') as fixture:
+            rows = [json.loads(row) for row in fixture]
+        for row in rows:
+            if row['_id']['oid'] == '6466a2':
+                row['createdat'] = '2023-13-45T10:00:00.000Z'
+            elif row['_id']['oid'] == '6466a6':
+                row['lastupdatedat'] = '2023-02-30T10:00:00.000Z'
+        invalid_date_path = os.path.join(self.tmp_dir, 'invalid_dates.json')
+        with open(invalid_date_path, 'w', encoding='utf-8') as invalid_date_file:
+            invalid_date_file.writelines(json.dumps(row) + '\n' for row in rows)
+        return invalid_date_path
+
+    def test_validate_frame_invalid_dates(self):
+        source_DF = self.spark.read.json(self.write_invalid_date_rows())
+        rows = self.job.validate_frame(source_DF, self.source_config['rules']).collect()
+        rejected_rules = {row['_id']['oid']: sorted(row['rejected_rules']) for row in rows}
+        self.assertEqual(['createdat_iso_timestamp'], rejected_rules['6466a2'])
+        self.assertEqual(['lastupdatedat_iso_timestamp'], rejected_rules['6466a6'])
+
+    def test_add_event_date_column_invalid_date(self):
+        source_DF = self.spark.createDataFrame([('2023-02-30T10:00:00.000Z', '2023-03-01T10:00:00.000Z')],
+                                               ['createdat', 'time'])
+        row = self.job.add_event_date_column(source_DF, self.source_config['event_date_columns']).collect()[0]
+        self.assertEqual('2023-03-01', row['event_date'])
+
+    def test_rules_cast_to_target_schema(self):
+        rule_casts = {rule['column']: rule.get('cast') for rule in self.source_config['rules']}
+        for column, dtype in self.source_config['target_schema'].items():
+            self.assertEqual(dtype, rule_casts.get(column), column)
+
+    def test_run_job_invalid_dates_rejected(self):
+        self.glue_ctx.catalog_tables[RAW_TABLE] = self.write_invalid_date_rows()
+        result = self.run_job()
+        self.assertEqual({'good_records': 2, 'default_group': 4}, result['group_counts'])
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(0, valid_DF.filter('createdat IS NULL OR lastupdatedat IS NULL').count())
+        self.assertEqual(4, self.spark.read.json(self.rejected_path).count())
+
+    def test_run_job_no_new_data(self):
+        self.glue_ctx.catalog_tables.clear()
+        self.assertIsNone(self.run_job())
+
+    def test_run_job_valid_and_rejected(self):
+        result = self.run_job()
+        self.assertEqual({'good_records': 4, 'default_group': 2}, result['group_counts'])
+        self.assertEqual(1, result['rule_failures']['seller_not_null'])
+
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(4, valid_DF.count())
+        self.assertEqual('decimal(18,4)', dict(valid_DF.dtypes)['total'])
+        self.assertEqual('timestamp', dict(valid_DF.dtypes)['createdat'])
+        self.assertNotIn('_id', valid_DF.columns)
+        self.assertNotIn('rejected_rules', valid_DF.columns)
+
+        rejected_DF = self.spark.read.json(self.rejected_path)
+        self.assertEqual(2, rejected_DF.count())
+        self.assertIn('rejected_rules', rejected_DF.columns)
+        self.assertEqual(['event_date=2023-05-02'], [name for name in os.listdir(self.rejected_path)
+                                                     if name.startswith('event_date=')])
+
+    def test_run_job_metrics(self):
+        with patch('ok_nok_common.boto3') as mock_boto:
+            self.run_job(metric_dimensions={'JobName': 'ok-nok-jenji'})
+        put_metric_data = mock_boto.client.return_value.put_metric_data
+        metric_data = [datum for call in put_metric_data.call_args_list for datum in call[1]['MetricData']]
+        metrics = {(datum['MetricName'], datum['Dimensions'][1]['Value']): datum['Value'] for datum in metric_data}
+        self.assertEqual(4, metrics[('RoutedRows', 'good_records')])
+        self.assertEqual(2, metrics[('RoutedRows', 'default_group')])
+        self.assertEqual(1, metrics[('RuleFailures', 'seller_not_null')])
+        self.assertEqual(0, metrics[('RuleFailures', 'category_not_null')])
+        self.assertEqual({'Name': 'JobName', 'Value': 'ok-nok-jenji'}, metric_data[0]['Dimensions'][0])
+        self.assertEqual({'DataLake/ArrivalHub'}, {call[1]['Namespace'] for call in put_metric_data.call_args_list})
+
+    def test_run_job_year_month_day_partitions(self):
+        self.run_job(partition_keys=['year', 'month', 'day'])
+        self.assertEqual(['year=2023'], [name for name in os.listdir(self.validated_path)
+                                         if name.startswith('year=')])
+        self.assertEqual(['day=01', 'day=03'], sorted(
+            os.listdir(os.path.join(self.validated_path, 'year=2023', 'month=05'))))
+
+    def test_run_job_dedupe(self):
+        result = self.run_job(dedupe=True)
+        self.assertEqual(4, result['group_counts']['good_records'])
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(3, valid_DF.count())
+        latest = valid_DF.filter("jenjiexpenseid = 'exp-001'").collect()[0]
+        self.assertEqual('EXPENSE_UPDATED', latest['eventtype'])
+
+    def test_run_job_dedupe_late_redelivery(self):
+        self.run_job(dedupe=True)
+        self.glue_ctx.catalog_tables[RAW_TABLE] = self.write_stale_rows()  # Years after the event date
+        result = self.run_job(dedupe=True)
+        self.assertEqual(1, result['group_counts']['good_records'])
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(3, valid_DF.count())
+        self.assertEqual(['EXPENSE_UPDATED'], [row['eventtype'] for row in
+                                               valid_DF.filter("jenjiexpenseid = 'exp-001'").collect()])
+
+    def test_run_job_dedupe_unpartitioned_files_ignored(self):
+        self.spark.createDataFrame([('exp-001',)], ['jenjiexpenseid']).write.parquet(self.validated_path)
+        self.run_job(dedupe=True)  # Old files at the root are not a partition of the batch
+        self.assertEqual(3, self.spark.read.parquet(os.path.join(self.validated_path, 'event_date=2023-05-01'),
+                                                    os.path.join(self.validated_path, 'event_date=2023-05-03'))
+                         .count())
+
+    def test_run_job_merge(self):
+        self.run_job(write_mode='merge')
+        self.run_job(write_mode='merge')  # Re-delivery of the same batch
+        valid_DF = self.spark.read.parquet(self.validated_path)
+        self.assertEqual(3, valid_DF.count())
+        self.assertEqual(3, valid_DF.select('jenjiexpenseid').distinct().count())
+
+    def test_run_job_merge_rows_per_file(self):
+        self.run_job(write_mode='merge', rows_per_file=1)
+        self.run_job(write_mode='merge', rows_per_file=1)  # The rewritten partitions keep the file sizing
+        partition_path = os.path.join(self.validated_path, 'event_date=2023-05-01')
+        self.assertEqual(2, len([name for name in os.listdir(partition_path) if name.endswith('.parquet')]))
+        self.assertEqual(2, self.spark.read.parquet(partition_path).count())
+
+    def test_run_job_merge_out_of_order(self):
+        stale_path = self.write_stale_rows()
+        for dedupe in (False, True):
+            with self.subTest(dedupe=dedupe):
+                self.validated_path = os.path.join(self.tmp_dir, f'Validated-{dedupe}')
+                self.glue_ctx.catalog_tables[RAW_TABLE] = os.path.join(local_glue.FIXTURES_DIR,
+                                                                       'jenji_transactions.json')
+                self.run_job(write_mode='merge', dedupe=dedupe)
+                self.glue_ctx.catalog_tables[RAW_TABLE] = stale_path  # Older version delivered late
+                self.run_job(write_mode='merge', dedupe=dedupe)
+
+                valid_DF = self.spark.read.parquet(self.validated_path)
+                self.assertEqual(3, valid_DF.count())
+                latest = valid_DF.filter("jenjiexpenseid = 'exp-001'").collect()
+                self.assertEqual(['EXPENSE_UPDATED'], [row['eventtype'] for row in latest])
+
+    def test_run_job_rows_per_file(self):
+        self.run_job(rows_per_file=1)
+        partition_path = os.path.join(self.validated_path, 'event_date=2023-05-01')
+        self.assertEqual(3, len([name for name in os.listdir(partition_path) if name.endswith('.parquet')]))
+        self.assertEqual(3, self.spark.read.parquet(partition_path).count())
+
+    def test_run_job_merge_unpartitioned_files_ignored(self):
+        self.spark.createDataFrame([('exp-001',)], ['jenjiexpenseid']).write.parquet(self.validated_path)
+        self.run_job(write_mode='merge')
+        self.run_job(write_mode='merge')  # Merged into the partitions, not appended next to the old files
+        valid_DF = self.spark.read.parquet(os.path.join(self.validated_path, 'event_date=2023-05-01'),
+                                           os.path.join(self.validated_path, 'event_date=2023-05-03'))
+        self.assertEqual(3, valid_DF.count())
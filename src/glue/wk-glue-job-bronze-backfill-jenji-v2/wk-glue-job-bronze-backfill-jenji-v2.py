@@ -0,0 +1,157 @@
+"""
+One-off backfill of the validated Jenji table v1 into v2.
+v1 (Validated/Jenji/v1/, tb_transaction_raw_valid_jenji_v1) holds string columns,
+written unpartitioned at the root then in event date partitions. v2 (see jenji.json,
+tb_transaction_raw_valid_jenji_v2) holds the columns of the target schema typed and
+is partitioned by event date only, so that the two layouts are never mixed in one table.
+The v1 rows are validated again with the rules of jenji.json: the ones the target schema
+cast would turn into null (e.g. 2023-02-30) are written to --rejected_path instead.
+To be run once, before the ok-nok job writes into v2: the run refuses a v2 path
+which already exists, delete it to run again after a failure.
+"""
+import sys
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+from pyspark.sql import functions as F
+from pyspark.storagelevel import StorageLevel
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from awsglue.dynamicframe import DynamicFrame
+from ok_nok_common import (
+    PARTITION_COLUMNS,
+    REJECTED_RULES_COLUMN,
+    VALID_COLUMN,
+    add_event_date_column,
+    add_partition_columns,
+    cast_frame,
+    get_job_argument,
+    load_source_config,
+    path_exists,
+    repartition_for_write,
+    validate_frame,
+)
+
+
+V1_PATH = "s3://rgi-sandbox-repo-dev/DataLakeV1/ArrivalHub/Validated/Jenji/v1/"
+BACKFILL_REJECTED_PATH = "s3://rgi-sandbox-repo-dev/DataLakeV1/ArrivalHub/Rejected/Jenji/backfill-v2/"
+JENJI_RULES_CONFIG = "jenji.json"  # Shipped with --extra-files, see common/jenji.json
+JENJI_SOURCE_ID = "jenji"
+ROWS_PER_FILE = 128 * 1024 * 1024 // 256  # Target file size / estimated Parquet snappy row
+
+
+def read_v1_rows(spark, v1_path):
+    """
+    Read all the Parquet files of v1, at the root and in the partitions: the partition
+    columns are not read (the event date is derived again from the rows)
+    """
+    v1_DF = spark.read.option("recursiveFileLookup", "true").parquet(v1_path)
+    return v1_DF.drop(*[column for column in PARTITION_COLUMNS if column in v1_DF.columns])
+
+
+def run_job(
+    glue_ctx,
+    source_config,
+    v1_path=V1_PATH,
+    rejected_path=BACKFILL_REJECTED_PATH,
+    rows_per_file=ROWS_PER_FILE,
+):
+    """
+    Write the v1 rows into the validated path (v2) of the source_config, typed and
+    partitioned, and the rows failing the rules to rejected_path (JSON with the failed rules)
+    :return: dict of valid_records, rejected_records row counts
+    """
+    spark = glue_ctx.spark_session
+    validated_path = source_config["validated_path"]
+    partition_keys = source_config["partition_keys"]
+    if path_exists(spark, validated_path):
+        raise Exception(
+            f"ERROR: {validated_path} already exists, the backfill runs once before the"
+            " ok-nok job writes into it"
+        )
+
+    validated_DF = add_partition_columns(
+        add_event_date_column(
+            validate_frame(read_v1_rows(spark, v1_path), source_config["rules"]),
+            source_config["event_date_columns"],
+        ),
+        partition_keys,
+    ).persist(StorageLevel.MEMORY_AND_DISK)
+    valid_counts = {
+        row[VALID_COLUMN]: row["count"]
+        for row in validated_DF.groupBy(VALID_COLUMN).count().collect()
+    }
+    row_counts = {
+        "valid_records": valid_counts.get(True, 0),
+        "rejected_records": valid_counts.get(False, 0),
+    }
+    for group_name, rows in row_counts.items():
+        print("METRIC BackfilledRows group=%s rows=%d" % (group_name, rows))
+
+    valid_DF = cast_frame(
+        validated_DF.filter(F.col(VALID_COLUMN)).drop(VALID_COLUMN, REJECTED_RULES_COLUMN),
+        source_config["target_schema"],
+    )
+    valid_sink = glue_ctx.getSink(
+        path=validated_path,
+        connection_type="s3",
+        updateBehavior="UPDATE_IN_DATABASE",
+        partitionKeys=partition_keys,
+        compression="snappy",
+        enableUpdateCatalog=bool(source_config["catalog_table_name"]),
+        transformation_ctx="S3DLBronzeBackfillTxnJenji",
+    )
+    if source_config["catalog_table_name"]:
+        valid_sink.setCatalogInfo(
+            catalogDatabase=source_config["database"],
+            catalogTableName=source_config["catalog_table_name"],
+        )
+    valid_sink.setFormat("glueparquet")
+    valid_sink.writeFrame(
+        DynamicFrame.fromDF(
+            repartition_for_write(
+                valid_DF, partition_keys, row_counts["valid_records"], rows_per_file
+            ),
+            glue_ctx,
+            "valid_records",
+        )
+    )
+
+    if row_counts["rejected_records"]:
+        glue_ctx.write_dynamic_frame.from_options(
+            frame=DynamicFrame.fromDF(
+                validated_DF.filter(~F.col(VALID_COLUMN)).drop(VALID_COLUMN),
+                glue_ctx,
+                "rejected_records",
+            ),
+            connection_type="s3",
+            format="json",
+            connection_options={"path": rejected_path, "partitionKeys": partition_keys},
+            transformation_ctx="S3DLBronzeBackfillNokTxnJenji",
+        )
+    validated_DF.unpersist()
+    return row_counts
+
+
+def main():
+    args = getResolvedOptions(sys.argv, ["JOB_NAME"])
+    sc = SparkContext()
+    glueContext = GlueContext(sc)
+    job = Job(glueContext)
+    job.init(args["JOB_NAME"], args)
+
+    source_config = load_source_config(
+        get_job_argument("rules_config", JENJI_RULES_CONFIG), JENJI_SOURCE_ID
+    )
+    v1_path = get_job_argument("v1_path", V1_PATH)
+    print("BACKFILL FROM:", v1_path, "TO:", source_config["validated_path"])
+    run_job(
+        glueContext,
+        source_config,
+        v1_path=v1_path,
+        rejected_path=get_job_argument("rejected_path", BACKFILL_REJECTED_PATH),
+    )
+    job.commit()
+
+
+if __name__ == "__main__":
+    main()
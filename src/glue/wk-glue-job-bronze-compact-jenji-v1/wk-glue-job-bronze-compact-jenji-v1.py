@@ -0,0 +1,245 @@
+"""
+Compact the small Parquet files of the validated Jenji table partitions.
+Each run merges the partitions holding more than --min_files files whose
+average size is below half of --target_file_size_mb, to be scheduled
+periodically next to the ok-nok validation job.
+Only the partitions dated before --compact_before (yyyy-MM-dd), by default
+--min_partition_age_days days ago, are compacted: the recent ones still get new files.
+Only the files listed by the run are replaced, the files appended meanwhile are kept.
+The merge write mode of the ok-nok job rewrites partitions however old they are,
+so the run is skipped while a run of --merge_job_name is active, and the ok-nok job
+refuses to merge while a compaction runs.
+Each partition is staged with a manifest of its listed and staged files: the next run
+finishes a compaction interrupted after its manifest, and drops the staged files of
+one interrupted before, so that a failure never leaves the rows twice in the table.
+"""
+import re
+import sys
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from datetime import date, datetime, timedelta, timezone
+from ok_nok_common import get_active_job_run_ids, get_job_argument
+
+# Date of a partition path: event_date=yyyy-MM-dd or year=yyyy/month=MM/day=dd
+EVENT_DATE_PARTITION_REGEX = re.compile(r"event_date=([0-9]{4})-([0-9]{2})-([0-9]{2})/")
+YEAR_MONTH_DAY_PARTITION_REGEX = re.compile(r"year=([0-9]{4})/month=([0-9]{1,2})/day=([0-9]{1,2})/")
+# Manifest of a staged partition: the listed files to delete, the staged files to move in
+MANIFEST_DIR = "_manifest"
+MANIFEST_SCHEMA = "kind string, source string, target string"
+# Job merging into the partitions of the validated table (write_mode merge)
+MERGE_JOB_NAME = "wk-glue-job-bronze-ok-nok-jenji-v1"
+
+
+def get_file_system(spark, path):
+    """Hadoop file system of a path scheme (s3, file) and the JVM path"""
+    jvm_path = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    return jvm_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration()), jvm_path
+
+
+def list_partition_files(spark, table_path):
+    """
+    List the Parquet files of the table per partition path
+    :return: dict of partition path: list of (file path, size in bytes)
+    """
+    file_system, jvm_path = get_file_system(spark, table_path)
+    partition_files = {}
+    if not file_system.exists(jvm_path):
+        return partition_files
+    file_statuses = file_system.listFiles(jvm_path, True)
+    while file_statuses.hasNext():
+        file_status = file_statuses.next()
+        file_path = file_status.getPath().toString()
+        if file_path.endswith(".parquet") and "=" in file_path:
+            partition_path = file_path.rsplit("/", 1)[0] + "/"
+            partition_files.setdefault(partition_path, []).append((file_path, file_status.getLen()))
+    return partition_files
+
+
+def get_partition_date(partition_path):
+    """Date of a partition path (see the *_PARTITION_REGEX), None when it has none"""
+    match = EVENT_DATE_PARTITION_REGEX.search(partition_path)
+    match = match or YEAR_MONTH_DAY_PARTITION_REGEX.search(partition_path)
+    if not match:
+        return None
+    try:
+        return date(*[int(group) for group in match.groups()])
+    except ValueError:
+        return None
+
+
+def get_partition_subpath(partition_path):
+    """Partition directories of a partition path, e.g. event_date=2023-05-01/"""
+    return "".join(directory + "/" for directory in partition_path.split("/") if "=" in directory)
+
+
+def select_partitions_to_compact(partition_files, target_file_size, min_files, compact_before):
+    """
+    Select the closed partitions (dated before compact_before) made of many small files,
+    the partitions without date are never compacted
+    :return: dict of partition path: number of files after compaction
+    """
+    partitions_to_compact = {}
+    for partition_path, files in partition_files.items():
+        partition_date = get_partition_date(partition_path)
+        if partition_date is None or partition_date >= compact_before:
+            continue
+        total_size = sum(file_size for _, file_size in files)
+        if len(files) > min_files and total_size / len(files) < target_file_size / 2:
+            partitions_to_compact[partition_path] = max(1, -(-total_size // target_file_size))
+    return partitions_to_compact
+
+
+def write_manifest(spark, staging_path, partition_path, file_paths):
+    """
+    Record the listed files of the partition and the files staged to replace them,
+    once the staged copy is complete (see finish_compaction)
+    """
+    file_system, jvm_staging_path = get_file_system(spark, staging_path)
+    staged_names = [
+        file_status.getPath().getName()
+        for file_status in file_system.listStatus(jvm_staging_path)
+        if file_status.getPath().getName().endswith(".parquet")
+    ]
+    manifest_rows = [("listed", file_path, None) for file_path in file_paths] + [
+        ("staged", staging_path + name, partition_path + name) for name in staged_names
+    ]
+    spark.createDataFrame(manifest_rows, MANIFEST_SCHEMA).coalesce(1).write.mode("overwrite").json(
+        staging_path + MANIFEST_DIR
+    )
+
+
+def finish_compaction(spark, staging_path):
+    """
+    Finish the compaction of the manifest of a staged partition: the staged files not
+    moved yet are moved into the partition, then the listed files are deleted. Idempotent,
+    so that the next run finishes a compaction interrupted anywhere after its manifest
+    """
+    file_system, jvm_staging_path = get_file_system(spark, staging_path)
+    jvm_path_class = spark.sparkContext._jvm.org.apache.hadoop.fs.Path
+    manifest_rows = spark.read.schema(MANIFEST_SCHEMA).json(staging_path + MANIFEST_DIR).collect()
+    for row in manifest_rows:
+        if row["kind"] != "staged":
+            continue
+        staged_path, target_path = jvm_path_class(row["source"]), jvm_path_class(row["target"])
+        if file_system.exists(staged_path):
+            if not file_system.rename(staged_path, target_path):
+                raise Exception(f"ERROR: Cannot move {row['source']} to {row['target']}")
+        elif not file_system.exists(target_path):
+            raise Exception(f"ERROR: Staged file {row['source']} lost, {row['target']} missing")
+    for row in manifest_rows:
+        if row["kind"] == "listed":
+            file_system.delete(jvm_path_class(row["source"]), False)
+    file_system.delete(jvm_staging_path, True)
+
+
+def recover_compactions(spark, staging_root_path):
+    """
+    Finish the compactions interrupted by a previous run after their manifest, then drop
+    the staging path: the staged copies without manifest were never moved into the table
+    :return: list of the staging paths of the finished compactions
+    """
+    file_system, jvm_staging_root_path = get_file_system(spark, staging_root_path)
+    if not file_system.exists(jvm_staging_root_path):
+        return []
+    staging_paths = set()
+    file_statuses = file_system.listFiles(jvm_staging_root_path, True)
+    while file_statuses.hasNext():
+        file_path = file_statuses.next().getPath().toString()
+        if "/%s/" % MANIFEST_DIR in file_path:
+            staging_paths.add(file_path.split("/%s/" % MANIFEST_DIR)[0] + "/")
+    for staging_path in sorted(staging_paths):
+        print("RECOVER interrupted compaction", staging_path)
+        finish_compaction(spark, staging_path)
+    file_system.delete(jvm_staging_root_path, True)
+    return sorted(staging_paths)
+
+
+def compact_partition(spark, partition_path, file_paths, staging_path, num_files):
+    """
+    Rewrite the listed files of one partition into num_files files: they are written to
+    the staging path with their manifest, moved into the partition, then the listed files
+    are deleted. The partition directory is never overwritten, so the files added meanwhile
+    are kept. A failure before the manifest leaves only the staged copy, dropped by the next
+    run; a failure after it leaves the partition with both the moved files and the listed
+    ones, so the next run finishes the compaction first (see recover_compactions)
+    """
+    spark.read.parquet(*file_paths).coalesce(num_files).write.mode("overwrite").parquet(
+        staging_path
+    )
+    write_manifest(spark, staging_path, partition_path, file_paths)
+    finish_compaction(spark, staging_path)
+
+
+def run_job(spark, table_path, staging_path, target_file_size, min_files, compact_before):
+    """
+    Finish the compactions interrupted by the previous run, then compact the closed
+    partitions of the table made of many small files
+    :return: dict of partition path: number of files after compaction
+    """
+    recover_compactions(spark, staging_path)
+    partition_files = list_partition_files(spark, table_path)
+    partitions_to_compact = select_partitions_to_compact(
+        partition_files, target_file_size, min_files, compact_before
+    )
+    print(
+        "PARTITIONS: %d TO COMPACT: %d BEFORE: %s"
+        % (len(partition_files), len(partitions_to_compact), compact_before)
+    )
+    for partition_path, num_files in sorted(partitions_to_compact.items()):
+        print(
+            "COMPACT %s from %d to %d files"
+            % (partition_path, len(partition_files[partition_path]), num_files)
+        )
+        compact_partition(
+            spark,
+            partition_path,
+            [file_path for file_path, _ in partition_files[partition_path]],
+            staging_path + get_partition_subpath(partition_path),
+            num_files,
+        )
+    return partitions_to_compact
+
+
+def main():
+    args = getResolvedOptions(sys.argv, ["JOB_NAME"])
+    sc = SparkContext()
+    glueContext = GlueContext(sc)
+    spark = glueContext.spark_session
+    job = Job(glueContext)
+    job.init(args["JOB_NAME"], args)
+
+    bucket_name = get_job_argument("bucket_name", "rgi-sandbox-repo-dev")
+    table_prefix = get_job_argument("table_prefix", "DataLakeV1/ArrivalHub/Validated/Jenji/v2/")
+    staging_prefix = get_job_argument("staging_prefix", "DataLakeV1/ArrivalHub/Compacting/")
+    target_file_size = int(get_job_argument("target_file_size_mb", "128")) * 1024 * 1024
+    min_files = int(get_job_argument("min_files", "4"))
+    min_partition_age_days = int(get_job_argument("min_partition_age_days", "7"))
+    merge_job_name = get_job_argument("merge_job_name", MERGE_JOB_NAME)
+    compact_before = get_job_argument("compact_before")
+    if compact_before:
+        compact_before = datetime.strptime(compact_before, "%Y-%m-%d").date()
+    else:
+        compact_before = datetime.now(timezone.utc).date() - timedelta(days=min_partition_age_days)
+
+    # The merge rewrites the partitions it touches, whatever their age: the listed files
+    # of a compaction could be replaced meanwhile, the run is skipped until the next one
+    active_job_run_ids = get_active_job_run_ids(merge_job_name)
+    if active_job_run_ids:
+        print(f"WARNING: {merge_job_name} is running {active_job_run_ids}, compaction skipped")
+        job.commit()
+        return
+    run_job(
+        spark,
+        "s3://%s/%s" % (bucket_name, table_prefix),
+        "s3://%s/%s%s" % (bucket_name, staging_prefix, table_prefix),
+        target_file_size,
+        min_files,
+        compact_before,
+    )
+    job.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,260 +2,170 @@
 Select raw data with a LastUpdated date older than n minutes.
 The reason is to leave a time gap in case data has been written
 in S3 to mitigate the eventual consistency.
+The keys are moved into the ingestion_date=yyyy-MM-dd partition (UTC date of their
+LastModified) of their source, which the crawler adds to the raw catalog table so that
+the ok-nok jobs prune the partitions with their --ingestion_lookback_days predicate.
+The AWS helpers are the ones of the S3 trigger Lambda
+(src/lambda/wk-xdp-datalake-dlv-s3-trigger/scripts), shipped to the job
+as a zip of the scripts package with --extra-py-files.
 """
-import os
-from datetime import datetime, timezone, timedelta
+import sys
 import time
-import uuid
-from dateutil import parser
-import boto3
+from datetime import datetime, timezone
+from scripts import aws_metrics, aws_utils
 
 
-def get_current_region_name():
-    """Dynamically determine the AWS Region (env, session))"""
-    potential_values = [
-        os.environ.get('AWS_REGION'),
-        os.environ.get('AWS_DEFAULT_REGION'),
-        boto3.DEFAULT_SESSION.region_name if boto3.DEFAULT_SESSION else None,
-        boto3.Session().region_name,
-    ]
-    for region_name in potential_values:
-        if region_name:
-            return region_name
-    return None
+def get_job_argument(name, default=None):
+    """Optional Glue job argument --name value (getResolvedOptions fails on missing ones)"""
+    option = '--' + name
+    if option in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(option) + 1]
+    return default
 
 
-def get_current_lambda_function_name():
-    """Dynamically determine the AWS Lambda Function Name (env))"""
-    return os.environ['AWS_LAMBDA_FUNCTION_NAME']
-
-
-def prefix_object_name(object_name, sep='_', iso_dt=False, iso_tm=False, uu_id=False):
-    """
-    Prefix the object name upon given parameters in the below order:
-        <with_prefix><sep><add_datetime><sep><add_uuid><sep><object_name>
-    :param object_name: Name of the object
-    :param sep: Separator
-    :param iso_dt: Format is YYYYMMDD with current utc date
-    :param iso_tm: Format is HH24MISS with current utc time
-    :param uu_id: Set by uuid4
-    :return: Formatted object_name
-    """
-    new_prefix = ''
-    dt_utc = datetime.now(timezone.utc)
-    if iso_dt:
-        new_prefix += dt_utc.strftime('%Y%m%d') + sep
-    if iso_tm:
-        new_prefix += dt_utc.strftime('%H%M%S') + sep
-    if uu_id:
-        new_prefix += str(uuid.uuid4()) + sep
-    return new_prefix + object_name
+# Job settings
+BUCKET_NAME = 'rgi-sandbox-repo-dev'  # TODO: Get it from SSM # pylint: disable=W0511
+START_AT_PREFIX = 'DataLakeV1/ArrivalHub/PendingSelection/'  # TODO: Get it from SSM # pylint: disable=W0511
+MOVE_TO_PREFIX = 'DataLakeV1/ArrivalHub/PendingValidations/'  # TODO: Get it from SSM # pylint: disable=W0511
+NEW_OBJECT_TAG_VALUE = 'ProcessStatus'  # TODO: Maybe get it from SSM # pylint: disable=W0511
+OBJECT_TAG_VALUE = 'PendingValidations'  # TODO: Get it from SSM # pylint: disable=W0511
+INGESTION_PARTITION_COLUMN = 'ingestion_date'  # Partition of the raw catalog tables
+# or dynamically:
+#if move_to_prefix.endswith('/'):
+#    object_tag_value = move_to_prefix.split('/')[-2]
+#else:
+#    object_tag_value = move_to_prefix.split('/')[-1]
 
 
-def exec_func_with_max_retries(func_to_exec, max_tries=3, sleep_sec=5, func_text=None, quiet_mode=True):
+def select_keys_from_to(candidate_s3_keys, source_allow_list, bucket_name=BUCKET_NAME,
+                        move_to_prefix=MOVE_TO_PREFIX, new_object_tag_value=NEW_OBJECT_TAG_VALUE,
+                        object_tag_value=OBJECT_TAG_VALUE, selection_stats=None):
     """
-    This wrapper allows a function to be executed with retries.
-    If the func_to_exec has parameters just use the below call:
-        exec_func_with_max_retries(lambda: my_func(p1, p2))
-    :param func_to_exec: Name of the function to execute
-    :param max_tries: Maximum retries
-    :param sleep_sec: Time in seconds to sleep between retries
-    :param func_text: Text to display while attempting to execute
-    :return: Number of retries. On FAILURE the exception
+    Validate the candidate prefixes and yield the ones to move,
+    consumed by the move pipeline while the previous keys are being moved
+    :param candidate_s3_keys: Iterable of dict: Key, LastModified, Size, StorageClass
+    :param source_allow_list: SourceAllowList of the incoming sources
+    :param bucket_name: Bucket name
+    :param move_to_prefix: Prefix of the destination
+    :param new_object_tag_value: Tag key set on the PlaceHolder keys
+    :param object_tag_value: Tag value set on the PlaceHolder keys
+    :param selection_stats: dict of Candidates, Selected, Ignored, Bytes updated on the fly
+    :return: Generator of (object_key_from, object_key_to, object_size),
+             object_key_to in the ingestion date partition of the source (see get_ingestion_date)
     """
-    retry_cnt = 0
-    for retry_cnt in range(max_tries):
-        try:
-            if func_text:
-                print(func_text)
-            func_to_exec()
-            break
-        except Exception as exception_handler:  # pylint: disable=broad-except
-            retry_cnt += 1
-            print(exception_handler)
-            if retry_cnt < max_tries:
-                if not quiet_mode:
-                    print(f"WARNING: Retry {retry_cnt} out of {max_tries},"
-                          f" sleeping {sleep_sec} seconds")
-                time.sleep(sleep_sec)
-            else:
-                if not quiet_mode:
-                    print(f"ERROR: Max retries exceeded {retry_cnt} out of {max_tries}")
-                raise exception_handler
+    if selection_stats is None:
+        selection_stats = new_selection_stats()
+    for s3_key in candidate_s3_keys:
+        print(s3_key.get('Size'), s3_key.get('LastModified'), s3_key.get('Key'))
+        object_key_from = s3_key.get('Key')
+        selection_stats['Candidates'] += 1
+
+        # =====================================================================================
+        # TODO: to set into common function # pylint: disable=W0511
+        # Inspect s3_key prefix
+        object_prefixes_list = object_key_from.split('/')  # Split in prefixes path
+        object_prefixes_count = len(object_prefixes_list)
+        # Check prefixes parts, expected at least Medallion/SubFolder/SourceId/FimeName.json
+        # Not raised: the keys already copied by the move pipeline must still be deleted
+        # TODO: The below may need to create a metric to set off an alarm # pylint: disable=W0511
+        if object_prefixes_count < 4:
+            selection_stats['Ignored'] += 1
+            print(f"ERROR: Invalid object prefixes path {object_key_from},"
+                  f" expected 4 actual {object_prefixes_count}")
             continue
-    return retry_cnt
-
-
-def move_s3_key_from_to_location(bucket_name, object_key_from, object_key_to):
-    """In AWS S3 there is no file rename nor move nor folders/sub-folders
-       Hence AWS does copy+delete of the prefixes keys
-    :param bucket_name: Name of S3 bucket
-    :param object_key_from: Prefix Key of the source
-    :param object_key_to: Prefix Key of the target
-    :return: -
-    """
-    s3_client = boto3.client('s3')  # Simple Storage Service
-    copy_source = {'Bucket': bucket_name, 'Key': object_key_from}
-    s3_client.copy_object(Bucket=bucket_name, CopySource=copy_source, Key=object_key_to)
-    s3_client.delete_object(Bucket=bucket_name, Key=object_key_from)
-
+        # Extract Source Id and "filename"
+        source_id = object_prefixes_list[-2]  # Skip "filename" and get last sub-folder prefix
+        object_name = object_prefixes_list[-1]  # Get "filename"
+        # =====================================================================================
+
+        # Validate candidate prefixes
+        if source_allow_list.is_allowed(source_id, object_name):
+            # Set the new destination
+            object_key_to = move_to_prefix + source_allow_list.get_target_prefix(source_id) + '/' \
+                            + f'{INGESTION_PARTITION_COLUMN}={get_ingestion_date(s3_key)}/' + object_name
+            # Move key to new destination, the key tag is updated by the copy itself
+            if 'PlaceHolder' not in object_key_from:
+                print('move_s3_keys_from_to_location from:', object_key_from)
+                print('move_s3_keys_from_to_location to:  ', object_key_to)
+                selection_stats['Selected'] += 1
+                selection_stats['Bytes'][object_key_from] = s3_key.get('Size') or 0
+                yield object_key_from, object_key_to, s3_key.get('Size')
+            else:
+                # Update key tag
+                aws_utils.put_s3_key_tag(bucket_name, object_key_from, new_object_tag_value, object_tag_value)
+        else:
+            selection_stats['Ignored'] += 1
+            print(f"Ignored: {object_key_from}")
 
-def get_s3_key_tag(bucket_name, object_key, tag_key):
-    """Get object tag value
-    :param bucket_name: Name of S3 bucket
-    :param object_key: Prefix key
-    :param tag_key: Tag key
-    :return: Tag value
-    """
-    s3_client = boto3.client('s3')  # Simple Storage Service
-    tags_response = s3_client.get_object_tagging(Bucket=bucket_name, Key=object_key)
-    for tag in tags_response['TagSet']:
-        if tag['Key'] == tag_key:
-            return tag['Value']
-    return None
 
+def get_ingestion_date(s3_key):
+    """UTC date (yyyy-MM-dd) of the LastModified of a listed key, else of today"""
+    last_modified = s3_key.get('LastModified') or datetime.now(timezone.utc)
+    return last_modified.astimezone(timezone.utc).strftime('%Y-%m-%d')
 
-def put_s3_key_tag(bucket_name, object_key, tag_key, tag_new_value, if_tag_value=None):
-    """Get object tag value
-    :param bucket_name: Name of S3 bucket
-    :param object_key: Prefix key
-    :param tag_key: Tag key
-    :param tag_new_value: Tag new value
-    :param if_tag_value: Change value only if matches current Tag value
-    :return: -
-    """
-    if if_tag_value and if_tag_value != get_s3_key_tag(bucket_name, object_key, tag_key):
-        return
 
-    # Create or Replace Tag key:value
-    s3_client = boto3.client('s3')  # Simple Storage Service
-    tags_response = s3_client.get_object_tagging(Bucket=bucket_name, Key=object_key)
-    tag_set = tags_response['TagSet']
-    if not any(tag['Key'] == tag_key for tag in tag_set):
-        tag_set.append({"Key": tag_key, "Value": tag_new_value})
-    else:
-        for tag in tag_set:
-            if tag['Key'] == tag_key:
-                tag['Value'] = tag_new_value
-                break
-    s3_client.put_object_tagging(Bucket=bucket_name, Key=object_key, Tagging={'TagSet': tag_set})
+def new_selection_stats():
+    """Counters of select_keys_from_to: Candidates, Selected, Ignored, Bytes per selected key"""
+    return {'Candidates': 0, 'Selected': 0, 'Ignored': 0, 'Bytes': {}}
 
 
-def list_s3_key_older_than(bucket_name, start_at_prefix, utc_dtm=None, minutes_ago=None):
+def run_job(bucket_name=BUCKET_NAME, start_at_prefix=START_AT_PREFIX, move_to_prefix=MOVE_TO_PREFIX,
+            minutes_ago=2, list_max_workers=None, max_keys_per_source=None, move_max_workers=None,
+            region_name=None):
     """
-    List all the keys in S3 bucket starting from a prefix down.
-    Keys with LastModified datetime older than given minutes ago will be returned as a list
-    :param bucket_name: Name of S3 bucket
-    :param start_at_prefix: Starting from this prefix down
-    :param utc_dtm: UTC datetime
-    :param minutes_ago: older than minutes ago
-    :return: list of dict: Key, LastModified(ISO 8601), Size, StorageClass
-            Note: an empty list will be returned when input parameters are invalid
+    Select the keys older than minutes_ago of the allowed sources and move them
+    :return: dict of selection_stats, moved_keys, failed_keys, elapsed_sec
     """
-    if not utc_dtm:
-        utc_dtm = datetime.now(timezone.utc)
-    if not minutes_ago or not isinstance(minutes_ago, int):
-        minutes_ago = 5  # TODO: Maybe get it from SSM # pylint: disable=W0511
-
-    # Validate
+    print('========== Get list of allowed Source Id ============')
+    # Get valid list of incoming sources id from Simple System Manager (cached)
+    source_allow_list = aws_utils.get_source_allow_list(region_name=region_name)
+
+    print('========== Select candidate prefixes ============')
+    # Listed per source_id concurrently while moving
+    list_s3_key = aws_utils.iter_s3_key_older_than_by_prefix(bucket_name, start_at_prefix,
+                                                             minutes_ago=minutes_ago,
+                                                             max_workers=list_max_workers,
+                                                             max_keys_per_prefix=max_keys_per_source)
+
+    print('========== Validate and move prefixes ============')
+    selection_stats = new_selection_stats()
+    move_start_tm = time.monotonic()
+    moved_keys, failed_keys = aws_utils.move_s3_keys_from_to_location(
+        bucket_name,
+        select_keys_from_to(list_s3_key, source_allow_list, bucket_name, move_to_prefix,
+                            selection_stats=selection_stats),
+        tag_updates={NEW_OBJECT_TAG_VALUE: OBJECT_TAG_VALUE}, max_workers=move_max_workers)
+    move_elapsed_sec = max(time.monotonic() - move_start_tm, 1e-6)
+    moved_bytes = sum(selection_stats['Bytes'][key] for key in moved_keys)
+
+    print('========== Summary ============')
+    print(f"Candidates: {selection_stats['Candidates']} Selected: {selection_stats['Selected']}"
+          f" Ignored: {selection_stats['Ignored']} Moved: {len(moved_keys)} Failed: {len(failed_keys)}"
+          f" Workers: {move_max_workers or aws_utils.S3_MOVE_MAX_WORKERS}")
+    print(f"Elapsed: {move_elapsed_sec:.1f} sec Files/sec: {len(moved_keys) / move_elapsed_sec:.1f}"
+          f" Bytes/sec: {moved_bytes / move_elapsed_sec:.0f}")
+    for failed_key, failed_error in failed_keys.items():
+        print(f'FAILED: {failed_key} {failed_error}')
+    return {'selection_stats': selection_stats, 'moved_keys': moved_keys, 'failed_keys': failed_keys,
+            'elapsed_sec': move_elapsed_sec}
+
+
+def main():
+    # Init AWS common objects
+    region_name = aws_utils.get_current_region_name()
+    job_name = get_job_argument('JOB_NAME', 'wk-glue-job-bronze-mvsel2val-jenji-v1')
     try:
-        utc_dtm_iso8601 = utc_dtm.strftime('%Y-%m-%dT%H:%M:%S')
-        parser.parse(utc_dtm_iso8601)
-        utc_dtm -= timedelta(minutes=minutes_ago)
-    except ValueError:
-        print(f'ERROR: Invalid utc_dtm|minutes_ago: {utc_dtm},{minutes_ago}')
-        return []
-
-    # Get the details
-    s3_keys_list = []
-    try:
-        s3_client = boto3.client('s3')
-        paginator = s3_client.get_paginator('list_objects')
-        page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=start_at_prefix)
-        for page in page_iterator:
-            for obj in page['Contents']:
-                # Must have Key in dictionary, filter out "Folders", older "Files"
-                if 'Key' in obj \
-                        and not str(obj['Key']).endswith('/') \
-                        and obj['LastModified'] <= utc_dtm:
-                    # Convert LastModified to string ISO 8601
-                    last_modified1_dt = obj['LastModified'].strftime('%Y-%m-%dT%H:%M:%S')
-                    last_modified2_dt = obj['LastModified'].strftime('%f')
-                    s3_keys_list.append({
-                        'Key': obj['Key'],
-                        'LastModified': last_modified1_dt
-                                        + '.' + last_modified2_dt[:3] + 'Z',
-                        'Size': obj['Size'],
-                        'StorageClass': obj['StorageClass']
-                    })
-    except Exception as exception_handler:  # pylint: disable=W0703
-        print(exception_handler)
-        print(f'ERROR: Cannot list_s3_key_older_than '
-              f'{bucket_name}, {start_at_prefix}, {utc_dtm}, {minutes_ago}')
-        return []
-    return s3_keys_list
-
-
-print('========== Get list of allowed Source Id ============')
-# Init AWS common objects
-region_name = get_current_region_name()
-
-# Init AWS clients
-ssm_client = boto3.client('ssm', region_name=region_name)  # Simple System Manager
-
-# Get valid list of incoming sources id from Simple System Manager
-valid_source_id_list = ssm_client.get_parameter(  # TODO: Wrap into common function # pylint: disable=W0511
-    Name='/datalake/bronze/source_id-list')['Parameter']['Value']
-
-
-print('========== Select candidate prefixes ============')
-bucket_name = 'rgi-sandbox-repo-dev'  # TODO: Get it from SSM # pylint: disable=W0511
-start_at_prefix = 'DataLakeV1/ArrivalHub/PendingSelection/' # TODO: Get it from SSM # pylint: disable=W0511
-list_s3_key = list_s3_key_older_than(bucket_name, start_at_prefix, minutes_ago=2)
-
-
-print('========== Scan over prefixes ============')
-move_to_prefix = 'DataLakeV1/ArrivalHub/PendingValidations/'  # TODO: Get it from SSM # pylint: disable=W0511
-new_object_tag_value = 'ProcessStatus'  # TODO: Maybe get it from SSM # pylint: disable=W0511
-object_tag_value = 'PendingValidations'  # TODO: Get it from SSM # pylint: disable=W0511
-# or dynamically:
-#if move_to_prefix.endswith('/'):
-#    object_tag_value = move_to_prefix.split('/')[-2]
-#else:
-#    object_tag_value = move_to_prefix.split('/')[-1]
-
-for s3_key in list_s3_key:
-    print('=====================================================================================')
-    print(s3_key.get('Size'), s3_key.get('LastModified'), s3_key.get('Key'))
-    object_key_from = s3_key.get('Key')
-
-    # =====================================================================================
-    # TODO: to set into common function # pylint: disable=W0511
-    # Inspect s3_key prefix
-    object_prefixes_list = object_key_from.split('/')  # Split in prefixes path
-    object_prefixes_count = len(object_prefixes_list)
-    # Check prefixes parts, expected at least Medallion/SubFolder/SourceId/FimeName.json
-    # TODO: The below may need to create a metric to set off an alarm # pylint: disable=W0511
-    if object_prefixes_count < 4:
-        raise Exception(f"ERROR: Invalid object prefixes path,"
-                        f" expected 4 actual {object_prefixes_count}")
-    # Extract Source Id and "filename"
-    source_id = object_prefixes_list[-2]  # Skip "filename" and get last sub-folder prefix
-    object_name = object_prefixes_list[-1]  # Get "filename"
-    root_prefix = '/'.join(object_prefixes_list[:object_prefixes_count-3])
-    # =====================================================================================
-
-    print('========== Calidate candidate prefixes ============')
-    if len(object_key_from) > 4 and object_key_from[-5:] == '.json' \
-            and source_id in valid_source_id_list:
-        # Update key tag
-        put_s3_key_tag(bucket_name, object_key_from, new_object_tag_value, object_tag_value)
-        # Set the new destination
-        object_key_to = move_to_prefix + source_id + '/' + object_key_from.rsplit('/', 1)[-1]
-        # Move key to new destination
-        if 'PlaceHolder' not in object_key_from:
-            print('move_s3_key_from_to_location from:', object_key_from)
-            print('move_s3_key_from_to_location to:  ', object_key_to)
-            move_s3_key_from_to_location(bucket_name, object_key_from, object_key_to)
-    else:
-        print(f"Ignored: {object_key_from}")
+        result = run_job(region_name=region_name,
+                         list_max_workers=int(get_job_argument('list_max_workers', aws_utils.S3_LIST_MAX_WORKERS)),
+                         max_keys_per_source=int(get_job_argument('max_keys_per_source', '0')) or None,
+                         move_max_workers=int(get_job_argument('move_max_workers', aws_utils.S3_MOVE_MAX_WORKERS)))
+    finally:
+        # The Glue logs are not extracted as EMF, the API metrics are published with PutMetricData
+        aws_metrics.put_api_metrics(aws_utils.get_aws_client('cloudwatch', region_name), {'JobName': job_name})
+    failed_keys = result['failed_keys']
+    if failed_keys:
+        raise Exception(f"ERROR: Cannot move {len(failed_keys)} keys: {list(failed_keys)[:10]}")
+
+
+if __name__ == '__main__':
+    main()
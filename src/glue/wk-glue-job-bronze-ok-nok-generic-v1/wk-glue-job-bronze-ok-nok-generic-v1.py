@@ -0,0 +1,271 @@
+"""
+Validate the raw (PendingValidations) data of several sources in one Spark session.
+Each source is described by a rule config (catalog table, validation rules,
+target schema, output paths), loaded from a JSON/YAML file (local or S3)
+or from the SSM parameters under a path (one parameter per source).
+The sources are processed concurrently so that the small ones share the
+Glue DPU startup of one job run instead of one job per source.
+The job bookmarks are committed once all the sources succeeded: the input files of
+each source written meanwhile are recorded under --processed_files_path, so that
+the rerun after a failed source skips them instead of writing their rows twice.
+"""
+import concurrent.futures
+import sys
+from awsglue.transforms import *
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+from pyspark.sql import functions as F
+from pyspark.storagelevel import StorageLevel
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from awsglue.dynamicframe import DynamicFrame
+from ok_nok_common import (
+    REJECTED_RULES_COLUMN,
+    VALID_COLUMN,
+    add_event_date_column,
+    add_partition_columns,
+    build_push_down_predicate,
+    cast_frame,
+    count_rule_failures,
+    delete_path,
+    get_job_argument,
+    load_source_configs,
+    parse_source_configs,
+    path_exists,
+    put_count_metrics,
+    repartition_for_write,
+    validate_frame,
+)
+
+
+# Input file of each row, recorded in the processed files of the source
+INPUT_FILE_COLUMN = "_input_file"
+# Source rule configs: see load_source_configs in ok_nok_common and common/jenji.json
+
+
+def get_source_push_down_predicate(source_config, lookback_days, utc_today=None):
+    """
+    Partition predicate of the catalog table of a source: its push_down_predicate,
+    else the last lookback_days days of its ingestion_partition_column
+    """
+    return source_config["push_down_predicate"] or build_push_down_predicate(
+        source_config["ingestion_partition_column"], lookback_days, utc_today
+    )
+
+
+def get_processed_files_path(processed_files_path, source_id):
+    """Path of the input files of a source written since the last committed job bookmarks"""
+    return "%s/%s/" % (processed_files_path.rstrip("/"), source_id)
+
+
+def drop_processed_files(source_DF, processed_files_path):
+    """
+    Drop the rows of the input files already written by a previous run
+    whose job bookmarks were not committed (another source failed)
+    """
+    spark = source_DF.sparkSession
+    if not path_exists(spark, processed_files_path):
+        return source_DF
+    processed_files_DF = spark.read.schema("%s string" % INPUT_FILE_COLUMN).json(
+        processed_files_path
+    )
+    return source_DF.join(F.broadcast(processed_files_DF), INPUT_FILE_COLUMN, "left_anti")
+
+
+def record_processed_files(validated_DF, processed_files_path):
+    """Record the input files of the rows written, skipped by the reruns until the next commit"""
+    validated_DF.select(INPUT_FILE_COLUMN).distinct().write.mode("append").json(
+        processed_files_path
+    )
+
+
+def validate_source(
+    glue_ctx,
+    source_config,
+    push_down_predicate=None,
+    rows_per_file=None,
+    processed_files_path=None,
+    metric_dimensions=None,
+):
+    """
+    Validate the new rows of one source and write the valid ones (typed, Parquet)
+    and the rejected ones (raw, JSON with the failed rule ids). With processed_files_path,
+    the input files already written since the last committed job bookmarks are skipped
+    and the ones written by this run are recorded. The row counts are published to
+    CloudWatch with the metric_dimensions (e.g. {"JobName": ...}) and the source id
+    :return: dict of valid_records, rejected_records row counts
+    """
+    source_id = source_config["source_id"]
+    partition_keys = source_config["partition_keys"]
+
+    # The transformation_ctx keeps one job bookmark per source
+    source_node = glue_ctx.create_dynamic_frame.from_catalog(
+        database=source_config["database"],
+        table_name=source_config["table_name"],
+        transformation_ctx="S3DLBronzeTxn_%s" % source_id,
+        **({"push_down_predicate": push_down_predicate} if push_down_predicate else {}),
+        **(
+            {"additional_options": {"attachFilename": INPUT_FILE_COLUMN}}
+            if processed_files_path
+            else {}
+        ),
+    )
+    if source_config["drop_fields"]:
+        source_node = DropFields.apply(
+            frame=source_node,
+            paths=source_config["drop_fields"],
+            transformation_ctx="Filteroutcolumns_%s" % source_id,
+        )
+    source_DF = source_node.toDF()
+    if not source_DF.columns:
+        print("WARNING: No new data for %s since the last job bookmark" % source_id)
+        return {"valid_records": 0, "rejected_records": 0}
+    if processed_files_path:
+        source_DF = drop_processed_files(source_DF, processed_files_path)
+
+    # The rows are validated once, persisted, then the valid and rejected rows are derived
+    validated_DF = add_partition_columns(
+        add_event_date_column(
+            validate_frame(source_DF, source_config["rules"]), source_config["event_date_columns"]
+        ),
+        partition_keys,
+    ).persist(StorageLevel.MEMORY_AND_DISK)
+    valid_counts = {
+        row[VALID_COLUMN]: row["count"]
+        for row in validated_DF.groupBy(VALID_COLUMN).count().collect()
+    }
+    row_counts = {
+        "valid_records": valid_counts.get(True, 0),
+        "rejected_records": valid_counts.get(False, 0),
+    }
+    for group_name, rows in row_counts.items():
+        print("METRIC RoutedRows source=%s group=%s rows=%d" % (source_id, group_name, rows))
+    if metric_dimensions is not None:
+        put_count_metrics(
+            "RoutedRows", {**metric_dimensions, "Source": source_id}, "Group", row_counts
+        )
+    if not sum(row_counts.values()):
+        print("WARNING: The new data of %s has already been written by a previous run" % source_id)
+        validated_DF.unpersist()
+        return row_counts
+
+    valid_DF = cast_frame(
+        validated_DF.filter(F.col(VALID_COLUMN)).drop(
+            VALID_COLUMN, REJECTED_RULES_COLUMN, INPUT_FILE_COLUMN
+        ),
+        source_config["target_schema"],
+    )
+    valid_sink = glue_ctx.getSink(
+        path=source_config["validated_path"],
+        connection_type="s3",
+        updateBehavior="UPDATE_IN_DATABASE",
+        partitionKeys=partition_keys,
+        compression="snappy",
+        enableUpdateCatalog=bool(source_config["catalog_table_name"]),
+        transformation_ctx="S3DLBronzeOkTxn_%s" % source_id,
+    )
+    if source_config["catalog_table_name"]:
+        valid_sink.setCatalogInfo(
+            catalogDatabase=source_config["database"],
+            catalogTableName=source_config["catalog_table_name"],
+        )
+    valid_sink.setFormat("glueparquet")
+    if rows_per_file:
+        valid_DF = repartition_for_write(
+            valid_DF, partition_keys, row_counts["valid_records"], rows_per_file
+        )
+    valid_sink.writeFrame(DynamicFrame.fromDF(valid_DF, glue_ctx, "valid_%s" % source_id))
+
+    rejected_DF = validated_DF.filter(~F.col(VALID_COLUMN)).drop(VALID_COLUMN, INPUT_FILE_COLUMN)
+    glue_ctx.write_dynamic_frame.from_options(
+        frame=DynamicFrame.fromDF(rejected_DF, glue_ctx, "rejected_%s" % source_id),
+        connection_type="s3",
+        format="json",
+        connection_options={
+            "path": source_config["rejected_path"],
+            "partitionKeys": partition_keys,
+        },
+        transformation_ctx="S3DLBronzeNokTxn_%s" % source_id,
+    )
+
+    count_rule_failures(validated_DF, source_config["rules"], metric_dimensions, source_id)
+    if processed_files_path:
+        record_processed_files(validated_DF, processed_files_path)
+    validated_DF.unpersist()
+    return row_counts
+
+
+def main():
+    args = getResolvedOptions(sys.argv, ["JOB_NAME", "rules_config"])
+    sc = SparkContext()
+    glueContext = GlueContext(sc)
+    spark = glueContext.spark_session
+    job = Job(glueContext)
+    job.init(args["JOB_NAME"], args)
+
+    source_configs = load_source_configs(args["rules_config"])
+    source_ids = get_job_argument("source_ids")  # Optional subset, e.g. "jenji,expensya"
+    if source_ids:
+        source_configs = [
+            config for config in source_configs if config["source_id"] in source_ids.split(",")
+        ]
+    print("SOURCES:", [config["source_id"] for config in source_configs])
+
+    if get_job_argument("job-bookmark-option", "job-bookmark-disable") != "job-bookmark-enable":
+        print("WARNING: Job bookmarks are not enabled, every run reads the whole tables")
+    # Each source prunes the ingestion date partitions of its own catalog table
+    lookback_days = get_job_argument("ingestion_lookback_days")
+    push_down_predicates = {
+        config["source_id"]: get_source_push_down_predicate(config, lookback_days)
+        for config in source_configs
+    }
+    print("PUSH DOWN PREDICATES:", push_down_predicates)
+    processed_files_path = get_job_argument("processed_files_path")
+    if not processed_files_path:
+        print("WARNING: No --processed_files_path, a rerun after a failure rewrites every source")
+    target_file_size_mb = int(get_job_argument("target_file_size_mb", "128"))
+    estimated_row_bytes = int(get_job_argument("estimated_row_bytes", "256"))  # Parquet snappy
+    rows_per_file = max(1, target_file_size_mb * 1024 * 1024 // estimated_row_bytes)
+
+    # Spark runs the jobs submitted by concurrent threads in parallel: the small sources
+    # share the executors instead of waiting for each other
+    max_concurrent_sources = int(get_job_argument("max_concurrent_sources", "4"))
+    failed_sources = {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, max_concurrent_sources)
+    ) as executor:
+        future_to_source_id = {
+            executor.submit(
+                validate_source,
+                glueContext,
+                source_config,
+                push_down_predicates[source_config["source_id"]],
+                rows_per_file,
+                processed_files_path
+                and get_processed_files_path(processed_files_path, source_config["source_id"]),
+                {"JobName": args["JOB_NAME"]},
+            ): source_config["source_id"]
+            for source_config in source_configs
+        }
+        for future in concurrent.futures.as_completed(future_to_source_id):
+            source_id = future_to_source_id[future]
+            if future.exception() is not None:
+                print("ERROR: Validation of %s failed: %s" % (source_id, future.exception()))
+                failed_sources[source_id] = future.exception()
+            else:
+                print("SOURCE %s DONE: %s" % (source_id, future.result()))
+
+    # The job bookmarks are committed only when all the sources succeeded, the processed
+    # files of the sources which succeeded are skipped by the rerun until then
+    if failed_sources:
+        raise Exception(f"ERROR: Validation failed for the sources {sorted(failed_sources)}")
+    job.commit()
+    if processed_files_path:
+        for source_config in source_configs:
+            delete_path(
+                spark, get_processed_files_path(processed_files_path, source_config["source_id"])
+            )
+
+
+if __name__ == "__main__":
+    main()
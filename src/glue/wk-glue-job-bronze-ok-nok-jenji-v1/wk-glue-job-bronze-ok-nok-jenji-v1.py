@@ -2,11 +2,197 @@ import sys
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
+from pyspark.sql import functions as F
+from pyspark.sql.window import Window
+from pyspark.storagelevel import StorageLevel
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from awsglue.dynamicframe import DynamicFrameCollection
-import concurrent.futures
-import re
+from awsglue.dynamicframe import DynamicFrame, DynamicFrameCollection
+from ok_nok_common import (
+    EVENT_DATE_COLUMN,
+    REJECTED_RULES_COLUMN,
+    VALID_COLUMN,
+    add_event_date_column,
+    add_partition_columns,
+    build_push_down_predicate,
+    cast_frame,
+    count_rule_failures,
+    delete_path,
+    get_active_job_run_ids,
+    get_job_argument,
+    load_source_config,
+    path_exists,
+    put_count_metrics,
+    repartition_for_write,
+    validate_frame,
+)
+
+
+GROUP_COLUMN = "_group"
+MERGE_STAGING_PATH = "s3://rgi-sandbox-repo-dev/DataLakeV1/ArrivalHub/Merging/Jenji/v2/"
+# Job compacting the partitions of the validated table, never run with a merge
+COMPACTION_JOB_NAME = "wk-glue-job-bronze-compact-jenji-v1"
+# Target file size of the validated output (rows per file estimated from the row size)
+TARGET_FILE_SIZE_MB = 128
+ESTIMATED_ROW_BYTES = 256  # Parquet snappy
+# Business key of an expense and its version, the latest version is kept by the dedupe
+DEDUPE_KEY_COLUMN = "jenjiexpenseid"
+DEDUPE_ORDER_COLUMN = "lastupdatedat"
+
+# Source rule config of Jenji (catalog table, declarative validation rules, target schema,
+# event date columns, output paths), the one of the generic ok-nok job too: common/jenji.json
+# shipped with --extra-files, or the --rules_config location (see load_source_configs)
+JENJI_RULES_CONFIG = "jenji.json"
+JENJI_SOURCE_ID = "jenji"
+
+
+def dedupe_latest(source_DF, key_column, order_column):
+    """Keep the latest row (by order_column) per key_column within the frame"""
+    window = Window.partitionBy(key_column).orderBy(F.col(order_column).desc())
+    return (
+        source_DF.withColumn("_row_number", F.row_number().over(window))
+        .filter(F.col("_row_number") == 1)
+        .drop("_row_number")
+    )
+
+
+def get_written_partition_paths(spark, target_path, source_DF, partition_keys):
+    """
+    Paths of the partitions of the source_DF rows already written under target_path,
+    from the partition values as written in the paths (see add_partition_columns)
+    """
+    partition_paths = [
+        target_path.rstrip("/")
+        + "".join("/%s=%s" % (key, row[key]) for key in partition_keys)
+        + "/"
+        for row in source_DF.select(*partition_keys).distinct().collect()
+    ]
+    return [path for path in partition_paths if path_exists(spark, path)]
+
+
+def load_written_versions(
+    spark, validated_path, source_DF, partition_keys, key_column, order_column
+):
+    """
+    Latest version (order_column) already written of the keys of source_DF. A new version keeps
+    the event date of the first one, so only the partitions of the source_DF rows are read,
+    however old they are. None when none of them has been written yet
+    """
+    partition_paths = get_written_partition_paths(spark, validated_path, source_DF, partition_keys)
+    if not partition_paths:
+        print("WARNING: No validated partition to dedupe against in", validated_path)
+        return None
+    return (
+        spark.read.option("basePath", validated_path)
+        .parquet(*partition_paths)
+        .join(source_DF.select(key_column).distinct(), key_column, "left_semi")
+        .groupBy(key_column)
+        .agg(F.max(F.col(order_column).cast("timestamp")).alias("_written_version"))
+    )
+
+
+def drop_written_versions(source_DF, written_versions_DF, key_column, order_column):
+    """
+    Drop the rows whose version is not newer than the one already written (re-deliveries),
+    the written versions of the batch keys are broadcast so that the history is never shuffled
+    """
+    return (
+        source_DF.join(F.broadcast(written_versions_DF), key_column, "left")
+        .filter(
+            F.col("_written_version").isNull()
+            | (F.col(order_column).cast("timestamp") > F.col("_written_version"))
+        )
+        .drop("_written_version")
+    )
+
+
+def normalize_partition_columns(source_DF, partition_keys):
+    """
+    Partition columns as written in the paths (strings, zero padded month and day)
+    whatever the types inferred by the Parquet partition discovery
+    """
+    for partition_key in partition_keys:
+        if partition_key == EVENT_DATE_COLUMN:
+            column = F.date_format(F.col(partition_key), "yyyy-MM-dd")
+        elif partition_key in ("month", "day"):
+            column = F.lpad(F.col(partition_key).cast("string"), 2, "0")
+        else:
+            column = F.col(partition_key).cast("string")
+        source_DF = source_DF.withColumn(partition_key, column)
+    return source_DF
+
+
+def merge_into_partitions(
+    spark,
+    updates_DF,
+    target_path,
+    staging_path,
+    partition_keys,
+    key_column,
+    order_column,
+    rows_per_file,
+):
+    """
+    Merge (upsert on key_column) the updates into the partitions already written that they
+    touch: only those partitions are rewritten, through the staging path since Spark cannot
+    overwrite the files it reads, in files of about rows_per_file rows (see
+    repartition_for_write). A written row is replaced only by a newer version
+    (order_column), so that a late re-delivery of an older version is dropped. The updates
+    must hold one row per key and keep the partition of the version they replace
+    (the event date does not change)
+    :return: the updates of the partitions not written yet, to append (with the catalog update)
+    """
+    partition_paths = get_written_partition_paths(spark, target_path, updates_DF, partition_keys)
+    if not partition_paths:
+        print("WARNING: No validated partition to merge into in", target_path)
+        return updates_DF
+    touched_DF = normalize_partition_columns(
+        spark.read.option("basePath", target_path).parquet(*partition_paths), partition_keys
+    )
+    written_partitions_DF = F.broadcast(touched_DF.select(*partition_keys).distinct()).persist()
+    if written_partitions_DF.count() == 0:
+        written_partitions_DF.unpersist()
+        return updates_DF
+
+    # Rows of the touched partitions, aligned on the (typed) schema of the updates, and the
+    # updates: the latest version per key is kept, the update when both have the same version
+    versions_DF = touched_DF.select(
+        *[
+            (F.col(column) if column in touched_DF.columns else F.lit(None))
+            .cast(dtype)
+            .alias(column)
+            for column, dtype in updates_DF.dtypes
+        ]
+    ).withColumn("_merge_priority", F.lit(0))
+    window = Window.partitionBy(key_column).orderBy(
+        F.col(order_column).cast("timestamp").desc(), F.col("_merge_priority").desc()
+    )
+    merged_DF = (
+        versions_DF.unionByName(
+            updates_DF.join(written_partitions_DF, partition_keys, "left_semi").withColumn(
+                "_merge_priority", F.lit(1)
+            )
+        )
+        .withColumn("_row_number", F.row_number().over(window))
+        .filter(F.col("_row_number") == 1)
+        .drop("_row_number", "_merge_priority")
+        .persist(StorageLevel.MEMORY_AND_DISK)  # Read by the file sizing and the write
+    )
+    repartition_for_write(merged_DF, partition_keys, merged_DF.count(), rows_per_file).write.mode(
+        "overwrite"
+    ).partitionBy(*partition_keys).parquet(staging_path)
+    merged_DF.unpersist()
+
+    # Dynamic overwrite replaces only the partitions present in the staged data
+    staged_DF = normalize_partition_columns(spark.read.parquet(staging_path), partition_keys)
+    repartition_for_write(staged_DF, partition_keys, staged_DF.count(), rows_per_file).write.mode(
+        "overwrite"
+    ).option("partitionOverwriteMode", "dynamic").partitionBy(*partition_keys).parquet(target_path)
+    delete_path(spark, staging_path)
+    print("METRIC MergedPartitions partitions=%d" % written_partitions_DF.count())
+    new_partitions_DF = updates_DF.join(written_partitions_DF, partition_keys, "left_anti")
+    written_partitions_DF.unpersist()
+    return new_partitions_DF
 
 
 class GroupFilter:
@@ -15,180 +201,313 @@ class GroupFilter:
         self.filters = filters
 
 
-def apply_group_filter(source_DyF, group):
-    return Filter.apply(frame=source_DyF, f=group.filters)
+def label_frame(source_DF, group_filters, default_group="default_group"):
+    """
+    Compute the group of every row once into the GROUP_COLUMN column:
+    the first group whose filters (Spark SQL boolean column) match, else the default group
+    """
+    group_label = F.lit(default_group)
+    for gf in reversed(group_filters):
+        group_label = F.when(F.coalesce(gf.filters, F.lit(False)), F.lit(gf.name)).otherwise(
+            group_label
+        )
+    return source_DF.withColumn(GROUP_COLUMN, group_label)
 
 
-def threadedRoute(glue_ctx, source_DyF, group_filters) -> DynamicFrameCollection:
+def count_groups(labelled_DF, group_names, metric_dimensions=None):
+    """
+    Count the rows per group in one pass, reported as job metrics
+    and published to CloudWatch with the metric_dimensions (None does not publish)
+    """
+    group_counts = dict.fromkeys(group_names, 0)
+    for row in labelled_DF.groupBy(GROUP_COLUMN).count().collect():
+        group_counts[row[GROUP_COLUMN]] = row["count"]
+    for group_name, rows in group_counts.items():
+        print("METRIC RoutedRows group=%s rows=%d" % (group_name, rows))
+    if metric_dimensions is not None:
+        put_count_metrics("RoutedRows", metric_dimensions, "Group", group_counts)
+    return group_counts
+
+
+def route_frame(
+    glue_ctx, labelled_DF, group_names, rejected_groups=("default_group",), target_schema=None
+) -> DynamicFrameCollection:
+    """
+    Derive one DynamicFrame per group from the labelled (persisted) rows,
+    only the rejected groups keep the REJECTED_RULES_COLUMN and the raw string values,
+    the other groups are cast to the target schema
+    """
     dynamic_frames = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_filter = {
-            executor.submit(apply_group_filter, source_DyF, gf): gf
-            for gf in group_filters
-        }
-        for future in concurrent.futures.as_completed(future_to_filter):
-            gf = future_to_filter[future]
-            if future.exception() is not None:
-                print("%r generated an exception: %s" % (gf, future.exception()))
-            else:
-                dynamic_frames[gf.name] = future.result()
+    for group_name in group_names:
+        group_DF = labelled_DF.filter(F.col(GROUP_COLUMN) == group_name).drop(
+            GROUP_COLUMN, VALID_COLUMN
+        )
+        if group_name not in rejected_groups:
+            group_DF = group_DF.drop(REJECTED_RULES_COLUMN)
+            if target_schema:
+                group_DF = cast_frame(group_DF, target_schema)
+        dynamic_frames[group_name] = DynamicFrame.fromDF(group_DF, glue_ctx, group_name)
     return DynamicFrameCollection(dynamic_frames, glue_ctx)
 
 
-args = getResolvedOptions(sys.argv, ["JOB_NAME"])
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-job = Job(glueContext)
-job.init(args["JOB_NAME"], args)
+def validate_transactions(
+    glue_ctx, source_DF, partition_keys, source_config, metric_dimensions=None
+):
+    """
+    Validate and label the rows once (persisted) with the rules of the source_config,
+    then derive every group from them
+    :return: labelled (persisted) DataFrame, dict of group: rows, DynamicFrameCollection
+    """
+    group_filters = [GroupFilter(name="good_records", filters=F.col(VALID_COLUMN))]
+    group_names = [gf.name for gf in group_filters] + ["default_group"]
+    labelled_DF = label_frame(
+        add_partition_columns(
+            add_event_date_column(
+                validate_frame(source_DF, source_config["rules"]),
+                source_config["event_date_columns"],
+            ),
+            partition_keys,
+        ),
+        group_filters,
+    ).persist(StorageLevel.MEMORY_AND_DISK)
+    group_counts = count_groups(labelled_DF, group_names, metric_dimensions)
+    return (
+        labelled_DF,
+        group_counts,
+        route_frame(
+            glue_ctx, labelled_DF, group_names, target_schema=source_config["target_schema"]
+        ),
+    )
 
-# Script generated for node S3 DL Bronze Txn Jenji
-S3DLBronzeTxnJenji_node1 = glueContext.create_dynamic_frame.from_catalog(
-    database="wk-glue-data-catalog-arrivalhub",
-    table_name="tb_transaction_raw_pendval_jenji",
-    transformation_ctx="S3DLBronzeTxnJenji_node1",
-)
 
-# Script generated for node Filter out columns
-Filteroutcolumns_node2 = DropFields.apply(
-    frame=S3DLBronzeTxnJenji_node1,
-    paths=["_id.oid", "_id"],
-    transformation_ctx="Filteroutcolumns_node2",
-)
+def run_job(
+    glue_ctx,
+    source_config,
+    push_down_predicate=None,
+    partition_keys=None,
+    rows_per_file=TARGET_FILE_SIZE_MB * 1024 * 1024 // ESTIMATED_ROW_BYTES,
+    dedupe=False,
+    write_mode="append",
+    validated_path=None,
+    rejected_path=None,
+    merge_staging_path=MERGE_STAGING_PATH,
+    metric_dimensions=None,
+):
+    """
+    Read the new raw Jenji rows, validate them, write the valid rows (Parquet)
+    and the rejected ones (JSON with the failed rule ids). The row counts are published
+    to CloudWatch with the metric_dimensions, e.g. {"JobName": ...}
+    :param source_config: Jenji rule config, see JENJI_RULES_CONFIG
+    :param partition_keys: Output partition keys, default the ones of the source_config
+    :param validated_path: Output of the valid rows, default the one of the source_config
+    :param rejected_path: Output of the rejected rows, default the one of the source_config
+    :return: dict of group_counts, rule_failures. None when there is no new data
+    """
+    spark = glue_ctx.spark_session
+    partition_keys = list(partition_keys or source_config["partition_keys"])
+    validated_path = validated_path or source_config["validated_path"]
+    rejected_path = rejected_path or source_config["rejected_path"]
+
+    # Script generated for node S3 DL Bronze Txn Jenji
+    S3DLBronzeTxnJenji_node1 = glue_ctx.create_dynamic_frame.from_catalog(
+        database=source_config["database"],
+        table_name=source_config["table_name"],
+        transformation_ctx="S3DLBronzeTxnJenji_node1",
+        **({"push_down_predicate": push_down_predicate} if push_down_predicate else {}),
+    )
+
+    # Script generated for node Filter out columns
+    Filteroutcolumns_node2 = DropFields.apply(
+        frame=S3DLBronzeTxnJenji_node1,
+        paths=source_config["drop_fields"],
+        transformation_ctx="Filteroutcolumns_node2",
+    )
+
+    Filteroutcolumns_DF = Filteroutcolumns_node2.toDF()
+    if not Filteroutcolumns_DF.columns:
+        print("WARNING: No new data since the last job bookmark, nothing to validate")
+        return None
+
+    # Script generated for node Validate fields
+    (
+        Labelledrows_node1684510082790,
+        group_counts,
+        Validatefields_node1684510082794,
+    ) = validate_transactions(
+        glue_ctx, Filteroutcolumns_DF, partition_keys, source_config, metric_dimensions
+    )
+
+    # Script generated for node good_records
+    good_records_node1684510082995 = SelectFromCollection.apply(
+        dfc=Validatefields_node1684510082794,
+        key="good_records",
+        transformation_ctx="good_records_node1684510082995",
+    )
 
-# Script generated for node Validate fields
-Validatefields_node1684510082794 = threadedRoute(
-    glueContext,
-    source_DyF=Filteroutcolumns_node2,
-    group_filters=[
-        GroupFilter(
-            name="good_records",
-            filters=lambda row: (
-                bool(re.match(".*", row["cardprivatepan"]))
-                and bool(re.match(".*", row["cardprotransactionid"]))
-                and bool(re.match(".*", row["category"]))
-                and bool(
-                    re.match(
-                        "^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{3}Z$",
-                        row["createdat"],
-                    )
-                )
-                and bool(re.match(".*", row["currency"]))
-                and bool(re.match(".*", row["eventtype"]))
-                and bool(re.match(".*", row["jenjiexpenseid"]))
-                and bool(
-                    re.match(
-                        "^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{3}Z$",
-                        row["lastupdatedat"],
-                    )
-                )
-                and bool(re.match(".*", row["seller"]))
-                and bool(re.match(".*", row["state"]))
-                and row["taxrecoverable"] >= 0
-                and row["taxrecoverable"] <= 1
-                and bool(
-                    re.match(
-                        "^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{3}Z$",
-                        row["time"],
-                    )
-                )
-                and bool(
-                    re.match("^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$", row["total"])
-                )
-                and bool(
-                    re.match(
-                        "^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$", row["totalwithouttax"]
-                    )
-                )
+    # Script generated for node default_group
+    default_group_node1684510082986 = SelectFromCollection.apply(
+        dfc=Validatefields_node1684510082794,
+        key="default_group",
+        transformation_ctx="default_group_node1684510082986",
+    )
+
+    good_records_count = group_counts["good_records"]
+    Dedupedrows_DF = None
+    if dedupe:
+        Dedupedrows_DF = dedupe_latest(
+            good_records_node1684510082995.toDF(), DEDUPE_KEY_COLUMN, DEDUPE_ORDER_COLUMN
+        )
+        written_versions_DF = load_written_versions(
+            spark,
+            validated_path,
+            Dedupedrows_DF,
+            partition_keys,
+            DEDUPE_KEY_COLUMN,
+            DEDUPE_ORDER_COLUMN,
+        )
+        if written_versions_DF is not None:
+            Dedupedrows_DF = drop_written_versions(
+                Dedupedrows_DF, written_versions_DF, DEDUPE_KEY_COLUMN, DEDUPE_ORDER_COLUMN
+            )
+        Dedupedrows_DF = Dedupedrows_DF.persist(StorageLevel.MEMORY_AND_DISK)
+        deduped_count = Dedupedrows_DF.count()
+        print("METRIC DedupedRows rows=%d" % (good_records_count - deduped_count))
+        good_records_count = deduped_count
+        good_records_node1684510082995 = DynamicFrame.fromDF(
+            Dedupedrows_DF, glue_ctx, "good_records"
+        )
+    if write_mode == "merge":
+        # The partitions not written yet are appended by the sink, which registers them
+        good_records_node1684510082995 = DynamicFrame.fromDF(
+            merge_into_partitions(
+                spark,
+                dedupe_latest(
+                    good_records_node1684510082995.toDF(), DEDUPE_KEY_COLUMN, DEDUPE_ORDER_COLUMN
+                ),
+                validated_path,
+                merge_staging_path,
+                partition_keys,
+                DEDUPE_KEY_COLUMN,
+                DEDUPE_ORDER_COLUMN,
+                rows_per_file,
             ),
-        ),
-        GroupFilter(
-            name="default_group",
-            filters=lambda row: (
-                not (
-                    bool(re.match(".*", row["cardprivatepan"]))
-                    and bool(re.match(".*", row["cardprotransactionid"]))
-                    and bool(re.match(".*", row["category"]))
-                    and bool(
-                        re.match(
-                            "^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{3}Z$",
-                            row["createdat"],
-                        )
-                    )
-                    and bool(re.match(".*", row["currency"]))
-                    and bool(re.match(".*", row["eventtype"]))
-                    and bool(re.match(".*", row["jenjiexpenseid"]))
-                    and bool(
-                        re.match(
-                            "^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{3}Z$",
-                            row["lastupdatedat"],
-                        )
-                    )
-                    and bool(re.match(".*", row["seller"]))
-                    and bool(re.match(".*", row["state"]))
-                    and row["taxrecoverable"] >= 0
-                    and row["taxrecoverable"] <= 1
-                    and bool(
-                        re.match(
-                            "^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{3}Z$",
-                            row["time"],
-                        )
-                    )
-                    and bool(
-                        re.match("^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$", row["total"])
-                    )
-                    and bool(
-                        re.match(
-                            "^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$",
-                            row["totalwithouttax"],
-                        )
-                    )
-                )
+            glue_ctx,
+            "good_records",
+        )
+
+    # Script generated for node S3 DL Bronze Ok Txn Jenji
+    S3DLBronzeOkTxnJenji_node3 = glue_ctx.getSink(
+        path=validated_path,
+        connection_type="s3",
+        updateBehavior="UPDATE_IN_DATABASE",
+        partitionKeys=partition_keys,
+        compression="snappy",
+        enableUpdateCatalog=bool(source_config["catalog_table_name"]),
+        transformation_ctx="S3DLBronzeOkTxnJenji_node3",
+    )
+    if source_config["catalog_table_name"]:
+        S3DLBronzeOkTxnJenji_node3.setCatalogInfo(
+            catalogDatabase=source_config["database"],
+            catalogTableName=source_config["catalog_table_name"],
+        )
+    S3DLBronzeOkTxnJenji_node3.setFormat("glueparquet")
+    S3DLBronzeOkTxnJenji_node3.writeFrame(
+        DynamicFrame.fromDF(
+            repartition_for_write(
+                good_records_node1684510082995.toDF(),
+                partition_keys,
+                good_records_count,
+                rows_per_file,
             ),
-        ),
-    ],
-)
+            glue_ctx,
+            "good_records",
+        )
+    )
+    # Script generated for node S3 DL Bronze Nok Txn Jenji
+    S3DLBronzeNokTxnJenji_node1684510783099 = glue_ctx.write_dynamic_frame.from_options(
+        frame=default_group_node1684510082986,
+        connection_type="s3",
+        format="json",
+        connection_options={
+            "path": rejected_path,
+            "partitionKeys": partition_keys,
+        },
+        transformation_ctx="S3DLBronzeNokTxnJenji_node1684510783099",
+    )
 
-# Script generated for node good_records
-good_records_node1684510082995 = SelectFromCollection.apply(
-    dfc=Validatefields_node1684510082794,
-    key="good_records",
-    transformation_ctx="good_records_node1684510082995",
-)
+    rule_failures = count_rule_failures(
+        Labelledrows_node1684510082790, source_config["rules"], metric_dimensions
+    )
+    Labelledrows_node1684510082790.unpersist()
+    if Dedupedrows_DF is not None:
+        Dedupedrows_DF.unpersist()
+    return {"group_counts": group_counts, "rule_failures": rule_failures}
 
-# Script generated for node default_group
-default_group_node1684510082986 = SelectFromCollection.apply(
-    dfc=Validatefields_node1684510082794,
-    key="default_group",
-    transformation_ctx="default_group_node1684510082986",
-)
 
-# Script generated for node S3 DL Bronze Ok Txn Jenji
-S3DLBronzeOkTxnJenji_node3 = glueContext.getSink(
-    path="s3://rgi-sandbox-repo-dev/DataLakeV1/ArrivalHub/Validated/Jenji/v1/",
-    connection_type="s3",
-    updateBehavior="UPDATE_IN_DATABASE",
-    partitionKeys=[],
-    compression="snappy",
-    enableUpdateCatalog=True,
-    transformation_ctx="S3DLBronzeOkTxnJenji_node3",
-)
-S3DLBronzeOkTxnJenji_node3.setCatalogInfo(
-    catalogDatabase="wk-glue-data-catalog-arrivalhub",
-    catalogTableName="tb_transaction_raw_valid_jenji_v1",
-)
-S3DLBronzeOkTxnJenji_node3.setFormat("glueparquet")
-S3DLBronzeOkTxnJenji_node3.writeFrame(good_records_node1684510082995)
-# Script generated for node S3 DL Bronze Nok Txn Jenji
-S3DLBronzeNokTxnJenji_node1684510783099 = glueContext.write_dynamic_frame.from_options(
-    frame=default_group_node1684510082986,
-    connection_type="s3",
-    format="json",
-    connection_options={
-        "path": "s3://rgi-sandbox-repo-dev/DataLakeV1/ArrivalHub/Rejected/Jenji/",
-        "partitionKeys": [],
-    },
-    transformation_ctx="S3DLBronzeNokTxnJenji_node1684510783099",
-)
+def main():
+    args = getResolvedOptions(sys.argv, ["JOB_NAME"])
+    sc = SparkContext()
+    glueContext = GlueContext(sc)
+    job = Job(glueContext)
+    job.init(args["JOB_NAME"], args)
+
+    source_config = load_source_config(
+        get_job_argument("rules_config", JENJI_RULES_CONFIG), JENJI_SOURCE_ID
+    )
+
+    # Incremental mode: job bookmarks (state kept per transformation_ctx) read only the new
+    # files, the optional ingestion date predicate prunes the partitions listed: the
+    # ingestion_date partitions of the raw table, written by the mvsel2val job
+    if get_job_argument("job-bookmark-option", "job-bookmark-disable") != "job-bookmark-enable":
+        print("WARNING: Job bookmarks are not enabled, every run reads the whole table")
+    push_down_predicate = get_job_argument("push_down_predicate") or build_push_down_predicate(
+        get_job_argument("ingestion_partition_column", source_config["ingestion_partition_column"]),
+        get_job_argument("ingestion_lookback_days"),
+    )
+    print("PUSH DOWN PREDICATE:", push_down_predicate)
+
+    # Output partitioning (e.g. "event_date" or "year,month,day") and target file size
+    partition_keys = get_job_argument(
+        "partition_keys", ",".join(source_config["partition_keys"])
+    ).split(",")
+    target_file_size_mb = int(get_job_argument("target_file_size_mb", TARGET_FILE_SIZE_MB))
+    estimated_row_bytes = int(get_job_argument("estimated_row_bytes", ESTIMATED_ROW_BYTES))
+    rows_per_file = max(1, target_file_size_mb * 1024 * 1024 // estimated_row_bytes)
+    print("PARTITION KEYS:", partition_keys, "ROWS PER FILE:", rows_per_file)
+
+    # Optional dedupe of the valid rows: the latest version per expense within the batch,
+    # then only if newer than the version already written in the partition of the expense
+    dedupe = get_job_argument("dedupe", "false").lower() == "true"
+    print("DEDUPE:", dedupe)
+
+    # Write mode of the valid rows: append, or merge (upsert on the expense id) rewriting
+    # only the partitions already written that the new versions touch
+    write_mode = get_job_argument("write_mode", "append")
+    if write_mode not in ("append", "merge"):
+        raise Exception(f"ERROR: Unknown write_mode {write_mode}")
+    print("WRITE MODE:", write_mode)
+    if write_mode == "merge":
+        # The compaction replaces the files of the partitions that the merge rewrites,
+        # the bookmarks are not committed so that the next run merges the same files
+        compaction_job_name = get_job_argument("compaction_job_name", COMPACTION_JOB_NAME)
+        active_job_run_ids = get_active_job_run_ids(compaction_job_name)
+        if active_job_run_ids:
+            raise Exception(
+                f"ERROR: {compaction_job_name} is running {active_job_run_ids}, merge refused"
+            )
+
+    run_job(
+        glueContext,
+        source_config,
+        push_down_predicate=push_down_predicate,
+        partition_keys=partition_keys,
+        rows_per_file=rows_per_file,
+        dedupe=dedupe,
+        write_mode=write_mode,
+        metric_dimensions={"JobName": args["JOB_NAME"]},
+    )
+    job.commit()
+
 
-job.commit()
+if __name__ == "__main__":
+    main()
@@ -2,33 +2,61 @@
 AWS S3 Lambda Trigger with high level validations
 """
 
+import concurrent.futures
+import json
+import os
 import urllib.parse
-from scripts import aws_utils
+from scripts import aws_metrics, aws_utils
 from scripts.aws_s3_triggers import validation_incoming_source_delivery
 
+# Records of a batch (S3 or SQS event) are processed concurrently by a bounded thread pool
+LAMBDA_MAX_WORKERS = int(os.environ.get('LAMBDA_MAX_WORKERS', '8'))
 
-def lambda_handler(event, context):
-    """Function called by S3 as Trigger"""
+# Clients created at module init, during the Lambda init phase and not on the first invocation
+LAMBDA_PREWARM_CLIENTS = os.environ.get('LAMBDA_PREWARM_CLIENTS', 'true').lower() == 'true'
+if LAMBDA_PREWARM_CLIENTS and 'AWS_LAMBDA_RUNTIME_API' in os.environ:  # Only in the Lambda runtime
+    aws_utils.prewarm_aws_clients()
 
-    # Init AWS common objects
-    lambda_func_name = aws_utils.get_current_lambda_function_name()
-    region_name = aws_utils.get_current_region_name()
 
-    # Get the object from the trigger event
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    object_key = urllib.parse.unquote_plus(
-        event['Records'][0]['s3']['object']['key'], encoding='utf-8')
+def get_s3_objects_from_record(record):
+    """
+    Extract the S3 objects from an event record, either an S3 notification
+    record or an SQS message wrapping an S3 notification
+    :param record: Event record
+    :return: list of (bucket_name, object_key, object_etag, event_time, object_version), None when
+    not in the record. The version is the versionId of a versioned bucket, else the event sequencer
+    """
+    if record.get('eventSource') == 'aws:sqs':
+        s3_records = json.loads(record['body']).get('Records', [])  # s3:TestEvent has none
+    else:
+        s3_records = [record]
+    return [(s3_record['s3']['bucket']['name'],
+             urllib.parse.unquote_plus(s3_record['s3']['object']['key'], encoding='utf-8'),
+             s3_record['s3']['object'].get('eTag'), s3_record.get('eventTime'),
+             s3_record['s3']['object'].get('versionId') or s3_record['s3']['object'].get('sequencer'))
+            for s3_record in s3_records if 's3' in s3_record]
 
-    print("CONTEXT:", context)
-    print("LAMBDA FUNC:", lambda_func_name)
-    print("REGION NAME:", region_name)
+
+def process_s3_object(bucket_name, object_key, lambda_func_name, object_etag=None, event_time=None,
+                      object_version=None):
+    """
+    Validate one delivered S3 object
+    :param bucket_name: Bucket name
+    :param object_key: Prefix key
+    :param lambda_func_name: Lambda function name
+    :param object_etag: ETag of the delivered version, from the S3 event
+    :param event_time: Time of the S3 event
+    :param object_version: versionId or sequencer of the delivered version, from the S3 event
+    :return: S3 URI of the object. On FAILURE the exception
+    """
     print("BUCKET NAME:", bucket_name)
     print("OBJECT KEY:", object_key)
 
     # Limit the trigger to only few S3 prefixes
     if '/ArrivalHub/Delivered/' in object_key:
         try:
-            validation_incoming_source_delivery(bucket_name, object_key)
+            validation_incoming_source_delivery(bucket_name, object_key, object_etag, event_time,
+                                                object_version=object_version)
 
         except Exception as exception_handler:
             print(exception_handler)
@@ -38,3 +66,65 @@ def lambda_handler(event, context):
         print(f'WARNING: Per design ignoring {object_key} in {bucket_name} in {lambda_func_name}')
 
     return 's3://' + bucket_name + '/' + object_key
+
+
+def process_record(record, lambda_func_name):
+    """
+    Validate all the S3 objects of one event record
+    :param record: Event record
+    :param lambda_func_name: Lambda function name
+    :return: list of S3 URI. On FAILURE the exception
+    """
+    return [process_s3_object(bucket_name, object_key, lambda_func_name, object_etag, event_time, object_version)
+            for bucket_name, object_key, object_etag, event_time, object_version
+            in get_s3_objects_from_record(record)]
+
+
+def get_record_identifier(record):
+    """Identifier of the record in the partial batch failure response"""
+    if 'messageId' in record:  # SQS
+        return record['messageId']
+    return 's3://' + record['s3']['bucket']['name'] + '/' + record['s3']['object']['key']
+
+
+def lambda_handler(event, context):
+    """Function called by S3 (or SQS) as Trigger, all the event records are processed"""
+
+    # Init AWS common objects
+    lambda_func_name = aws_utils.get_current_lambda_function_name(use_cache=True)
+    region_name = aws_utils.get_current_region_name(use_cache=True)
+    records = event.get('Records', [])
+    aws_utils.clear_s3_tag_sets()  # Tag sets are cached within one invocation only
+    aws_utils.set_lambda_context(context)  # Retries stop before the invocation timeout
+    aws_metrics.reset_api_metrics()  # API calls are accounted per invocation
+
+    print("CONTEXT:", context)
+    print("LAMBDA FUNC:", lambda_func_name)
+    print("REGION NAME:", region_name)
+    print("RECORDS:", len(records))
+
+    batch_item_failures = []
+    first_exception = None
+    max_workers = max(1, min(LAMBDA_MAX_WORKERS, len(records)))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_record = {
+                executor.submit(process_record, record, lambda_func_name): record
+                for record in records
+            }
+            for future in concurrent.futures.as_completed(future_to_record):
+                record = future_to_record[future]
+                if future.exception() is not None:
+                    print(f"ERROR: Record {get_record_identifier(record)} failed: {future.exception()}")
+                    batch_item_failures.append({'itemIdentifier': get_record_identifier(record)})
+                    first_exception = first_exception or future.exception()
+    finally:
+        aws_metrics.emit_api_metrics({'FunctionName': lambda_func_name})
+
+    # S3 invokes asynchronously and only retries the whole event on exception,
+    # SQS retries only the failed messages listed in batchItemFailures
+    if first_exception is not None \
+            and not any(record.get('eventSource') == 'aws:sqs' for record in records):
+        raise first_exception
+
+    return {'batchItemFailures': batch_item_failures}
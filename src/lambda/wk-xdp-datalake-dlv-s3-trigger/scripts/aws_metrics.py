@@ -0,0 +1,246 @@
+"""
+AWS API call accounting: calls, errors, retries, latency histogram and bytes per operation,
+collected from the botocore events of the clients and emitted as CloudWatch EMF JSON lines
+(Lambda) or published with PutMetricData (Glue, whose logs are not extracted as EMF)
+"""
+
+import json
+import os
+import threading
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'DataLake/ArrivalHub')
+# Upper bounds in milliseconds of the latency buckets, the last bucket has no bound
+API_LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_API_METRICS_START_KEY = 'api_metrics_start_tm'
+PUT_METRIC_DATA_MAX_METRICS = 1000  # AWS limit of metrics per PutMetricData call
+
+
+def get_operation_name(event_name):
+    """Operation of a botocore event name, e.g. after-call.s3.CopyObject -> s3.CopyObject"""
+    return '.'.join(event_name.split('.')[-2:])
+
+
+class ApiMetrics:
+    """
+    Thread safe counters per operation ('service.Operation'): Calls, Errors (by error code),
+    Retries, Bytes, LatencySum, LatencyMax and the latency histogram in milliseconds
+    """
+
+    def __init__(self):
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def _get_operation(self, operation_name):
+        operation = self.operations.get(operation_name)
+        if operation is None:
+            operation = self.operations[operation_name] = {
+                'Calls': 0, 'Errors': {}, 'Retries': 0, 'Bytes': 0, 'LatencySum': 0.0,
+                'LatencyMax': 0.0, 'Histogram': [0] * (len(API_LATENCY_BUCKETS_MS) + 1)}
+        return operation
+
+    def record_call(self, operation_name, latency_ms, error_code=None, retries=0):
+        """Account one API call, retries included in its latency"""
+        bucket_idx = next((idx for idx, bound in enumerate(API_LATENCY_BUCKETS_MS) if latency_ms <= bound),
+                          len(API_LATENCY_BUCKETS_MS))
+        with self.lock:
+            operation = self._get_operation(operation_name)
+            operation['Calls'] += 1
+            operation['Retries'] += retries
+            operation['LatencySum'] += latency_ms
+            operation['LatencyMax'] = max(operation['LatencyMax'], latency_ms)
+            operation['Histogram'][bucket_idx] += 1
+            if error_code:
+                operation['Errors'][error_code] = operation['Errors'].get(error_code, 0) + 1
+
+    def record_bytes(self, operation_name, byte_count):
+        """Account bytes moved by an operation (e.g. the size of a copied object)"""
+        with self.lock:
+            self._get_operation(operation_name)['Bytes'] += byte_count
+
+    def get_call_count(self, prefix=''):
+        """Total calls of the operations starting with prefix, e.g. 's3.' or 'ssm.GetParameters'"""
+        with self.lock:
+            return sum(operation['Calls'] for operation_name, operation in self.operations.items()
+                       if operation_name.startswith(prefix))
+
+    def get_latency_percentile(self, operation_name, pct):
+        """Upper bound of the histogram bucket holding the percentile (LatencyMax for the last one)"""
+        with self.lock:
+            operation = self.operations.get(operation_name)
+            if not operation or not operation['Calls']:
+                return 0.0
+            rank = max(1, -(-operation['Calls'] * pct // 100))
+            cumulated = 0
+            for bucket_idx, count in enumerate(operation['Histogram']):
+                cumulated += count
+                if cumulated >= rank:
+                    break
+            if bucket_idx < len(API_LATENCY_BUCKETS_MS):
+                return min(float(API_LATENCY_BUCKETS_MS[bucket_idx]), operation['LatencyMax'])
+            return operation['LatencyMax']
+
+    def get_summary(self):
+        """dict of operation name: copy of its counters"""
+        with self.lock:
+            return {operation_name: dict(operation, Errors=dict(operation['Errors']),
+                                         Histogram=list(operation['Histogram']))
+                    for operation_name, operation in self.operations.items()}
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+
+
+_api_metrics = ApiMetrics()
+
+
+def get_api_metrics():
+    """Process wide ApiMetrics fed by the instrumented clients"""
+    return _api_metrics
+
+
+def reset_api_metrics():
+    """Zero the counters, e.g. at the start of an invocation"""
+    _api_metrics.reset()
+
+
+def _on_before_call(context, **kwargs):
+    context[_API_METRICS_START_KEY] = time.monotonic()
+
+
+def _on_after_call(http_response, parsed, context, event_name, **kwargs):
+    latency_ms = (time.monotonic() - context.get(_API_METRICS_START_KEY, time.monotonic())) * 1000
+    error_code = None
+    if http_response is not None and http_response.status_code >= 300:
+        error_code = parsed.get('Error', {}).get('Code') or str(http_response.status_code)
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0) if parsed else 0
+    _api_metrics.record_call(get_operation_name(event_name), latency_ms, error_code, retries)
+
+
+def _on_after_call_error(exception, context, event_name, **kwargs):
+    latency_ms = (time.monotonic() - context.get(_API_METRICS_START_KEY, time.monotonic())) * 1000
+    _api_metrics.record_call(get_operation_name(event_name), latency_ms, type(exception).__name__)
+
+
+def instrument_client(aws_client):
+    """
+    Register the accounting handlers on the botocore events of a client, once per client.
+    The before-call handler goes first so that a handler answering the call
+    (e.g. a local stub) is timed as well.
+    :param aws_client: boto3 client
+    :return: The same client
+    """
+    events = aws_client.meta.events
+    events.register_first('before-call', _on_before_call, unique_id='aws_metrics-before-call')
+    events.register('after-call', _on_after_call, unique_id='aws_metrics-after-call')
+    events.register('after-call-error', _on_after_call_error, unique_id='aws_metrics-after-call-error')
+    return aws_client
+
+
+def build_emf_documents(dimensions, namespace=None, api_metrics=None, timestamp_ms=None):
+    """
+    CloudWatch Embedded Metric Format documents: one per operation (dimensions + Operation)
+    and one total (dimensions only)
+    :param dimensions: dict of dimension name: value, e.g. {'FunctionName': ...}
+    :param namespace: CloudWatch namespace (default METRICS_NAMESPACE)
+    :param api_metrics: ApiMetrics (default the process wide one)
+    :param timestamp_ms: Epoch milliseconds (default now)
+    :return: list of dict
+    """
+    namespace = namespace or METRICS_NAMESPACE
+    api_metrics = api_metrics or _api_metrics
+    timestamp_ms = timestamp_ms or int(time.time() * 1000)
+    dimension_names = list(dimensions)
+
+    def emf_document(metric_units, values, extra_dimension_names=()):
+        return dict({'_aws': {'Timestamp': timestamp_ms, 'CloudWatchMetrics': [{
+            'Namespace': namespace, 'Dimensions': [dimension_names + list(extra_dimension_names)],
+            'Metrics': [{'Name': name, 'Unit': unit} for name, unit in metric_units]}]}},
+            **dimensions, **values)
+
+    summary = api_metrics.get_summary()
+    documents = []
+    for operation_name, operation in sorted(summary.items()):
+        documents.append(emf_document(
+            (('ApiCalls', 'Count'), ('ApiErrors', 'Count'), ('ApiRetries', 'Count'), ('ApiBytes', 'Bytes'),
+             ('ApiLatencyP50', 'Milliseconds'), ('ApiLatencyP99', 'Milliseconds'),
+             ('ApiLatencyMax', 'Milliseconds')),
+            {'Operation': operation_name, 'ApiCalls': operation['Calls'],
+             'ApiErrors': sum(operation['Errors'].values()), 'ApiRetries': operation['Retries'],
+             'ApiBytes': operation['Bytes'],
+             'ApiLatencyP50': round(api_metrics.get_latency_percentile(operation_name, 50), 3),
+             'ApiLatencyP99': round(api_metrics.get_latency_percentile(operation_name, 99), 3),
+             'ApiLatencyMax': round(operation['LatencyMax'], 3),
+             'ApiErrorCodes': operation['Errors'],
+             'ApiLatencyHistogram': {f'le{bound}': count for bound, count in zip(
+                 API_LATENCY_BUCKETS_MS + ('Inf',), operation['Histogram']) if count}},
+            ('Operation',)))
+    documents.append(emf_document(
+        (('ApiCalls', 'Count'), ('ApiErrors', 'Count'), ('ApiRetries', 'Count'), ('ApiBytes', 'Bytes')),
+        {'ApiCalls': sum(operation['Calls'] for operation in summary.values()),
+         'ApiErrors': sum(sum(operation['Errors'].values()) for operation in summary.values()),
+         'ApiRetries': sum(operation['Retries'] for operation in summary.values()),
+         'ApiBytes': sum(operation['Bytes'] for operation in summary.values())}))
+    return documents
+
+
+def emit_api_metrics(dimensions, namespace=None, reset=True):
+    """
+    Print the EMF documents of the API calls to stdout (CloudWatch Logs extracts the metrics)
+    :param dimensions: dict of dimension name: value, e.g. {'FunctionName': ...}
+    :param namespace: CloudWatch namespace (default METRICS_NAMESPACE)
+    :param reset: Zero the counters once emitted
+    :return: list of the emitted documents
+    """
+    documents = build_emf_documents(dimensions, namespace)
+    for document in documents:
+        print(json.dumps(document, separators=(',', ':')))
+    if reset:
+        reset_api_metrics()
+    return documents
+
+
+def build_metric_data(documents):
+    """
+    PutMetricData MetricData of EMF documents: one datum per metric of each document,
+    with the dimensions of the document
+    :param documents: list of dict, see build_emf_documents
+    :return: list of dict
+    """
+    metric_data = []
+    for document in documents:
+        directive = document['_aws']['CloudWatchMetrics'][0]
+        dimensions = [{'Name': name, 'Value': str(document[name])} for name in directive['Dimensions'][0]]
+        metric_data.extend({'MetricName': metric['Name'], 'Dimensions': dimensions,
+                            'Value': document[metric['Name']], 'Unit': metric['Unit']}
+                           for metric in directive['Metrics'])
+    return metric_data
+
+
+def put_api_metrics(cloudwatch_client, dimensions, namespace=None, reset=True):
+    """
+    Publish the metrics of the API calls with PutMetricData, for the processes whose logs are
+    not extracted as EMF (e.g. a Glue job). A failure is only logged.
+    :param cloudwatch_client: boto3 cloudwatch client
+    :param dimensions: dict of dimension name: value, e.g. {'JobName': ...}
+    :param namespace: CloudWatch namespace (default METRICS_NAMESPACE)
+    :param reset: Zero the counters once published
+    :return: list of the MetricData
+    """
+    namespace = namespace or METRICS_NAMESPACE
+    documents = build_emf_documents(dimensions, namespace)
+    metric_data = build_metric_data(documents)
+    total_document = documents[-1]
+    print(f"API calls: {total_document['ApiCalls']} Errors: {total_document['ApiErrors']}"
+          f" Retries: {total_document['ApiRetries']} Bytes: {total_document['ApiBytes']}")
+    try:
+        for idx in range(0, len(metric_data), PUT_METRIC_DATA_MAX_METRICS):
+            cloudwatch_client.put_metric_data(Namespace=namespace,
+                                              MetricData=metric_data[idx:idx + PUT_METRIC_DATA_MAX_METRICS])
+    except (BotoCoreError, ClientError) as exception_handler:
+        print(f'WARNING: Cannot publish the API metrics: {exception_handler}')
+    if reset:
+        reset_api_metrics()
+    return metric_data
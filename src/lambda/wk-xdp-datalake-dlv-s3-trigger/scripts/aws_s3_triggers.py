@@ -2,27 +2,47 @@
 AWS S3 Triggers
 """
 
-import boto3
+from datetime import datetime
+from botocore.exceptions import ClientError
 from scripts import aws_utils
 
 
-def validation_incoming_source_delivery(bucket_name, object_key):
+def parse_event_time(event_time):
+    """UTC datetime of an S3 event time, e.g. 2023-05-03T08:54:17.123Z, None when not given"""
+    if not event_time:
+        return None
+    return datetime.fromisoformat(event_time.replace('Z', '+00:00'))
+
+
+def validation_incoming_source_delivery(bucket_name, object_key, object_etag=None, event_time=None,
+                                        object_version=None):
     """
-    Simple validations for the incoming source (raw data) deliveries
+    Simple validations for the incoming source (raw data) deliveries.
+    With the ETag and the time of the S3 event the move is idempotent: the target name is
+    derived from the event, only this version of the object is copied (CopySourceIfMatch)
+    and a duplicate event of a version already moved stops at the ledger lookup, logged.
+    The versionId (or the sequencer) keeps a re-upload of identical content from being skipped.
     :param bucket_name: Bucket name
     :param object_key: Prefix key
+    :param object_etag: ETag of the delivered version, from the S3 event
+    :param event_time: Time of the S3 event, e.g. 2023-05-03T08:54:17.123Z
+    :param object_version: versionId of the delivered version or sequencer of the S3 event
     :return: -
     """
 
-    # Init AWS common objects
-    region_name = aws_utils.get_current_region_name()
+    # S3 notifications are delivered at least once
+    if object_etag:
+        processed_key = aws_utils.get_processed_key(bucket_name, object_key, object_etag, object_version)
+        if processed_key is not None:
+            print(f"WARNING: Duplicate event skipped, {object_key} (ETag {object_etag}, version {object_version}) "
+                  f"already moved to {processed_key['Target']} at {processed_key['ProcessedAt']}")
+            return
 
-    # Init AWS clients
-    ssm_client = boto3.client('ssm', region_name=region_name)  # Simple System Manager
+    # Init AWS common objects
+    region_name = aws_utils.get_current_region_name(use_cache=True)
 
-    # Get valid list of incoming sources id from Simple System Manager
-    valid_source_id_list = ssm_client.get_parameter(
-        Name='/datalake/bronze/source_id-list')['Parameter']['Value']
+    # Get valid list of incoming sources id from Simple System Manager (cached)
+    source_allow_list = aws_utils.get_source_allow_list(region_name=region_name)
     object_prefixes_list = object_key.split('/')  # Split in prefixes path
     object_prefixes_count = len(object_prefixes_list)
 
@@ -36,42 +56,75 @@ def validation_incoming_source_delivery(bucket_name, object_key):
     object_name = object_prefixes_list[-1]  # Get "filename"
     root_prefix = '/'.join(object_prefixes_list[:object_prefixes_count-3])
     print("OBJECT JSON:", object_name, " SOURCE ID:", source_id)
+    event_dtm = parse_event_time(event_time)  # Same target name for a duplicate event
 
     # Derive the next location where to move it
-    if len(object_key) > 4 and object_key[-5:] == '.json' \
-            and source_id in valid_source_id_list:
+    if source_allow_list.is_allowed(source_id, object_name):
         raise_exception_flg = False
         object_ext = object_key[-4:]
         object_tag_value = 'PendingSelection'  # TODO: Maybe get it from SSM # pylint: disable=W0511
         s3_move_to_location = root_prefix + '/' + object_tag_value + '/' + source_id + '/' \
-                            + aws_utils.prefix_object_name(object_name, iso_dt=True, iso_tm=True)
+                            + aws_utils.prefix_object_name(object_name, iso_dt=True, iso_tm=True, utc_dtm=event_dtm)
         print("OBJECT EXT:", object_ext)
     else:
         raise_exception_flg = True
         object_tag_value = 'Rejected'  # TODO: Maybe get it from SSM # pylint: disable=W0511
-        if source_id not in valid_source_id_list:
+        if source_id not in source_allow_list:
             s3_move_to_location = root_prefix + '/' + object_tag_value + '/' + '/' \
                                 + aws_utils.prefix_object_name(
-                                    object_name, iso_dt=True, iso_tm=True, uu_id=True)
+                                    object_name, iso_dt=True, iso_tm=True, uu_id=True, utc_dtm=event_dtm,
+                                    uuid_name=f'{bucket_name}/{object_key}#{object_etag}' if object_etag else None)
         else:
             s3_move_to_location = root_prefix + '/' + object_tag_value + '/' + source_id + '/' \
                                 + aws_utils.prefix_object_name(
-                                    object_name, iso_dt=True, iso_tm=True)
+                                    object_name, iso_dt=True, iso_tm=True, utc_dtm=event_dtm)
 
     # Move file to next location
     print("OBJECT MOVETO:", s3_move_to_location)
     new_object_tag_value = 'ProcessStatus'  # TODO: Maybe get it from SSM # pylint: disable=W0511
-    aws_utils.put_s3_key_tag(bucket_name, object_key, new_object_tag_value, object_tag_value)
     if 'PlaceHolder' not in object_key:  # TODO: To remove later # pylint: disable=W0511
-        aws_utils.exec_func_with_max_retries(
-            lambda: aws_utils.move_s3_key_from_to_location(
-                bucket_name, object_key, s3_move_to_location),
-            func_text=f"Moving from {bucket_name} {object_key} to {s3_move_to_location}"
-        )
+        # The tag is set on the target by the copy itself
+        try:
+            aws_utils.exec_func_with_max_retries(
+                lambda: aws_utils.move_s3_key_from_to_location(
+                    bucket_name, object_key, s3_move_to_location,
+                    tag_updates={new_object_tag_value: object_tag_value}, if_etag=object_etag),
+                func_text=f"Moving from {bucket_name} {object_key} to {s3_move_to_location}"
+            )
+        except ClientError as exception_handler:
+            if not object_etag or not is_already_moved(bucket_name, object_key, s3_move_to_location,
+                                                       exception_handler):
+                raise exception_handler
+            return
+        if object_etag:
+            aws_utils.put_processed_key(bucket_name, object_key, object_etag, s3_move_to_location,
+                                        object_tag_value, object_version)
     else:
+        aws_utils.put_s3_key_tag(bucket_name, object_key, new_object_tag_value, object_tag_value)
         print(f'WARNING: TEST not moved from {bucket_name} {object_key} to {s3_move_to_location}')  # TODO: To remove later # pylint: disable=W0511
 
     # TODO: The below may need to create a metric to set off an alarm # pylint: disable=W0511
     # TODO: Information from the Metadata may be collected for statistics # pylint: disable=W0511
     if raise_exception_flg:
         raise Exception(f"ERROR: Invalid SourceId or Extension, moved to {s3_move_to_location}")
+
+
+def is_already_moved(bucket_name, object_key, s3_move_to_location, exception_handler):
+    """
+    Tell whether a failed idempotent move is a duplicate: the source has been replaced by a
+    newer version (its own event moves it) or is gone because the target is already written
+    :param bucket_name: Bucket name
+    :param object_key: Prefix key of the source
+    :param s3_move_to_location: Prefix key of the target
+    :param exception_handler: ClientError of the move
+    :return: True when there is nothing left to do
+    """
+    error_code = exception_handler.response.get('Error', {}).get('Code')
+    if error_code in aws_utils.S3_PRECONDITION_ERROR_CODES:
+        print(f'WARNING: Duplicate event, {object_key} has been replaced by a newer version')
+        return True
+    if error_code in aws_utils.S3_NOT_FOUND_ERROR_CODES \
+            and aws_utils.exists_s3_key(bucket_name, s3_move_to_location):
+        print(f'WARNING: Duplicate event, {object_key} already moved to {s3_move_to_location}')
+        return True
+    return False
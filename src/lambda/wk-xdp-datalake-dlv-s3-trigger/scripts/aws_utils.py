@@ -2,103 +2,859 @@
 AWS utilities functions
 """
 
+import concurrent.futures
+import json
 import os
+import queue
+import random
+import re
 from datetime import datetime, timezone, timedelta
+import threading
 import time
+import urllib.parse
 import uuid
-from dateutil import parser
 import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+from botocore.exceptions import ClientError, NoCredentialsError, ParamValidationError
+from scripts import aws_metrics
 
+# Clients are cached per (service, region, config) and reused across warm invocations
+AWS_CLIENT_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_CLIENT_MAX_POOL_CONNECTIONS', '50'))
+AWS_CLIENT_TCP_KEEPALIVE = os.environ.get('AWS_CLIENT_TCP_KEEPALIVE', 'true').lower() == 'true'
+AWS_CLIENT_RETRY_MODE = os.environ.get('AWS_CLIENT_RETRY_MODE', 'standard')  # botocore retries per request
+_aws_clients = {}
+_aws_stub_clients = {}
+_aws_clients_lock = threading.Lock()
+
+# SSM parameters are cached in-process for SSM_PARAMETER_TTL_SEC and survive warm starts
+SSM_PARAMETER_TTL_SEC = int(os.environ.get('SSM_PARAMETER_TTL_SEC', '300'))
+SSM_GET_PARAMETERS_MAX_NAMES = 10  # AWS limit of names per GetParameters call
+SSM_THROTTLING_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException')
+_ssm_parameters = {}  # name: {'Value', 'Version', 'LoadedAt'}
+_ssm_parameters_lock = threading.Lock()
+
+# Allow-list of incoming source ids, parsed once per SSM parameter version
+SOURCE_ID_LIST_PARAMETER = '/datalake/bronze/source_id-list'
+SOURCE_DEFAULT_EXTENSIONS = ('.json',)
+_source_allow_lists = {}  # parameter name: SourceAllowList
+
+# S3 copy: single CopyObject for small objects, parallel UploadPartCopy for large ones
+S3_MAX_SINGLE_COPY_SIZE = 5 * 1024 ** 3  # AWS limit of CopyObject
+S3_MAX_MULTIPART_PARTS = 10000  # AWS limit of parts per multipart upload
+S3_MULTIPART_COPY_THRESHOLD = int(os.environ.get('S3_MULTIPART_COPY_THRESHOLD', str(256 * 1024 ** 2)))
+S3_MULTIPART_COPY_PART_SIZE = int(os.environ.get('S3_MULTIPART_COPY_PART_SIZE', str(128 * 1024 ** 2)))
+S3_MULTIPART_COPY_MAX_WORKERS = int(os.environ.get('S3_MULTIPART_COPY_MAX_WORKERS', '10'))
+S3_COPY_HEAD_FIELDS = ('CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage',
+                       'ContentType', 'Expires', 'Metadata', 'ServerSideEncryption',
+                       'SSEKMSKeyId', 'StorageClass', 'WebsiteRedirectLocation')
+S3_NOT_FOUND_ERROR_CODES = ('NoSuchKey', '404')  # HEAD errors have the HTTP status as code
+S3_PRECONDITION_ERROR_CODES = ('PreconditionFailed', '412')
+
+# S3 bulk move: parallel copies then batched DeleteObjects of the copied sources
+S3_DELETE_OBJECTS_MAX_KEYS = 1000  # AWS limit of keys per DeleteObjects call
+S3_MOVE_MAX_WORKERS = int(os.environ.get('S3_MOVE_MAX_WORKERS', '32'))
+
+# S3 parallel listing: one lister per sub-prefix (e.g. per source_id)
+S3_LIST_MAX_WORKERS = int(os.environ.get('S3_LIST_MAX_WORKERS', '8'))
+S3_LIST_QUEUE_SIZE = 10000  # Listed keys buffered ahead of the consumer
+
+# S3 tag sets read within a run, so that a tag update costs one PUT
+S3_TAG_MAX_WORKERS = int(os.environ.get('S3_TAG_MAX_WORKERS', '16'))
+_s3_tag_sets = {}  # (bucket_name, object_key): TagSet
+_s3_tag_sets_lock = threading.Lock()
+
+# Ledger of the moved (bucket, key, ETag, version), so that a duplicate S3 event costs one lookup,
+# the version (versionId or event sequencer) tells a re-upload of identical content from a duplicate:
+# in-process (kept across warm invocations), and in DynamoDB when PROCESSED_KEY_TABLE is set
+PROCESSED_KEY_TABLE = os.environ.get('PROCESSED_KEY_TABLE')
+PROCESSED_KEY_TTL_SEC = int(os.environ.get('PROCESSED_KEY_TTL_SEC', str(7 * 24 * 3600)))
+PROCESSED_KEY_MAX_LOCAL = 100000  # Entries kept in-process, the oldest are dropped first
+_processed_keys = {}  # (bucket_name, object_key, object_etag[, object_version]): {'Target', 'Status', 'ProcessedAt'}
+_processed_keys_lock = threading.Lock()
+
+# Retries of exec_func_with_max_retries: exponential backoff with full jitter, fatal errors
+# raised at once, a deadline before the Lambda timeout and a retry quota shared by the threads
+RETRY_BASE_SLEEP_SEC = float(os.environ.get('RETRY_BASE_SLEEP_SEC', '1'))
+RETRY_MAX_SLEEP_SEC = float(os.environ.get('RETRY_MAX_SLEEP_SEC', '20'))
+RETRY_DEADLINE_MARGIN_SEC = float(os.environ.get('RETRY_DEADLINE_MARGIN_SEC', '2'))
+RETRY_TOKEN_BUCKET_CAPACITY = int(os.environ.get('RETRY_TOKEN_BUCKET_CAPACITY', '500'))
+RETRY_COST = 5  # Tokens taken by a retry
+RETRY_THROTTLING_COST = 10  # Tokens taken by a retry after a throttling error
+RETRY_SUCCESS_REFILL = 1  # Tokens given back by a success without retry
+RETRY_THROTTLING_ERROR_CODES = SSM_THROTTLING_ERROR_CODES + (
+    'SlowDown', 'RequestLimitExceeded', 'RequestThrottled', 'RequestThrottledException',
+    'ThrottledException', 'ProvisionedThroughputExceededException', 'BandwidthLimitExceeded')
+RETRY_TRANSIENT_ERROR_CODES = ('InternalError', 'InternalFailure', 'ServiceUnavailable', 'RequestTimeout',
+                               'RequestTimeoutException', 'PriorRequestNotComplete', 'OperationAborted',
+                               'IDPCommunicationError')
+RETRY_FATAL_EXCEPTIONS = (NoCredentialsError, ParamValidationError)
+_lambda_context = None  # Context of the running Lambda invocation, see set_lambda_context
+
+# Region and function name resolved once per container (see use_cache)
+_current_names = {}  # 'region_name', 'lambda_function_name': value
+
+
+def get_current_region_name(use_cache=False):
+    """
+    Dynamically determine the AWS Region (env, session)), a boto3 Session is only
+    created when the environment has none (in Lambda AWS_REGION is always set)
+    :param use_cache: Resolve it once per container
+    :return: Region name or None
+    """
+    if use_cache and 'region_name' in _current_names:
+        return _current_names['region_name']
+    region_name = os.environ.get('AWS_REGION') \
+        or os.environ.get('AWS_DEFAULT_REGION') \
+        or (boto3.DEFAULT_SESSION.region_name if boto3.DEFAULT_SESSION else None) \
+        or boto3.Session().region_name \
+        or None
+    _current_names['region_name'] = region_name
+    return region_name
+
+
+def get_current_lambda_function_name(use_cache=False):
+    """
+    Dynamically determine the AWS Lambda Function Name (env))
+    :param use_cache: Resolve it once per container
+    :return: Function name. On FAILURE KeyError
+    """
+    if use_cache and 'lambda_function_name' in _current_names:
+        return _current_names['lambda_function_name']
+    _current_names['lambda_function_name'] = os.environ['AWS_LAMBDA_FUNCTION_NAME']
+    return _current_names['lambda_function_name']
+
+
+def clear_current_names():
+    """Forget the region and function name resolved with use_cache"""
+    _current_names.clear()
+
+
+def prewarm_aws_clients(region_name=None):
+    """
+    Create the clients used by the S3 trigger ahead of the first invocation (e.g. at module
+    init outside the handler), with the same registry keys as the helpers use them
+    :param region_name: AWS Region of the SSM client (default get_current_region_name)
+    :return: list of the clients
+    """
+    aws_clients = [get_aws_client('s3'),
+                   get_aws_client('ssm', region_name=region_name or get_current_region_name(use_cache=True))]
+    if PROCESSED_KEY_TABLE:
+        aws_clients.append(get_aws_client('dynamodb'))
+    return aws_clients
+
+
+def get_aws_client(service_name, region_name=None, max_pool_connections=None,
+                   tcp_keepalive=None, **config_kwargs):
+    """
+    Get a boto3 client from the module registry, create it only on first use.
+    The same client (and its connection pool) is shared by all the helpers,
+    across loop iterations and across warm Lambda invocations.
+    Its calls are accounted by aws_metrics.
+    :param service_name: AWS service name, e.g. 's3', 'ssm'
+    :param region_name: AWS Region, None lets boto3 resolve it
+    :param max_pool_connections: Size of the connection pool (default AWS_CLIENT_MAX_POOL_CONNECTIONS)
+    :param tcp_keepalive: Keep-alive for the pooled connections (default AWS_CLIENT_TCP_KEEPALIVE)
+    :param config_kwargs: Any other botocore Config parameters (hashable values)
+    :return: boto3 client
+    """
+    if service_name in _aws_stub_clients:
+        return _aws_stub_clients[service_name]
+
+    if max_pool_connections is None:
+        max_pool_connections = AWS_CLIENT_MAX_POOL_CONNECTIONS
+    if tcp_keepalive is None:
+        tcp_keepalive = AWS_CLIENT_TCP_KEEPALIVE
+    client_key = (service_name, region_name, max_pool_connections, tcp_keepalive,
+                  tuple(sorted(config_kwargs.items())))
+    aws_client = _aws_clients.get(client_key)
+    if aws_client is None:
+        with _aws_clients_lock:  # boto3 session is not thread safe while creating clients
+            aws_client = _aws_clients.get(client_key)
+            if aws_client is None:
+                config_kwargs.setdefault('retries', {'mode': AWS_CLIENT_RETRY_MODE})
+                client_config = Config(max_pool_connections=max_pool_connections,
+                                       tcp_keepalive=tcp_keepalive, **config_kwargs)
+                aws_client = boto3.client(service_name, region_name=region_name,
+                                          config=client_config)
+                _aws_clients[client_key] = aws_metrics.instrument_client(aws_client)
+    return aws_client
+
+
+def set_aws_client(service_name, aws_client):
+    """
+    Inject a client (e.g. a stub or a mock for tests) returned by get_aws_client
+    for the given service whatever the region and config, the calls of a botocore
+    client (e.g. answered by a local stub) are accounted by aws_metrics
+    :param service_name: AWS service name, e.g. 's3', 'ssm'
+    :param aws_client: Client to return, None removes the injected one
+    :return: -
+    """
+    if aws_client is None:
+        _aws_stub_clients.pop(service_name, None)
+    else:
+        if isinstance(aws_client, BaseClient):
+            aws_metrics.instrument_client(aws_client)
+        _aws_stub_clients[service_name] = aws_client
+
+
+def clear_aws_clients():
+    """Drop all the cached and injected clients, next get_aws_client creates new ones"""
+    with _aws_clients_lock:
+        _aws_clients.clear()
+        _aws_stub_clients.clear()
+
+
+def _cache_ssm_parameter(parameter, loaded_at):
+    """Store a parameter as returned by SSM in the in-process cache"""
+    with _ssm_parameters_lock:
+        _ssm_parameters[parameter['Name']] = {
+            'Value': parameter['Value'],
+            'Version': parameter.get('Version'),
+            'LoadedAt': loaded_at,
+        }
+
+
+def _is_ssm_parameter_fresh(name, ttl_sec, now):
+    """Check if a cached parameter is younger than ttl_sec"""
+    cached = _ssm_parameters.get(name)
+    return cached is not None and now - cached['LoadedAt'] < ttl_sec
+
+
+def get_ssm_parameters(names, ttl_sec=None, with_decryption=True, region_name=None):
+    """
+    Get many SSM parameters at once, only the missing or expired ones are
+    loaded from SSM in batches of SSM_GET_PARAMETERS_MAX_NAMES.
+    When SSM throttles, the stale cached values are returned with a warning.
+    :param names: List of parameter names
+    :param ttl_sec: Time to live of the cached values (default SSM_PARAMETER_TTL_SEC)
+    :param with_decryption: Decrypt SecureString parameters
+    :param region_name: AWS Region
+    :return: dict of name: value, unknown names are left out
+    """
+    if ttl_sec is None:
+        ttl_sec = SSM_PARAMETER_TTL_SEC
+    now = time.monotonic()
+    names_to_load = [name for name in dict.fromkeys(names)
+                     if not _is_ssm_parameter_fresh(name, ttl_sec, now)]
+
+    ssm_client = get_aws_client('ssm', region_name=region_name)  # Simple System Manager
+    for idx in range(0, len(names_to_load), SSM_GET_PARAMETERS_MAX_NAMES):
+        names_batch = names_to_load[idx:idx + SSM_GET_PARAMETERS_MAX_NAMES]
+        try:
+            response = ssm_client.get_parameters(Names=names_batch,
+                                                 WithDecryption=with_decryption)
+        except ClientError as exception_handler:
+            error_code = exception_handler.response.get('Error', {}).get('Code')
+            if error_code not in SSM_THROTTLING_ERROR_CODES \
+                    or any(name not in _ssm_parameters for name in names_batch):
+                raise exception_handler
+            print(f'WARNING: SSM throttled ({error_code}), using stale values for {names_batch}')
+            continue
+        for parameter in response['Parameters']:
+            _cache_ssm_parameter(parameter, now)
+        for name in response.get('InvalidParameters', []):
+            print(f'WARNING: SSM parameter not found {name}')
+
+    return {name: _ssm_parameters[name]['Value'] for name in names if name in _ssm_parameters}
+
+
+def get_ssm_parameter(name, ttl_sec=None, with_decryption=True, region_name=None):
+    """
+    Get one SSM parameter through the in-process cache, see get_ssm_parameters
+    :param name: Parameter name
+    :param ttl_sec: Time to live of the cached value (default SSM_PARAMETER_TTL_SEC)
+    :param with_decryption: Decrypt SecureString parameters
+    :param region_name: AWS Region
+    :return: Parameter value. On not found an exception
+    """
+    parameters = get_ssm_parameters([name], ttl_sec=ttl_sec,
+                                    with_decryption=with_decryption, region_name=region_name)
+    if name not in parameters:
+        raise Exception(f"ERROR: SSM parameter not found {name}")
+    return parameters[name]
+
+
+def get_ssm_parameters_by_path(path, ttl_sec=None, recursive=True, with_decryption=True,
+                               region_name=None):
+    """
+    Get all the SSM parameters under a path in one paginated call and cache them,
+    so that later get_ssm_parameter calls on any of them are served from memory.
+    When SSM throttles, the stale cached values under the path are returned with a warning.
+    :param path: Parameters path, e.g. '/datalake/bronze/'
+    :param ttl_sec: Time to live of the cached values (default SSM_PARAMETER_TTL_SEC)
+    :param recursive: Include the sub-paths
+    :param with_decryption: Decrypt SecureString parameters
+    :param region_name: AWS Region
+    :return: dict of name: value
+    """
+    if ttl_sec is None:
+        ttl_sec = SSM_PARAMETER_TTL_SEC
+    now = time.monotonic()
+    path_key = 'path:' + path + (':recursive' if recursive else '')
+    if not _is_ssm_parameter_fresh(path_key, ttl_sec, now):
+        ssm_client = get_aws_client('ssm', region_name=region_name)  # Simple System Manager
+        try:
+            paginator = ssm_client.get_paginator('get_parameters_by_path')
+            parameters = []
+            for page in paginator.paginate(Path=path, Recursive=recursive,
+                                           WithDecryption=with_decryption):
+                parameters.extend(page['Parameters'])
+        except ClientError as exception_handler:
+            error_code = exception_handler.response.get('Error', {}).get('Code')
+            if error_code not in SSM_THROTTLING_ERROR_CODES or path_key not in _ssm_parameters:
+                raise exception_handler
+            print(f'WARNING: SSM throttled ({error_code}), using stale values for {path}')
+        else:
+            for parameter in parameters:
+                _cache_ssm_parameter(parameter, now)
+            _cache_ssm_parameter({'Name': path_key,
+                                  'Value': [parameter['Name'] for parameter in parameters]}, now)
+
+    return {name: _ssm_parameters[name]['Value']
+            for name in _ssm_parameters[path_key]['Value'] if name in _ssm_parameters}
+
+
+def clear_ssm_parameters():
+    """Drop all the cached SSM parameters, next calls load them from SSM"""
+    with _ssm_parameters_lock:
+        _ssm_parameters.clear()
+        _source_allow_lists.clear()
 
-def get_current_region_name():
-    """Dynamically determine the AWS Region (env, session))"""
-    potential_values = [
-        os.environ.get('AWS_REGION'),
-        os.environ.get('AWS_DEFAULT_REGION'),
-        boto3.DEFAULT_SESSION.region_name if boto3.DEFAULT_SESSION else None,
-        boto3.Session().region_name,
-    ]
-    for region_name in potential_values:
-        if region_name:
-            return region_name
-    return None
 
+class SourceAllowList:
+    """
+    Parsed allow-list of incoming source ids with exact match lookup and
+    optional per source metadata:
+        extensions: Allowed object name extensions (default SOURCE_DEFAULT_EXTENSIONS)
+        target_prefix: Sub-folder where the selected deliveries are moved to (default the source id)
+    """
+
+    def __init__(self, sources_metadata, version=None, raw_value=None):
+        self.sources_metadata = sources_metadata
+        self.source_ids = frozenset(sources_metadata)
+        self.version = version
+        self.raw_value = raw_value
+
+    def __contains__(self, source_id):
+        return source_id in self.source_ids
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def get_extensions(self, source_id):
+        """Allowed object name extensions of the source id"""
+        return self.sources_metadata[source_id].get('extensions', SOURCE_DEFAULT_EXTENSIONS)
+
+    def get_target_prefix(self, source_id):
+        """Sub-folder where the deliveries of the source id are moved to"""
+        return self.sources_metadata[source_id].get('target_prefix', source_id)
+
+    def is_allowed(self, source_id, object_name):
+        """Check the source id is allowed and the object name has one of its extensions"""
+        return source_id in self.source_ids \
+            and object_name.endswith(self.get_extensions(source_id))
 
-def get_current_lambda_function_name():
-    """Dynamically determine the AWS Lambda Function Name (env))"""
-    return os.environ['AWS_LAMBDA_FUNCTION_NAME']
+
+def parse_source_id_list(source_id_list_value, version=None):
+    """
+    Parse the source id list as stored in SSM, either:
+        - delimited ids: "Jenji,SourceB SourceC"
+        - JSON list: ["Jenji", "SourceB"]
+        - JSON object: {"Jenji": {"extensions": [".json"], "target_prefix": "Jenji"}}
+    :param source_id_list_value: Raw parameter value
+    :param version: Parameter version
+    :return: SourceAllowList
+    """
+    value = source_id_list_value.strip()
+    if value[:1] in ('[', '{'):
+        parsed_value = json.loads(value)
+    else:
+        parsed_value = re.split(r'[,;\s]+', value)
+    if isinstance(parsed_value, dict):
+        sources_metadata = {}
+        for source_id, metadata in parsed_value.items():
+            metadata = dict(metadata or {})
+            if 'extensions' in metadata:
+                metadata['extensions'] = tuple(metadata['extensions'])
+            sources_metadata[source_id] = metadata
+    else:
+        sources_metadata = {source_id: {} for source_id in parsed_value if source_id}
+    return SourceAllowList(sources_metadata, version=version, raw_value=source_id_list_value)
+
+
+def get_source_allow_list(parameter_name=SOURCE_ID_LIST_PARAMETER, ttl_sec=None, region_name=None):
+    """
+    Get the allow-list of incoming source ids through the SSM parameter cache,
+    it is parsed again only when the parameter version (or value) changes
+    :param parameter_name: SSM parameter name
+    :param ttl_sec: Time to live of the cached parameter (default SSM_PARAMETER_TTL_SEC)
+    :param region_name: AWS Region
+    :return: SourceAllowList
+    """
+    value = get_ssm_parameter(parameter_name, ttl_sec=ttl_sec, region_name=region_name)
+    version = _ssm_parameters[parameter_name]['Version']
+    allow_list = _source_allow_lists.get(parameter_name)
+    if allow_list is None or allow_list.version != version \
+            or (version is None and allow_list.raw_value != value):
+        allow_list = parse_source_id_list(value, version=version)
+        _source_allow_lists[parameter_name] = allow_list
+    return allow_list
 
 
 def prefix_object_name(object_name, sep='_', iso_dt=False, iso_tm=False,
-                       uu_id=False):
+                       uu_id=False, utc_dtm=None, uuid_name=None):
     """
     Prefix the object name upon given parameters in the below order:
         <with_prefix><sep><add_datetime><sep><add_uuid><sep><object_name>
+    With utc_dtm and uuid_name the name is deterministic (e.g. same name for a duplicate event)
     :param object_name: Name of the object
     :param sep: Separator
     :param iso_dt: Format is YYYYMMDD with current utc date
     :param iso_tm: Format is HH24MISS with current utc time
     :param uu_id: Set by uuid4
+    :param utc_dtm: UTC datetime of iso_dt and iso_tm instead of the current one
+    :param uuid_name: Name of a uuid5 set instead of the uuid4
     :return: Formatted object_name
     """
     new_prefix = ''
-    dt_utc = datetime.now(timezone.utc)
+    dt_utc = utc_dtm or datetime.now(timezone.utc)
     if iso_dt:
         new_prefix += dt_utc.strftime('%Y%m%d') + sep
     if iso_tm:
         new_prefix += dt_utc.strftime('%H%M%S') + sep
     if uu_id:
-        new_prefix += str(uuid.uuid4()) + sep
+        new_prefix += str(uuid.uuid5(uuid.NAMESPACE_URL, uuid_name) if uuid_name else uuid.uuid4()) + sep
     return new_prefix + object_name
 
 
-def exec_func_with_max_retries(func_to_exec, max_tries=3, sleep_sec=5,
-                               func_text=None, quiet_mode=True):
+def set_lambda_context(context):
+    """
+    Keep the context of the running Lambda invocation, the retries stop
+    RETRY_DEADLINE_MARGIN_SEC before its timeout (see RetryPolicy)
+    :param context: Lambda context, None when not in Lambda
+    :return: -
+    """
+    global _lambda_context  # pylint: disable=W0603
+    _lambda_context = context
+
+
+def classify_retry_error(exception):
+    """
+    Classify an exception for the retries
+    :param exception: Exception raised by the retried function
+    :return: 'throttling', 'transient' (both retryable) or 'fatal'
+    """
+    if isinstance(exception, RETRY_FATAL_EXCEPTIONS):
+        return 'fatal'
+    if isinstance(exception, ClientError):
+        error_code = exception.response.get('Error', {}).get('Code')
+        status_code = exception.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        if error_code in RETRY_THROTTLING_ERROR_CODES or status_code == 429:
+            return 'throttling'
+        if error_code in RETRY_TRANSIENT_ERROR_CODES or status_code >= 500:
+            return 'transient'
+        return 'fatal'  # e.g. AccessDenied, NoSuchKey, PreconditionFailed
+    return 'transient'  # Connection errors, timeouts and errors raised by the function itself
+
+
+class RetryTokenBucket:
     """
-    This wrapper allows a function to be executed with retries.
+    Retry quota shared by the threads and the warm invocations: a retry takes tokens,
+    a success gives some back, no retry is made while the bucket is empty.
+    It stops the retry storms when a whole batch is throttled (e.g. S3 SlowDown).
+    """
+
+    def __init__(self, capacity=RETRY_TOKEN_BUCKET_CAPACITY):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def acquire(self, throttling=False):
+        """Take the tokens of one retry, return their number or 0 when the bucket is empty"""
+        cost = RETRY_THROTTLING_COST if throttling else RETRY_COST
+        with self.lock:
+            if self.tokens < cost:
+                return 0
+            self.tokens -= cost
+            return cost
+
+    def release(self, tokens=RETRY_SUCCESS_REFILL):
+        """Give tokens back after a success"""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+_retry_token_bucket = RetryTokenBucket()
+
+
+class RetryPolicy:
+    """
+    Retries with exponential backoff and full jitter: retry n sleeps a random time
+    within [0, min(max_sleep_sec, base_sleep_sec * 2 ** (n - 1))].
+    The fatal errors (see classify_retry_error) are not retried, and the retries stop
+    at the deadline or when the shared RetryTokenBucket is empty.
+    """
+
+    def __init__(self, max_tries=3, base_sleep_sec=None, max_sleep_sec=None, deadline_sec=None,
+                 context=None, token_bucket=None):
+        """
+        :param max_tries: Maximum tries, the first one included
+        :param base_sleep_sec: Sleep bound of the first retry (default RETRY_BASE_SLEEP_SEC)
+        :param max_sleep_sec: Sleep bound of any retry (default RETRY_MAX_SLEEP_SEC)
+        :param deadline_sec: Time in seconds after which no retry starts, None for no limit
+        :param context: Lambda context bounding the deadline (default the one of set_lambda_context)
+        :param token_bucket: RetryTokenBucket (default the process wide one)
+        """
+        self.max_tries = max_tries
+        self.base_sleep_sec = RETRY_BASE_SLEEP_SEC if base_sleep_sec is None else base_sleep_sec
+        self.max_sleep_sec = RETRY_MAX_SLEEP_SEC if max_sleep_sec is None else max_sleep_sec
+        self.deadline_sec = deadline_sec
+        self.context = context
+        self.token_bucket = token_bucket or _retry_token_bucket
+
+    def get_sleep_sec(self, retry_nr):
+        """Full jitter sleep before the retry number retry_nr (from 1)"""
+        return random.uniform(0, min(self.max_sleep_sec, self.base_sleep_sec * 2 ** (retry_nr - 1)))
+
+    def get_deadline(self, start_tm):
+        """time.monotonic() after which no retry starts, None for no limit"""
+        deadlines = []
+        if self.deadline_sec is not None:
+            deadlines.append(start_tm + self.deadline_sec)
+        context = self.context or _lambda_context
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            deadlines.append(start_tm + context.get_remaining_time_in_millis() / 1000
+                             - RETRY_DEADLINE_MARGIN_SEC)
+        return min(deadlines) if deadlines else None
+
+    def execute(self, func_to_exec, func_text=None, quiet_mode=True):
+        """
+        Execute func_to_exec until it succeeds or a retry is not allowed
+        :param func_to_exec: Function without parameters
+        :param func_text: Text to display while attempting to execute
+        :param quiet_mode: No WARNING/ERROR messages about the retries
+        :return: Number of retries. On FAILURE the last exception
+        """
+        deadline = self.get_deadline(time.monotonic())
+        retry_cnt = 0
+        retry_tokens = 0
+        while True:
+            try:
+                if func_text:
+                    print(func_text)
+                func_to_exec()
+            except Exception as exception_handler:  # pylint: disable=broad-except
+                retry_cnt += 1
+                print(exception_handler)
+                error_class = classify_retry_error(exception_handler)
+                sleep_sec = self.get_sleep_sec(retry_cnt)
+                if error_class == 'fatal':
+                    stop_reason = 'Not retryable error'
+                elif retry_cnt >= self.max_tries:
+                    stop_reason = f'Max retries exceeded {retry_cnt} out of {self.max_tries}'
+                elif deadline is not None and time.monotonic() + sleep_sec >= deadline:
+                    stop_reason = f'Retry deadline reached after {retry_cnt} tries'
+                else:
+                    retry_tokens = self.token_bucket.acquire(error_class == 'throttling')
+                    stop_reason = None if retry_tokens else f'Retry quota exhausted after {retry_cnt} tries'
+                if stop_reason:
+                    if not quiet_mode:
+                        print(f"ERROR: {stop_reason}")
+                    raise exception_handler
+                if not quiet_mode:
+                    print(f"WARNING: Retry {retry_cnt} out of {self.max_tries} ({error_class}),"
+                          f" sleeping {sleep_sec:.2f} seconds")
+                time.sleep(sleep_sec)
+                continue
+            self.token_bucket.release(retry_tokens or RETRY_SUCCESS_REFILL)
+            return retry_cnt
+
+
+def exec_func_with_max_retries(func_to_exec, max_tries=3, sleep_sec=None,
+                               func_text=None, quiet_mode=True, retry_policy=None):
+    """
+    This wrapper allows a function to be executed with retries (see RetryPolicy).
     If the func_to_exec has parameters just use the below call:
         exec_func_with_max_retries(lambda: my_func(p1, p2))
     :param func_to_exec: Name of the function to execute
     :param max_tries: Maximum retries
-    :param sleep_sec: Time in seconds to sleep between retries
+    :param sleep_sec: Sleep bound in seconds of the first retry, doubled at each retry
+                      (default RETRY_BASE_SLEEP_SEC)
     :param func_text: Text to display while attempting to execute
+    :param retry_policy: RetryPolicy replacing max_tries and sleep_sec
     :return: Number of retries. On FAILURE the exception
     """
-    retry_cnt = 0
-    for retry_cnt in range(max_tries):
-        try:
-            if func_text:
-                print(func_text)
-            func_to_exec()
-            break
-        except Exception as exception_handler:  # pylint: disable=broad-except
-            retry_cnt += 1
-            print(exception_handler)
-            if retry_cnt < max_tries:
-                if not quiet_mode:
-                    print(f"WARNING: Retry {retry_cnt} out of {max_tries},"
-                          f" sleeping {sleep_sec} seconds")
-                time.sleep(sleep_sec)
-            else:
-                if not quiet_mode:
-                    print(f"ERROR: Max retries exceeded {retry_cnt} out of {max_tries}")
-                raise exception_handler
-            continue
-    return retry_cnt
+    if retry_policy is None:
+        retry_policy = RetryPolicy(max_tries=max_tries, base_sleep_sec=sleep_sec)
+    return retry_policy.execute(func_to_exec, func_text, quiet_mode)
+
+
+def format_s3_etag(object_etag):
+    """ETag between double quotes, as returned by S3 (the S3 event notifications have none)"""
+    return object_etag if object_etag.startswith('"') else f'"{object_etag}"'
+
+
+def merge_s3_tag_set(tag_set, tag_updates):
+    """Create or Replace the Tag key:value of tag_updates in a copy of tag_set
+    :param tag_set: List of {'Key', 'Value'}
+    :param tag_updates: dict of Tag key: Tag new value
+    :return: New list of {'Key', 'Value'}
+    """
+    new_tag_set = [{'Key': tag['Key'], 'Value': tag_updates.get(tag['Key'], tag['Value'])}
+                   for tag in tag_set]
+    tag_keys = {tag['Key'] for tag in tag_set}
+    new_tag_set.extend({'Key': tag_key, 'Value': tag_value}
+                       for tag_key, tag_value in tag_updates.items() if tag_key not in tag_keys)
+    return new_tag_set
+
+
+def _copy_s3_key_single(s3_client, bucket_name, object_key_from, object_key_to, tag_updates=None,
+                        if_etag=None):
+    """Copy with one CopyObject request, metadata and tags are copied along"""
+    copy_source = {'Bucket': bucket_name, 'Key': object_key_from}
+    copy_args = {'CopySourceIfMatch': format_s3_etag(if_etag)} if if_etag else {}
+    if tag_updates:
+        tag_set = get_s3_key_tag_set(bucket_name, object_key_from)
+        s3_client.copy_object(Bucket=bucket_name, CopySource=copy_source, Key=object_key_to,
+                              MetadataDirective='COPY', TaggingDirective='REPLACE',
+                              Tagging=urllib.parse.urlencode(
+                                  [(tag['Key'], tag['Value'])
+                                   for tag in merge_s3_tag_set(tag_set, tag_updates)]), **copy_args)
+    else:
+        s3_client.copy_object(Bucket=bucket_name, CopySource=copy_source, Key=object_key_to,
+                              MetadataDirective='COPY', TaggingDirective='COPY', **copy_args)
 
 
-def move_s3_key_from_to_location(bucket_name, object_key_from, object_key_to):
+def _copy_s3_key_multipart(s3_client, bucket_name, object_key_from, object_key_to,
+                           tag_updates=None, part_size=None, max_workers=None, if_etag=None):
+    """Copy with parallel UploadPartCopy requests, metadata and tags are copied along"""
+    copy_source = {'Bucket': bucket_name, 'Key': object_key_from}
+    head_args = {'IfMatch': format_s3_etag(if_etag)} if if_etag else {}
+    head_response = s3_client.head_object(Bucket=bucket_name, Key=object_key_from, **head_args)
+    object_size = head_response['ContentLength']
+    tag_set = get_s3_key_tag_set(bucket_name, object_key_from)
+    if tag_updates:
+        tag_set = merge_s3_tag_set(tag_set, tag_updates)
+
+    # Part size is raised when needed to stay within the AWS maximum number of parts
+    part_size = max(part_size or S3_MULTIPART_COPY_PART_SIZE,
+                    -(-object_size // S3_MAX_MULTIPART_PARTS))
+    part_ranges = [(part_nr, start, min(start + part_size, object_size) - 1)
+                   for part_nr, start in enumerate(range(0, object_size, part_size), start=1)]
+
+    create_args = {field: head_response[field] for field in S3_COPY_HEAD_FIELDS
+                   if field in head_response}
+    if tag_set:
+        create_args['Tagging'] = urllib.parse.urlencode(
+            [(tag['Key'], tag['Value']) for tag in tag_set])
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket_name, Key=object_key_to, **create_args)['UploadId']
+
+    def upload_part_copy(part_nr, start, end):
+        response = s3_client.upload_part_copy(
+            Bucket=bucket_name, Key=object_key_to, UploadId=upload_id, PartNumber=part_nr,
+            CopySource=copy_source, CopySourceRange=f'bytes={start}-{end}',
+            CopySourceIfMatch=head_response['ETag'])
+        return {'PartNumber': part_nr, 'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers or S3_MULTIPART_COPY_MAX_WORKERS) as executor:
+            parts = list(executor.map(lambda part_range: upload_part_copy(*part_range),
+                                      part_ranges))
+        s3_client.complete_multipart_upload(Bucket=bucket_name, Key=object_key_to,
+                                            UploadId=upload_id, MultipartUpload={'Parts': parts})
+        aws_metrics.get_api_metrics().record_bytes('s3.UploadPartCopy', object_size)
+    except Exception as exception_handler:
+        print(f'ERROR: Multipart copy failed, aborting upload {upload_id} of {object_key_to}')
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key_to,
+                                         UploadId=upload_id)
+        raise exception_handler
+
+
+def copy_s3_key_from_to_location(bucket_name, object_key_from, object_key_to, object_size=None,
+                                 tag_updates=None, part_size=None, max_workers=None, if_etag=None):
+    """Server-side copy keeping the metadata and the tags of the source.
+       Objects from S3_MULTIPART_COPY_THRESHOLD bytes on, or over S3_MAX_SINGLE_COPY_SIZE whatever
+       the threshold, are copied by parallel parts,
+       when the size is unknown the single copy is tried first (no extra HEAD request)
+    :param bucket_name: Name of S3 bucket
+    :param object_key_from: Prefix Key of the source
+    :param object_key_to: Prefix Key of the target
+    :param object_size: Size in bytes of the source, if known (e.g. from a listing)
+    :param tag_updates: dict of Tag key: Tag value to create or replace on the target
+    :param part_size: Bytes per part of the multipart copy (default S3_MULTIPART_COPY_PART_SIZE)
+    :param max_workers: Parallel parts of the multipart copy (default S3_MULTIPART_COPY_MAX_WORKERS)
+    :param if_etag: Copy only this version of the source (CopySourceIfMatch), else PreconditionFailed
+    :return: -
+    """
+    s3_client = get_aws_client('s3')  # Simple Storage Service
+    if object_size is not None \
+            and (object_size >= S3_MULTIPART_COPY_THRESHOLD or object_size > S3_MAX_SINGLE_COPY_SIZE):
+        _copy_s3_key_multipart(s3_client, bucket_name, object_key_from, object_key_to,
+                               tag_updates, part_size, max_workers, if_etag)
+        return
+    try:
+        _copy_s3_key_single(s3_client, bucket_name, object_key_from, object_key_to, tag_updates,
+                            if_etag)
+        if object_size is not None:
+            aws_metrics.get_api_metrics().record_bytes('s3.CopyObject', object_size)
+    except ClientError as exception_handler:
+        # CopyObject refuses sources over S3_MAX_SINGLE_COPY_SIZE
+        if object_size is not None \
+                or exception_handler.response.get('Error', {}).get('Code') != 'InvalidRequest':
+            raise exception_handler
+        print(f'WARNING: Single copy refused, multipart copy of {object_key_from}')
+        _copy_s3_key_multipart(s3_client, bucket_name, object_key_from, object_key_to,
+                               tag_updates, part_size, max_workers, if_etag)
+
+
+def move_s3_key_from_to_location(bucket_name, object_key_from, object_key_to, object_size=None,
+                                 tag_updates=None, part_size=None, max_workers=None, if_etag=None):
     """In AWS S3 there is no file rename nor move nor folders/sub-folders
-       Hence AWS does copy+delete of the prefixes keys
+       Hence AWS does copy+delete of the prefixes keys, see copy_s3_key_from_to_location
     :param bucket_name: Name of S3 bucket
     :param object_key_from: Prefix Key of the source
     :param object_key_to: Prefix Key of the target
+    :param object_size: Size in bytes of the source, if known (e.g. from a listing)
+    :param tag_updates: dict of Tag key: Tag value to create or replace on the target
+    :param part_size: Bytes per part of the multipart copy (default S3_MULTIPART_COPY_PART_SIZE)
+    :param max_workers: Parallel parts of the multipart copy (default S3_MULTIPART_COPY_MAX_WORKERS)
+    :param if_etag: Move only this version of the source (CopySourceIfMatch then IfMatch on the
+                    delete), else PreconditionFailed: a newer version delivered between the copy
+                    and the delete is kept, for its own event to move it
     :return: -
     """
-    s3_client = boto3.client('s3')  # Simple Storage Service
-    copy_source = {'Bucket': bucket_name, 'Key': object_key_from}
-    s3_client.copy_object(Bucket=bucket_name, CopySource=copy_source, Key=object_key_to)
-    s3_client.delete_object(Bucket=bucket_name, Key=object_key_from)
+    copy_s3_key_from_to_location(bucket_name, object_key_from, object_key_to, object_size,
+                                 tag_updates, part_size, max_workers, if_etag)
+    s3_client = get_aws_client('s3')  # Simple Storage Service
+    delete_args = {'IfMatch': format_s3_etag(if_etag)} if if_etag else {}
+    s3_client.delete_object(Bucket=bucket_name, Key=object_key_from, **delete_args)
+    clear_s3_tag_sets(bucket_name, [object_key_from])
+
+
+def delete_s3_keys(bucket_name, object_keys, max_tries=3, sleep_sec=1):
+    """
+    Delete many keys with DeleteObjects calls of up to S3_DELETE_OBJECTS_MAX_KEYS keys,
+    the keys reported in error are retried up to max_tries
+    :param bucket_name: Name of S3 bucket
+    :param object_keys: List of prefix keys
+    :param max_tries: Maximum tries per key
+    :param sleep_sec: Time in seconds to sleep between retries
+    :return: dict of the keys not deleted: error message
+    """
+    s3_client = get_aws_client('s3')  # Simple Storage Service
+    object_keys = list(object_keys)
+    keys_to_delete = object_keys
+    failed_keys = {}
+    for try_nr in range(1, max_tries + 1):
+        failed_keys = {}
+        for idx in range(0, len(keys_to_delete), S3_DELETE_OBJECTS_MAX_KEYS):
+            keys_batch = keys_to_delete[idx:idx + S3_DELETE_OBJECTS_MAX_KEYS]
+            try:
+                response = s3_client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in keys_batch], 'Quiet': True})
+            except ClientError as exception_handler:
+                failed_keys.update({key: str(exception_handler) for key in keys_batch})
+                continue
+            for error in response.get('Errors', []):
+                failed_keys[error['Key']] = f"{error.get('Code')}: {error.get('Message')}"
+        if not failed_keys:
+            break
+        print(f'WARNING: Delete try {try_nr} out of {max_tries}, {len(failed_keys)} keys failed')
+        keys_to_delete = list(failed_keys)
+        if try_nr < max_tries:
+            time.sleep(sleep_sec)
+    for key, error in failed_keys.items():
+        print(f'ERROR: Cannot delete {bucket_name} {key}: {error}')
+    clear_s3_tag_sets(bucket_name, object_keys)
+    return failed_keys
+
+
+def move_s3_keys_from_to_location(bucket_name, keys_from_to, tag_updates=None, max_workers=None):
+    """
+    Bulk move pipeline: the copies run in parallel with a bounded number of keys in flight,
+    the sources copied successfully are removed by DeleteObjects calls every
+    S3_DELETE_OBJECTS_MAX_KEYS keys (see delete_s3_keys) while the next copies go on.
+    keys_from_to may be a generator, it is consumed as the copies progress.
+    :param bucket_name: Name of S3 bucket
+    :param keys_from_to: Iterable of (object_key_from, object_key_to, object_size or None)
+    :param tag_updates: dict of Tag key: Tag value to create or replace on the targets
+    :param max_workers: Parallel copies (default S3_MOVE_MAX_WORKERS)
+    :return: (list of moved keys from, dict of failed keys from: error message)
+    """
+    max_workers = max_workers or S3_MOVE_MAX_WORKERS
+    moved_keys = []
+    failed_keys = {}
+    copied_keys = []
+
+    def flush_copied_keys():
+        delete_failed_keys = delete_s3_keys(bucket_name, copied_keys)
+        failed_keys.update(delete_failed_keys)
+        moved_keys.extend(key for key in copied_keys if key not in delete_failed_keys)
+        copied_keys.clear()
+
+    def collect_done(futures_done):
+        for future in futures_done:
+            object_key_from = future_to_key.pop(future)
+            if future.exception() is not None:
+                print(f'ERROR: Cannot copy {bucket_name} {object_key_from}: {future.exception()}')
+                failed_keys[object_key_from] = str(future.exception())
+            else:
+                copied_keys.append(object_key_from)
+        if len(copied_keys) >= S3_DELETE_OBJECTS_MAX_KEYS:
+            flush_copied_keys()
+
+    future_to_key = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for object_key_from, object_key_to, object_size in keys_from_to:
+                if len(future_to_key) >= 2 * max_workers:  # Bound the keys in flight
+                    futures_done, _ = concurrent.futures.wait(
+                        future_to_key, return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect_done(futures_done)
+                future = executor.submit(copy_s3_key_from_to_location, bucket_name, object_key_from,
+                                         object_key_to, object_size, tag_updates)
+                future_to_key[future] = object_key_from
+        finally:
+            # Also when keys_from_to raises: the sources already copied are deleted, else
+            # they would stay both in the source and the target and be copied again
+            collect_done(concurrent.futures.as_completed(list(future_to_key)))
+            if copied_keys:
+                flush_copied_keys()
+    return moved_keys, failed_keys
+
+
+def get_s3_key_tag_set(bucket_name, object_key, use_cache=True):
+    """Get object tag set, read once per run (see clear_s3_tag_sets)
+    :param bucket_name: Name of S3 bucket
+    :param object_key: Prefix key
+    :param use_cache: Return the tag set already read, if any
+    :return: List of {'Key', 'Value'}
+    """
+    tag_set = _s3_tag_sets.get((bucket_name, object_key)) if use_cache else None
+    if tag_set is None:
+        s3_client = get_aws_client('s3')  # Simple Storage Service
+        tag_set = s3_client.get_object_tagging(Bucket=bucket_name, Key=object_key)['TagSet']
+        with _s3_tag_sets_lock:
+            _s3_tag_sets[(bucket_name, object_key)] = tag_set
+    return tag_set
+
+
+def clear_s3_tag_sets(bucket_name=None, object_keys=None):
+    """Drop the tag sets read so far, all of them or only the given keys
+    :param bucket_name: Name of S3 bucket
+    :param object_keys: List of prefix keys
+    :return: -
+    """
+    with _s3_tag_sets_lock:
+        if object_keys is None:
+            _s3_tag_sets.clear()
+        else:
+            for object_key in object_keys:
+                _s3_tag_sets.pop((bucket_name, object_key), None)
 
 
 def get_s3_key_tag(bucket_name, object_key, tag_key):
@@ -108,90 +864,327 @@ def get_s3_key_tag(bucket_name, object_key, tag_key):
     :param tag_key: Tag key
     :return: Tag value
     """
-    s3_client = boto3.client('s3')  # Simple Storage Service
-    tags_response = s3_client.get_object_tagging(Bucket=bucket_name, Key=object_key)
-    for tag in tags_response['TagSet']:
+    for tag in get_s3_key_tag_set(bucket_name, object_key):
         if tag['Key'] == tag_key:
             return tag['Value']
     return None
 
 
-def put_s3_key_tag(bucket_name, object_key, tag_key, tag_new_value, if_tag_value=None):
-    """Get object tag value
+def put_s3_key_tag(bucket_name, object_key, tag_key, tag_new_value, if_tag_value=None,
+                   tag_set=None):
+    """Set object tag value with one PUT, the current tag set is read only
+       when neither given nor already read within the run
     :param bucket_name: Name of S3 bucket
     :param object_key: Prefix key
     :param tag_key: Tag key
     :param tag_new_value: Tag new value
     :param if_tag_value: Change value only if matches current Tag value
-    :return: -
+    :param tag_set: Current tag set, if the caller already has it
+    :return: True when the tag set was changed
     """
-    if if_tag_value and if_tag_value != get_s3_key_tag(bucket_name, object_key, tag_key):
-        return
+    if tag_set is None:
+        tag_set = get_s3_key_tag_set(bucket_name, object_key)
+    tag_value = next((tag['Value'] for tag in tag_set if tag['Key'] == tag_key), None)
+    if (if_tag_value and if_tag_value != tag_value) or tag_value == tag_new_value:
+        return False
 
     # Create or Replace Tag key:value
-    s3_client = boto3.client('s3')  # Simple Storage Service
-    tags_response = s3_client.get_object_tagging(Bucket=bucket_name, Key=object_key)
-    tag_set = tags_response['TagSet']
-    if not any(tag['Key'] == tag_key for tag in tag_set):
-        tag_set.append({"Key": tag_key, "Value": tag_new_value})
-    else:
-        for tag in tag_set:
-            if tag['Key'] == tag_key:
-                tag['Value'] = tag_new_value
-                break
-    s3_client.put_object_tagging(Bucket=bucket_name, Key=object_key, Tagging={'TagSet': tag_set})
+    new_tag_set = merge_s3_tag_set(tag_set, {tag_key: tag_new_value})
+    s3_client = get_aws_client('s3')  # Simple Storage Service
+    s3_client.put_object_tagging(Bucket=bucket_name, Key=object_key,
+                                 Tagging={'TagSet': new_tag_set})
+    with _s3_tag_sets_lock:
+        _s3_tag_sets[(bucket_name, object_key)] = new_tag_set
+    return True
 
 
-def list_s3_key_older_than(bucket_name, start_at_prefix, utc_dtm=None, minutes_ago=None):
+def put_s3_keys_tag(bucket_name, object_keys, tag_key, tag_new_value, if_tag_value=None,
+                    tag_sets=None, max_workers=None):
+    """Set the tag value of many objects in parallel, see put_s3_key_tag
+    :param bucket_name: Name of S3 bucket
+    :param object_keys: List of prefix keys
+    :param tag_key: Tag key
+    :param tag_new_value: Tag new value
+    :param if_tag_value: Change value only if matches current Tag value
+    :param tag_sets: dict of prefix key: current tag set, for the keys the caller already has
+    :param max_workers: Parallel updates (default S3_TAG_MAX_WORKERS)
+    :return: dict of the keys not updated on error: error message
     """
-    List all the keys in S3 bucket starting from a prefix down.
-    Keys with LastModified datetime older than given minutes ago will be returned as a list
+    tag_sets = tag_sets or {}
+    failed_keys = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or S3_TAG_MAX_WORKERS) as executor:
+        future_to_key = {
+            executor.submit(put_s3_key_tag, bucket_name, object_key, tag_key, tag_new_value,
+                            if_tag_value, tag_sets.get(object_key)): object_key
+            for object_key in object_keys
+        }
+        for future in concurrent.futures.as_completed(future_to_key):
+            if future.exception() is not None:
+                object_key = future_to_key[future]
+                print(f'ERROR: Cannot tag {bucket_name} {object_key}: {future.exception()}')
+                failed_keys[object_key] = str(future.exception())
+    return failed_keys
+
+
+def exists_s3_key(bucket_name, object_key):
+    """
+    Check an object exists with one HEAD request
     :param bucket_name: Name of S3 bucket
-    :param start_at_prefix: Starting from this prefix down
+    :param object_key: Prefix key
+    :return: True when it exists
+    """
+    try:
+        get_aws_client('s3').head_object(Bucket=bucket_name, Key=object_key)
+    except ClientError as exception_handler:
+        if exception_handler.response.get('Error', {}).get('Code') in S3_NOT_FOUND_ERROR_CODES:
+            return False
+        raise exception_handler
+    return True
+
+
+def get_processed_ledger_key(bucket_name, object_key, object_etag, object_version=None):
+    """
+    Ledger key of a processed version: without the version an identical re-upload
+    (same ETag) within PROCESSED_KEY_TTL_SEC would be taken for a duplicate event
+    """
+    ledger_key = (bucket_name, object_key, format_s3_etag(object_etag))
+    return ledger_key + (object_version,) if object_version else ledger_key
+
+
+def get_processed_key(bucket_name, object_key, object_etag, object_version=None):
+    """
+    Look up a processed version of an object in the ledger, in-process first then in the
+    PROCESSED_KEY_TABLE DynamoDB table (one GetItem) when set
+    :param bucket_name: Name of S3 bucket
+    :param object_key: Prefix key of the source
+    :param object_etag: ETag of the source version
+    :param object_version: versionId or sequencer of the S3 event of the source version
+    :return: dict of Target, Status, ProcessedAt or None when not processed yet
+    """
+    ledger_key = get_processed_ledger_key(bucket_name, object_key, object_etag, object_version)
+    with _processed_keys_lock:
+        processed_key = _processed_keys.get(ledger_key)
+    if processed_key is not None or not PROCESSED_KEY_TABLE:
+        return processed_key
+    item = get_aws_client('dynamodb').get_item(
+        TableName=PROCESSED_KEY_TABLE, Key={'LedgerKey': {'S': '#'.join(ledger_key)}},
+        ConsistentRead=True).get('Item')
+    if item is None or int(item['ExpiresAt']['N']) < time.time():
+        return None
+    processed_key = {'Target': item['Target']['S'], 'Status': item['Status']['S'],
+                     'ProcessedAt': item['ProcessedAt']['S']}
+    with _processed_keys_lock:
+        _processed_keys[ledger_key] = processed_key
+    return processed_key
+
+
+def put_processed_key(bucket_name, object_key, object_etag, object_key_to, status, object_version=None):
+    """
+    Record a processed version of an object in the ledger (see get_processed_key)
+    :param bucket_name: Name of S3 bucket
+    :param object_key: Prefix key of the source
+    :param object_etag: ETag of the source version
+    :param object_key_to: Prefix key where it has been moved
+    :param status: Outcome, e.g. the ProcessStatus tag value of the target
+    :param object_version: versionId or sequencer of the S3 event of the source version
+    :return: dict of Target, Status, ProcessedAt
+    """
+    ledger_key = get_processed_ledger_key(bucket_name, object_key, object_etag, object_version)
+    processed_key = {'Target': object_key_to, 'Status': status,
+                     'ProcessedAt': datetime.now(timezone.utc).isoformat()}
+    if PROCESSED_KEY_TABLE:
+        get_aws_client('dynamodb').put_item(
+            TableName=PROCESSED_KEY_TABLE,
+            Item={'LedgerKey': {'S': '#'.join(ledger_key)}, 'Target': {'S': object_key_to},
+                  'Status': {'S': status}, 'ProcessedAt': {'S': processed_key['ProcessedAt']},
+                  'ExpiresAt': {'N': str(int(time.time()) + PROCESSED_KEY_TTL_SEC)}})
+    with _processed_keys_lock:
+        if len(_processed_keys) >= PROCESSED_KEY_MAX_LOCAL:
+            del _processed_keys[next(iter(_processed_keys))]
+        _processed_keys[ledger_key] = processed_key
+    return processed_key
+
+
+def clear_processed_keys():
+    """Drop the in-process ledger, the DynamoDB table is kept"""
+    with _processed_keys_lock:
+        _processed_keys.clear()
+
+
+def format_s3_last_modified(last_modified):
+    """Format an S3 LastModified datetime as string ISO 8601 with milliseconds"""
+    return last_modified.strftime('%Y-%m-%dT%H:%M:%S.') \
+        + f'{last_modified.microsecond // 1000:03d}Z'
+
+
+def filter_s3_objects_older_than(objects, utc_dtm=None, minutes_ago=None, iso_last_modified=False):
+    """
+    Filter out "Folders" and the objects modified after given minutes ago
+    :param objects: Objects as returned in a ListObjectsV2 page Contents
     :param utc_dtm: UTC datetime
     :param minutes_ago: older than minutes ago
-    :return: list of dict: Key, LastModified(ISO 8601), Size, StorageClass
-            Note: an empty list will be returned when input parameters are invalid
+    :param iso_last_modified: LastModified as string ISO 8601 instead of datetime
+    :return: Generator of dict: Key, LastModified, Size, StorageClass
     """
     if not utc_dtm:
         utc_dtm = datetime.now(timezone.utc)
     if not minutes_ago or not isinstance(minutes_ago, int):
         minutes_ago = 5  # TODO: Maybe get it from SSM # pylint: disable=W0511
+    utc_dtm -= timedelta(minutes=minutes_ago)
+    for obj in objects:
+        if not obj['Key'].endswith('/') and obj['LastModified'] <= utc_dtm:
+            yield {
+                'Key': obj['Key'],
+                'LastModified': format_s3_last_modified(obj['LastModified'])
+                                if iso_last_modified else obj['LastModified'],
+                'Size': obj['Size'],
+                'StorageClass': obj.get('StorageClass')
+            }
 
-    # Validate
-    try:
-        utc_dtm_iso8601 = utc_dtm.strftime('%Y-%m-%dT%H:%M:%S')
-        parser.parse(utc_dtm_iso8601)
-        utc_dtm -= timedelta(minutes=minutes_ago)
-    except ValueError:
-        print(f'ERROR: Invalid utc_dtm|minutes_ago: {utc_dtm},{minutes_ago}')
-        return []
 
-    # Get the details
-    s3_keys_list = []
+def iter_s3_key_older_than(bucket_name, start_at_prefix, utc_dtm=None, minutes_ago=None,
+                           start_after=None, continuation_token=None, iso_last_modified=False,
+                           listing_state=None):
+    """
+    Iterate over the keys in S3 bucket starting from a prefix down, page by page,
+    so that the first keys can be processed while the next pages are listed.
+    Keys with LastModified datetime older than given minutes ago are yielded
+    :param bucket_name: Name of S3 bucket
+    :param start_at_prefix: Starting from this prefix down
+    :param utc_dtm: UTC datetime
+    :param minutes_ago: older than minutes ago
+    :param start_after: Resume the listing after this key
+    :param continuation_token: Resume the listing from this ListObjectsV2 continuation token,
+                               as given by listing_state
+    :param iso_last_modified: LastModified as string ISO 8601 instead of datetime
+    :param listing_state: dict updated once all the keys of a page are yielded with
+                          NextContinuationToken: the continuation_token resuming the listing
+                          after them, None when the listing is complete
+    :return: Generator of dict: Key, LastModified, Size, StorageClass
+    """
+    if not utc_dtm:
+        utc_dtm = datetime.now(timezone.utc)
+    s3_client = get_aws_client('s3')  # Simple Storage Service
+    paginator = s3_client.get_paginator('list_objects_v2')
+    paginate_args = {'Bucket': bucket_name, 'Prefix': start_at_prefix}
+    if start_after:
+        paginate_args['StartAfter'] = start_after
+    if continuation_token:
+        paginate_args['ContinuationToken'] = continuation_token  # Raw token of the first request
+    for page in paginator.paginate(**paginate_args):
+        yield from filter_s3_objects_older_than(page.get('Contents', []), utc_dtm, minutes_ago,
+                                                iso_last_modified)
+        if listing_state is not None:
+            listing_state['NextContinuationToken'] = page.get('NextContinuationToken')
+
+
+def list_s3_sub_prefixes(bucket_name, start_at_prefix):
+    """
+    List the first level sub-prefixes ("sub-folders") under a prefix
+    :param bucket_name: Name of S3 bucket
+    :param start_at_prefix: Prefix ending with '/'
+    :return: (list of sub-prefixes, list of objects directly under the prefix)
+    """
+    s3_client = get_aws_client('s3')  # Simple Storage Service
+    paginator = s3_client.get_paginator('list_objects_v2')
+    sub_prefixes = []
+    objects = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=start_at_prefix, Delimiter='/'):
+        sub_prefixes.extend(common_prefix['Prefix']
+                            for common_prefix in page.get('CommonPrefixes', []))
+        objects.extend(page.get('Contents', []))
+    return sub_prefixes, objects
+
+
+def iter_s3_key_older_than_by_prefix(bucket_name, start_at_prefix, utc_dtm=None, minutes_ago=None,
+                                     max_workers=None, max_keys_per_prefix=None,
+                                     iso_last_modified=False):
+    """
+    Same as iter_s3_key_older_than, but the sub-prefixes (e.g. one per source_id)
+    are discovered first then listed concurrently and merged in one stream.
+    A per sub-prefix limit keeps a single noisy source from starving the others.
+    :param bucket_name: Name of S3 bucket
+    :param start_at_prefix: Starting from this prefix down, ending with '/'
+    :param utc_dtm: UTC datetime
+    :param minutes_ago: older than minutes ago
+    :param max_workers: Sub-prefixes listed concurrently (default S3_LIST_MAX_WORKERS)
+    :param max_keys_per_prefix: Maximum keys yielded per sub-prefix, None for all
+    :param iso_last_modified: LastModified as string ISO 8601 instead of datetime
+    :return: Generator of dict: Key, LastModified, Size, StorageClass
+    """
+    if not utc_dtm:
+        utc_dtm = datetime.now(timezone.utc)
+    sub_prefixes, objects = list_s3_sub_prefixes(bucket_name, start_at_prefix)
+
+    keys_queue = queue.Queue(maxsize=S3_LIST_QUEUE_SIZE)
+    stop_event = threading.Event()
+    end_of_prefix = object()
+
+    def put_in_queue(item):
+        while not stop_event.is_set():
+            try:
+                keys_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def list_sub_prefix(sub_prefix):
+        if stop_event.is_set():  # The consumer stopped before this sub-prefix was listed, no LIST
+            return
+        try:
+            s3_keys = iter_s3_key_older_than(bucket_name, sub_prefix, utc_dtm, minutes_ago,
+                                             iso_last_modified=iso_last_modified)
+            for key_nr, s3_key in enumerate(s3_keys, start=1):
+                if not put_in_queue(s3_key):
+                    return
+                if max_keys_per_prefix and key_nr >= max_keys_per_prefix:
+                    print(f'WARNING: Listing of {sub_prefix} limited to {max_keys_per_prefix} keys')
+                    break
+        except Exception as exception_handler:  # pylint: disable=W0703
+            put_in_queue(exception_handler)
+        finally:
+            put_in_queue(end_of_prefix)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or S3_LIST_MAX_WORKERS) as executor:
+        for sub_prefix in sub_prefixes:
+            executor.submit(list_sub_prefix, sub_prefix)
+        try:
+            # Keys directly under the prefix, not in a sub-prefix, are already listed
+            yield from filter_s3_objects_older_than(objects, utc_dtm, minutes_ago,
+                                                    iso_last_modified)
+            prefixes_left = len(sub_prefixes)
+            while prefixes_left:
+                item = keys_queue.get()
+                if item is end_of_prefix:
+                    prefixes_left -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop_event.set()  # Release the listers when the consumer stops early
+
+
+def list_s3_key_older_than(bucket_name, start_at_prefix, utc_dtm=None, minutes_ago=None):
+    """
+    List all the keys in S3 bucket starting from a prefix down.
+    Keys with LastModified datetime older than given minutes ago will be returned as a list,
+    see iter_s3_key_older_than to process them while listing
+    :param bucket_name: Name of S3 bucket
+    :param start_at_prefix: Starting from this prefix down
+    :param utc_dtm: UTC datetime
+    :param minutes_ago: older than minutes ago
+    :return: list of dict: Key, LastModified(ISO 8601), Size, StorageClass
+            Note: an empty list will be returned when the listing fails
+    """
     try:
-        s3_client = boto3.client('s3')
-        paginator = s3_client.get_paginator('list_objects')
-        page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=start_at_prefix)
-        for page in page_iterator:
-            for obj in page['Contents']:
-                # Must have Key in dictionary, filter out "Folders", older "Files"
-                if 'Key' in obj \
-                        and not str(obj['Key']).endswith('/') \
-                        and obj['LastModified'] <= utc_dtm:
-                    # Convert LastModified to string ISO 8601
-                    last_modified1_dt = obj['LastModified'].strftime('%Y-%m-%dT%H:%M:%S')
-                    last_modified2_dt = obj['LastModified'].strftime('%f')
-                    s3_keys_list.append({
-                        'Key': obj['Key'],
-                        'LastModified': last_modified1_dt
-                                        + '.' + last_modified2_dt[:3] + 'Z',
-                        'Size': obj['Size'],
-                        'StorageClass': obj['StorageClass']
-                    })
+        return list(iter_s3_key_older_than(bucket_name, start_at_prefix, utc_dtm, minutes_ago,
+                                           iso_last_modified=True))
     except Exception as exception_handler:  # pylint: disable=W0703
         print(exception_handler)
         print(f'ERROR: Cannot list_s3_key_older_than '
               f'{bucket_name}, {start_at_prefix}, {utc_dtm}, {minutes_ago}')
         return []
-    return s3_keys_list
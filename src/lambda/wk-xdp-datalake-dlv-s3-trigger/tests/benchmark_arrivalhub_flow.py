@@ -0,0 +1,125 @@
+"""
+Benchmark of the ArrivalHub file flow on the in-process S3/SSM fake, e.g. for 20 thousand
+objects over 50 sources with 5 ms per API call: python benchmark_arrivalhub_flow.py --objects 20
+--sources 50 --latency-ms 5
+The delivered objects go through lambda_handler (Delivered -> PendingSelection) by S3 event
+batches, then through the mvsel2val Glue job selection (PendingSelection -> PendingValidations).
+Reports the objects/sec, the API calls per object and the p50/p99 latency of the batches.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import time
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MVSEL2VAL_JOB_NAME = 'wk-glue-job-bronze-mvsel2val-jenji-v1'
+MVSEL2VAL_JOB_PATH = os.path.join(LAMBDA_DIR, '..', '..', 'glue', MVSEL2VAL_JOB_NAME, MVSEL2VAL_JOB_NAME + '.py')
+sys.path.insert(0, LAMBDA_DIR)
+
+import lambda_function  # noqa: E402 pylint: disable=C0413
+from scripts import aws_utils  # noqa: E402 pylint: disable=C0413
+from fake_aws import FakeAWS  # noqa: E402 pylint: disable=C0413
+
+BUCKET_NAME = 'rgi-sandbox-repo-dev'
+ARRIVALHUB_PREFIX = 'DataLakeV1/ArrivalHub/'
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))] if ordered else 0.0
+
+
+def seed_delivered(fake_aws, objects, sources):
+    """objects delivered round robin over sources, all of them allowed"""
+    source_ids = [f'Source{idx:03d}' for idx in range(sources)]
+    fake_aws.ssm.seed_parameter(aws_utils.SOURCE_ID_LIST_PARAMETER, ','.join(source_ids))
+    object_keys = []
+    for idx in range(objects):
+        object_key = f'{ARRIVALHUB_PREFIX}Delivered/{source_ids[idx % sources]}/{idx:08d}.json'
+        fake_aws.s3.seed_object(BUCKET_NAME, object_key, body=b'{"id": %d}' % idx)
+        object_keys.append(object_key)
+    return object_keys
+
+
+def run_lambda_phase(fake_aws, object_keys, batch_size):
+    """lambda_handler on S3 events of batch_size records"""
+    aws_utils.clear_aws_clients()
+    aws_utils.clear_ssm_parameters()
+    aws_utils.set_aws_client('s3', fake_aws.client('s3'))
+    aws_utils.set_aws_client('ssm', fake_aws.client('ssm'))
+    fake_aws.reset_calls()
+    batch_elapsed_sec = []
+    start_tm = time.monotonic()
+    for idx in range(0, len(object_keys), batch_size):
+        event = {'Records': [{'eventSource': 'aws:s3',
+                              's3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': object_key}}}
+                             for object_key in object_keys[idx:idx + batch_size]]}
+        batch_start_tm = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lambda_function.lambda_handler(event, None)
+        batch_elapsed_sec.append(time.monotonic() - batch_start_tm)
+    return time.monotonic() - start_tm, batch_elapsed_sec
+
+
+def run_selection_phase(fake_aws):
+    """mvsel2val run_job over the PendingSelection keys, aged past its minutes_ago"""
+    spec = importlib.util.spec_from_file_location(MVSEL2VAL_JOB_NAME.replace('-', '_'), MVSEL2VAL_JOB_PATH)
+    job = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(job)
+    aws_utils.set_aws_client('s3', fake_aws.client('s3'))  # The job imports the same scripts package
+    aws_utils.set_aws_client('ssm', fake_aws.client('ssm'))
+    fake_aws.s3.age_objects(10)
+    fake_aws.reset_calls()
+    start_tm = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = job.run_job(BUCKET_NAME, ARRIVALHUB_PREFIX + 'PendingSelection/',
+                             ARRIVALHUB_PREFIX + 'PendingValidations/', minutes_ago=2)
+    return time.monotonic() - start_tm, result
+
+
+def print_phase(name, objects, elapsed_sec, fake_aws, batch_elapsed_sec=None):
+    elapsed_sec = max(elapsed_sec, 1e-6)
+    print(f"{name}: {objects} objects in {elapsed_sec:.2f} sec Objects/sec: {objects / elapsed_sec:.0f}"
+          f" Calls/object: {fake_aws.get_call_count() / max(objects, 1):.2f}")
+    print(f"  Calls: {dict(sorted(fake_aws.calls.items()))}")
+    if batch_elapsed_sec:
+        print(f"  Batch latency p50: {percentile(batch_elapsed_sec, 50) * 1000:.1f} ms"
+              f" p99: {percentile(batch_elapsed_sec, 99) * 1000:.1f} ms")
+
+
+def run_benchmark(objects, sources, batch_size, latency_ms):
+    os.environ.setdefault('AWS_REGION', 'eu-west-1')
+    os.environ.setdefault('AWS_LAMBDA_FUNCTION_NAME', 'benchmark-arrivalhub-flow')
+    fake_aws = FakeAWS(latency_sec=latency_ms / 1000)
+    object_keys = seed_delivered(fake_aws, objects, sources)
+
+    lambda_elapsed_sec, batch_elapsed_sec = run_lambda_phase(fake_aws, object_keys, batch_size)
+    print_phase('Lambda', objects, lambda_elapsed_sec, fake_aws, batch_elapsed_sec)
+    lambda_calls = fake_aws.get_call_count()
+
+    selection_elapsed_sec, result = run_selection_phase(fake_aws)
+    moved = len(result['moved_keys'])
+    print_phase('Selection', moved, selection_elapsed_sec, fake_aws)
+    if result['failed_keys'] or moved != objects:
+        print(f"WARNING: Moved {moved} of {objects} objects, failed {len(result['failed_keys'])}")
+    aws_utils.clear_aws_clients()
+    return {'lambda_objects_per_sec': objects / max(lambda_elapsed_sec, 1e-6),
+            'lambda_calls_per_object': lambda_calls / max(objects, 1),
+            'lambda_batch_p50_sec': percentile(batch_elapsed_sec, 50),
+            'lambda_batch_p99_sec': percentile(batch_elapsed_sec, 99),
+            'selection_objects_per_sec': moved / max(selection_elapsed_sec, 1e-6),
+            'selection_calls_per_object': fake_aws.get_call_count() / max(moved, 1)}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--objects', type=float, default=5.0, help='Thousands of delivered objects')
+    arg_parser.add_argument('--sources', type=int, default=20, help='Number of source ids')
+    arg_parser.add_argument('--batch-size', type=int, default=10, help='S3 records per lambda_handler event')
+    arg_parser.add_argument('--latency-ms', type=float, default=0.0, help='Latency added to each API call')
+    cli_args = arg_parser.parse_args()
+    run_benchmark(int(cli_args.objects * 1000), cli_args.sources, cli_args.batch_size, cli_args.latency_ms)
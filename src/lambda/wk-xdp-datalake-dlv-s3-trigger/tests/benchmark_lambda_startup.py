@@ -0,0 +1,96 @@
+"""
+Cold start benchmark of the S3 trigger Lambda, e.g. python benchmark_lambda_startup.py --runs 10
+Each run is a fresh interpreter (a new container) answered by the in-process S3/SSM fake:
+reports the import time of lambda_function (boto3 included), the first invocation latency
+and a warm invocation latency, with and without the clients pre-warmed at module init.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET_NAME = 'rgi-sandbox-repo-dev'
+DELIVERED_PREFIX = 'DataLakeV1/ArrivalHub/Delivered/Jenji/'
+CHILD_ENV = {
+    'AWS_REGION': 'eu-west-1',
+    'AWS_LAMBDA_FUNCTION_NAME': 'benchmark-lambda-startup',
+    'AWS_LAMBDA_RUNTIME_API': '127.0.0.1:9001',  # Seen as the Lambda runtime by lambda_function
+    'AWS_ACCESS_KEY_ID': 'fake',
+    'AWS_SECRET_ACCESS_KEY': 'fake',
+    'AWS_EC2_METADATA_DISABLED': 'true',
+}
+
+
+def run_child():
+    """One container: import then two invocations, the timings are printed as JSON"""
+    sys.path.insert(0, LAMBDA_DIR)
+    boto3_start_tm = time.perf_counter()
+    import boto3  # noqa: F401 pylint: disable=C0415,W0611 # Imported by lambda_function
+    boto3_import_sec = time.perf_counter() - boto3_start_tm
+
+    from fake_aws import FakeAWS  # pylint: disable=C0415
+    fake_aws = FakeAWS()
+    fake_aws.install()  # Before the import, so that the pre-warmed clients are answered too
+    fake_aws.ssm.seed_parameter('/datalake/bronze/source_id-list', 'Jenji')
+    for idx in range(2):
+        fake_aws.s3.seed_object(BUCKET_NAME, f'{DELIVERED_PREFIX}{idx}.json')
+
+    module_start_tm = time.perf_counter()
+    import lambda_function  # pylint: disable=C0415
+    module_import_sec = time.perf_counter() - module_start_tm
+
+    invocation_sec = []
+    for idx in range(2):
+        event = {'Records': [{'eventSource': 'aws:s3', 's3': {
+            'bucket': {'name': BUCKET_NAME}, 'object': {'key': f'{DELIVERED_PREFIX}{idx}.json'}}}]}
+        invocation_start_tm = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lambda_function.lambda_handler(event, None)
+        invocation_sec.append(time.perf_counter() - invocation_start_tm)
+
+    print(json.dumps({'import_sec': boto3_import_sec + module_import_sec, 'boto3_import_sec': boto3_import_sec,
+                      'first_invocation_sec': invocation_sec[0], 'warm_invocation_sec': invocation_sec[1],
+                      'api_calls': fake_aws.get_call_count()}))
+
+
+def run_containers(runs, prewarm):
+    """Timings of runs fresh interpreters"""
+    env = dict(os.environ, **CHILD_ENV, LAMBDA_PREWARM_CLIENTS='true' if prewarm else 'false')
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], env=env,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True,
+                                   text=True, check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def run_benchmark(runs):
+    summary = {}
+    for prewarm in (False, True):
+        results = run_containers(runs, prewarm)
+        median = {name: statistics.median(result[name] for result in results)
+                  for name in ('import_sec', 'boto3_import_sec', 'first_invocation_sec', 'warm_invocation_sec')}
+        summary['prewarm' if prewarm else 'lazy'] = median
+        print(f"Clients {'pre-warmed' if prewarm else 'lazy'} ({runs} runs, medians):"
+              f" import {median['import_sec'] * 1000:.1f} ms (boto3 {median['boto3_import_sec'] * 1000:.1f} ms)"
+              f" first invocation {median['first_invocation_sec'] * 1000:.1f} ms"
+              f" warm invocation {median['warm_invocation_sec'] * 1000:.1f} ms")
+    return summary
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per mode')
+    arg_parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    cli_args = arg_parser.parse_args()
+    if cli_args.child:
+        run_child()
+    else:
+        run_benchmark(cli_args.runs)
@@ -0,0 +1,335 @@
+"""
+In-process fake of the S3, SSM and DynamoDB APIs used by the ArrivalHub flow, for tests
+and benchmarks. The fake answers real boto3 clients from their botocore 'before-call' event:
+the parameters are validated, the paginators and the ClientError exceptions are the real
+ones, and no request leaves the process. Every call is counted per operation and can be
+slowed down by a fixed latency to mimic the round trips.
+"""
+import collections
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timedelta, timezone
+import boto3
+from botocore import xform_name
+
+FAKE_REGION_NAME = 'eu-west-1'
+
+
+class FakeHTTPResponse:
+    """Minimal HTTP response seen by the botocore after-call handlers"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = b''
+        self.raw = None
+
+
+class FakeAWSError(Exception):
+    """Error answered as an AWS error response (raised as ClientError by the client)"""
+
+    def __init__(self, code, message='', status_code=400):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+class FakeS3:
+    """Objects by (bucket, key): Body, Size, ETag, LastModified, Metadata, TagSet, StorageClass"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}  # UploadId: {'Bucket', 'Key', 'Args', 'Parts'}
+        self.lock = threading.Lock()
+        self.clock = lambda: datetime.now(timezone.utc)
+
+    def seed_object(self, bucket_name, object_key, body=b'{}', tag_set=None, last_modified=None,
+                    metadata=None):
+        """Create an object directly, without counting any call"""
+        with self.lock:
+            self.objects[(bucket_name, object_key)] = {
+                'Body': body, 'Size': len(body), 'ETag': '"%s"' % hashlib.md5(body).hexdigest(),
+                'LastModified': last_modified or self.clock(), 'Metadata': dict(metadata or {}),
+                'TagSet': list(tag_set or []), 'StorageClass': 'STANDARD'}
+
+    def age_objects(self, minutes):
+        """Move the LastModified of all the objects back in time"""
+        with self.lock:
+            for obj in self.objects.values():
+                obj['LastModified'] -= timedelta(minutes=minutes)
+
+    def list_keys(self, bucket_name, prefix=''):
+        with self.lock:
+            return sorted(key for bucket, key in self.objects
+                          if bucket == bucket_name and key.startswith(prefix))
+
+    def get_tag_set(self, bucket_name, object_key):
+        return self._get_object(bucket_name, object_key)['TagSet']
+
+    def _get_object(self, bucket_name, object_key):
+        obj = self.objects.get((bucket_name, object_key))
+        if obj is None:
+            raise FakeAWSError('NoSuchKey', f'{object_key} does not exist', 404)
+        return obj
+
+    def _get_copy_source(self, params):
+        copy_source = params['CopySource']
+        if isinstance(copy_source, dict):
+            bucket_name, object_key = copy_source['Bucket'], copy_source['Key']
+        else:
+            bucket_name, object_key = urllib.parse.unquote(copy_source).lstrip('/').split('/', 1)
+        obj = self._get_object(bucket_name, object_key)
+        if params.get('CopySourceIfMatch') and params['CopySourceIfMatch'] != obj['ETag']:
+            raise FakeAWSError('PreconditionFailed', 'CopySourceIfMatch', 412)
+        return obj
+
+    @staticmethod
+    def _parse_tagging(tagging):
+        return [{'Key': key, 'Value': value}
+                for key, value in urllib.parse.parse_qsl(tagging or '', keep_blank_values=True)]
+
+    def put_object(self, params):
+        body = params.get('Body') or b''
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.seed_object(params['Bucket'], params['Key'], body,
+                         self._parse_tagging(params.get('Tagging')), metadata=params.get('Metadata'))
+        return {'ETag': self.objects[(params['Bucket'], params['Key'])]['ETag']}
+
+    def head_object(self, params):
+        with self.lock:
+            obj = self._get_object(params['Bucket'], params['Key'])
+            if params.get('IfMatch') and params['IfMatch'] != obj['ETag']:
+                raise FakeAWSError('412', 'Precondition Failed', 412)  # HEAD errors have no body
+            return {'ContentLength': obj['Size'], 'ETag': obj['ETag'], 'LastModified': obj['LastModified'],
+                    'Metadata': dict(obj['Metadata']), 'StorageClass': obj['StorageClass']}
+
+    def copy_object(self, params):
+        with self.lock:
+            source = self._get_copy_source(params)
+            target = dict(source, LastModified=self.clock(), TagSet=list(source['TagSet']))
+            if params.get('MetadataDirective') == 'REPLACE':
+                target['Metadata'] = dict(params.get('Metadata') or {})
+            if params.get('TaggingDirective') == 'REPLACE':
+                target['TagSet'] = self._parse_tagging(params.get('Tagging'))
+            self.objects[(params['Bucket'], params['Key'])] = target
+            return {'CopyObjectResult': {'ETag': target['ETag'], 'LastModified': target['LastModified']}}
+
+    def create_multipart_upload(self, params):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {'Bucket': params['Bucket'], 'Key': params['Key'],
+                                       'Args': params, 'Parts': {}}
+        return {'Bucket': params['Bucket'], 'Key': params['Key'], 'UploadId': upload_id}
+
+    def upload_part_copy(self, params):
+        with self.lock:
+            source = self._get_copy_source(params)
+            start, end = params['CopySourceRange'][len('bytes='):].split('-')
+            part_body = source['Body'][int(start):int(end) + 1]
+            part_etag = '"%s"' % hashlib.md5(part_body).hexdigest()
+            self.uploads[params['UploadId']]['Parts'][params['PartNumber']] = part_body
+            return {'CopyPartResult': {'ETag': part_etag}}
+
+    def complete_multipart_upload(self, params):
+        with self.lock:
+            upload = self.uploads.pop(params['UploadId'])
+        body = b''.join(upload['Parts'][part['PartNumber']]
+                        for part in params['MultipartUpload']['Parts'])
+        self.seed_object(params['Bucket'], params['Key'], body,
+                         self._parse_tagging(upload['Args'].get('Tagging')),
+                         metadata=upload['Args'].get('Metadata'))
+        return {'Bucket': params['Bucket'], 'Key': params['Key']}
+
+    def abort_multipart_upload(self, params):
+        with self.lock:
+            self.uploads.pop(params['UploadId'], None)
+        return {}
+
+    def delete_object(self, params):
+        with self.lock:
+            obj = self.objects.get((params['Bucket'], params['Key']))
+            if obj is not None and params.get('IfMatch') and params['IfMatch'] != obj['ETag']:
+                raise FakeAWSError('PreconditionFailed', 'IfMatch', 412)
+            self.objects.pop((params['Bucket'], params['Key']), None)
+        return {}
+
+    def delete_objects(self, params):
+        with self.lock:
+            for obj in params['Delete']['Objects']:
+                self.objects.pop((params['Bucket'], obj['Key']), None)
+        if params['Delete'].get('Quiet'):
+            return {'Errors': []}
+        return {'Deleted': [{'Key': obj['Key']} for obj in params['Delete']['Objects']], 'Errors': []}
+
+    def get_object_tagging(self, params):
+        with self.lock:
+            return {'TagSet': list(self._get_object(params['Bucket'], params['Key'])['TagSet'])}
+
+    def put_object_tagging(self, params):
+        with self.lock:
+            self._get_object(params['Bucket'], params['Key'])['TagSet'] = list(params['Tagging']['TagSet'])
+        return {}
+
+    def list_objects_v2(self, params):
+        prefix = params.get('Prefix', '')
+        delimiter = params.get('Delimiter')
+        max_keys = params.get('MaxKeys', 1000)
+        start_after = max(params.get('StartAfter', ''), params.get('ContinuationToken', ''))
+        contents, common_prefixes, last_key = [], [], None
+        for key in self.list_keys(params['Bucket'], prefix):
+            if key <= start_after or (common_prefixes and key.startswith(common_prefixes[-1])):
+                continue
+            if len(contents) + len(common_prefixes) >= max_keys:
+                return {'Contents': contents, 'CommonPrefixes': [{'Prefix': common_prefix}
+                                                                 for common_prefix in common_prefixes],
+                        'KeyCount': max_keys, 'IsTruncated': True, 'NextContinuationToken': last_key}
+            delimiter_idx = key.find(delimiter, len(prefix)) if delimiter else -1
+            if delimiter_idx >= 0:
+                common_prefixes.append(key[:delimiter_idx + 1])
+                last_key = common_prefixes[-1] + '\uffff'  # Past all the keys of the common prefix
+                continue
+            with self.lock:
+                obj = self.objects.get((params['Bucket'], key))
+            if obj is not None:
+                contents.append({'Key': key, 'LastModified': obj['LastModified'], 'ETag': obj['ETag'],
+                                 'Size': obj['Size'], 'StorageClass': obj['StorageClass']})
+            last_key = key
+        return {'Contents': contents, 'CommonPrefixes': [{'Prefix': common_prefix}
+                                                         for common_prefix in common_prefixes],
+                'KeyCount': len(contents) + len(common_prefixes), 'IsTruncated': False}
+
+
+class FakeSSM:
+    """Parameters by name: Value, Version, Type"""
+
+    def __init__(self):
+        self.parameters = {}
+        self.lock = threading.Lock()
+
+    def seed_parameter(self, name, value, parameter_type='String'):
+        """Create or update a parameter directly, without counting any call"""
+        with self.lock:
+            version = self.parameters.get(name, {}).get('Version', 0) + 1
+            self.parameters[name] = {'Name': name, 'Value': value, 'Version': version,
+                                     'Type': parameter_type}
+
+    def get_parameters(self, params):
+        with self.lock:
+            return {'Parameters': [dict(self.parameters[name]) for name in params['Names']
+                                   if name in self.parameters],
+                    'InvalidParameters': [name for name in params['Names'] if name not in self.parameters]}
+
+    def get_parameters_by_path(self, params):
+        path = params['Path'].rstrip('/') + '/'
+        with self.lock:
+            names = sorted(name for name in self.parameters if name.startswith(path)
+                           and (params.get('Recursive') or '/' not in name[len(path):]))
+            return {'Parameters': [dict(self.parameters[name]) for name in names]}
+
+    def put_parameter(self, params):
+        self.seed_parameter(params['Name'], params['Value'], params.get('Type', 'String'))
+        return {'Version': self.parameters[params['Name']]['Version']}
+
+
+class FakeDynamoDB:
+    """Items by (table name, key attribute values), the key attributes are given at seed time"""
+
+    def __init__(self):
+        self.tables = {}  # table name: key attribute names
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def seed_table(self, table_name, key_names=('LedgerKey',)):
+        """Create a table directly, without counting any call"""
+        with self.lock:
+            self.tables[table_name] = tuple(key_names)
+
+    def _get_item_key(self, table_name, item):
+        if table_name not in self.tables:
+            raise FakeAWSError('ResourceNotFoundException', f'{table_name} does not exist')
+        return (table_name,) + tuple(json.dumps(item[key_name], sort_keys=True)
+                                     for key_name in self.tables[table_name])
+
+    def get_item(self, params):
+        with self.lock:
+            item = self.items.get(self._get_item_key(params['TableName'], params['Key']))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, params):
+        with self.lock:
+            self.items[self._get_item_key(params['TableName'], params['Item'])] = dict(params['Item'])
+        return {}
+
+
+class FakeAWS:
+    """
+    S3, SSM and DynamoDB backends answering the clients created by client(), with per operation
+    call counts (e.g. calls['s3.CopyObject']) and an optional latency per call
+    """
+
+    def __init__(self, latency_sec=0.0):
+        self.s3 = FakeS3()
+        self.ssm = FakeSSM()
+        self.dynamodb = FakeDynamoDB()
+        self.latency_sec = latency_sec
+        self.calls = collections.Counter()
+        self.calls_lock = threading.Lock()
+        self.clients = {}
+
+    def client(self, service_name):
+        """Real boto3 client of the service answered by the fake backend"""
+        if service_name not in self.clients:
+            aws_client = boto3.client(service_name, region_name=FAKE_REGION_NAME,
+                                      aws_access_key_id='fake', aws_secret_access_key='fake')
+            aws_client.meta.events.register('before-parameter-build', self._keep_api_params)
+            aws_client.meta.events.register('before-call', self._answer_call)
+            self.clients[service_name] = aws_client
+        return self.clients[service_name]
+
+    def install(self, boto3_session=None):
+        """
+        Answer all the clients created afterwards by a boto3 session (default: the default
+        session), e.g. the clients created by the code under test at import time
+        """
+        if boto3_session is None:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session(region_name=FAKE_REGION_NAME)
+            boto3_session = boto3.DEFAULT_SESSION
+        boto3_session.events.register('before-parameter-build', self._keep_api_params,
+                                      unique_id='fake_aws-before-parameter-build')
+        boto3_session.events.register('before-call', self._answer_call, unique_id='fake_aws-before-call')
+        return boto3_session
+
+    def get_call_count(self, prefix=''):
+        """Total calls of the operations starting with prefix, e.g. 's3.' or 'ssm.GetParameters'"""
+        with self.calls_lock:
+            return sum(count for operation, count in self.calls.items() if operation.startswith(prefix))
+
+    def reset_calls(self):
+        with self.calls_lock:
+            self.calls.clear()
+
+    @staticmethod
+    def _keep_api_params(params, context, **kwargs):
+        context['fake_api_params'] = params
+
+    def _answer_call(self, model, context, **kwargs):
+        service_name = model.service_model.service_name
+        backend = {'s3': self.s3, 'ssm': self.ssm, 'dynamodb': self.dynamodb}[service_name]
+        with self.calls_lock:
+            self.calls[f'{service_name}.{model.name}'] += 1
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+        try:
+            response = getattr(backend, xform_name(model.name))(context['fake_api_params'])
+        except FakeAWSError as aws_error:
+            return FakeHTTPResponse(aws_error.status_code), {
+                'Error': {'Code': aws_error.code, 'Message': aws_error.message},
+                'ResponseMetadata': {'HTTPStatusCode': aws_error.status_code}}
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+        return FakeHTTPResponse(200), response
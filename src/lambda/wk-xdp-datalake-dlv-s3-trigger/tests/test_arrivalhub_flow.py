@@ -0,0 +1,212 @@
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest.mock import patch
+import lambda_function
+from scripts import aws_utils
+from fake_aws import FakeAWS
+
+BUCKET_NAME = 'bucket_name'
+DELIVERED_PREFIX = 'DataLakeV1/ArrivalHub/Delivered/'
+PENDING_SELECTION_PREFIX = 'DataLakeV1/ArrivalHub/PendingSelection/'
+EVENT_TIME = '2023-05-03T08:54:17.123Z'
+
+
+def s3_event(object_keys, fake_aws=None, event_time=EVENT_TIME, sequencer=None):
+    """
+    S3 event of the keys, with the ETag and the time of the notification when fake_aws is given,
+    and the sequencer of the upload when given
+    """
+    records = []
+    for object_key in object_keys:
+        s3_object = {'key': object_key}
+        if fake_aws is not None:
+            s3_object['eTag'] = fake_aws.s3.objects[(BUCKET_NAME, object_key)]['ETag'].strip('"')
+        if sequencer is not None:
+            s3_object['sequencer'] = sequencer
+        records.append({'eventSource': 'aws:s3', 'eventTime': event_time,
+                        's3': {'bucket': {'name': BUCKET_NAME}, 'object': s3_object}})
+    return {'Records': records}
+
+
+# -----------------------------------------------------------------------------
+@patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_NAME': 'ThisValue', 'AWS_REGION': 'eu-west-1'})
+class TestArrivalHubFlow(unittest.TestCase):
+
+    def setUp(self):
+        aws_utils.clear_aws_clients()
+        aws_utils.clear_ssm_parameters()
+        aws_utils.clear_s3_tag_sets()
+        aws_utils.clear_processed_keys()
+        self.fake_aws = FakeAWS()
+        self.fake_aws.ssm.seed_parameter(aws_utils.SOURCE_ID_LIST_PARAMETER, 'Jenji,SourceB')
+        aws_utils.set_aws_client('s3', self.fake_aws.client('s3'))
+        aws_utils.set_aws_client('ssm', self.fake_aws.client('ssm'))
+
+    def tearDown(self):
+        aws_utils.clear_aws_clients()
+        aws_utils.clear_ssm_parameters()
+        aws_utils.clear_s3_tag_sets()
+        aws_utils.clear_processed_keys()
+
+    def seed_delivered(self, source_id, count, extension='.json'):
+        object_keys = [f'{DELIVERED_PREFIX}{source_id}/{idx}{extension}' for idx in range(count)]
+        for object_key in object_keys:
+            self.fake_aws.s3.seed_object(BUCKET_NAME, object_key,
+                                         tag_set=[{'Key': 'Origin', 'Value': source_id}])
+        return object_keys
+
+    def test_lambda_handler_moves_to_pending_selection(self):
+        object_keys = self.seed_delivered('Jenji', 3)
+        self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(s3_event(object_keys), None))
+
+        self.assertEqual([], self.fake_aws.s3.list_keys(BUCKET_NAME, DELIVERED_PREFIX))
+        pending_keys = self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX + 'Jenji/')
+        self.assertEqual(3, len(pending_keys))
+        self.assertEqual([{'Key': 'Origin', 'Value': 'Jenji'}, {'Key': 'ProcessStatus', 'Value': 'PendingSelection'}],
+                         self.fake_aws.s3.get_tag_set(BUCKET_NAME, pending_keys[0]))
+
+    def test_lambda_handler_rejects_unknown_source(self):
+        object_keys = self.seed_delivered('Unknown', 1)
+        self.assertRaises(Exception, lambda_function.lambda_handler, s3_event(object_keys), None)
+        self.assertEqual(1, len(self.fake_aws.s3.list_keys(BUCKET_NAME, 'DataLakeV1/ArrivalHub/Rejected/')))
+
+    def test_lambda_handler_call_budget(self):
+        object_keys = self.seed_delivered('Jenji', 10) + self.seed_delivered('SourceB', 10)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            lambda_function.lambda_handler(s3_event(object_keys), None)
+
+        # One allow-list read for the batch, then GetObjectTagging + CopyObject + DeleteObject per object
+        self.assertEqual(1, self.fake_aws.get_call_count('ssm.'))
+        self.assertEqual(3 * len(object_keys), self.fake_aws.get_call_count('s3.'))
+        self.assertEqual(len(object_keys), self.fake_aws.calls['s3.CopyObject'])
+
+        # The same budget is reported by the EMF summary of the invocation
+        emf_documents = [json.loads(line) for line in stdout.getvalue().splitlines() if line.startswith('{"_aws"')]
+        self.assertEqual(1 + 3 * len(object_keys), emf_documents[-1]['ApiCalls'])
+        self.assertEqual({'ThisValue'}, {document['FunctionName'] for document in emf_documents})
+
+    def test_move_s3_keys_from_to_location_call_budget(self):
+        object_keys = self.seed_delivered('Jenji', 25)
+        moved_keys, failed_keys = aws_utils.move_s3_keys_from_to_location(
+            BUCKET_NAME, [(key, key.replace('Delivered', 'PendingValidations'), 2) for key in object_keys],
+            tag_updates={'ProcessStatus': 'PendingValidations'})
+
+        self.assertEqual((25, {}), (len(moved_keys), failed_keys))
+        # The sources are removed by one DeleteObjects call
+        self.assertEqual(2 * 25 + 1, self.fake_aws.get_call_count('s3.'))
+        self.assertEqual(1, self.fake_aws.calls['s3.DeleteObjects'])
+
+    def test_move_s3_keys_from_to_location_keys_error(self):
+        object_keys = self.seed_delivered('Jenji', 5)
+
+        def keys_from_to():
+            for key in object_keys:
+                yield key, key.replace('Delivered', 'PendingValidations'), 2
+            raise ValueError('Listing failed')
+
+        # The sources already copied are deleted before the error is raised
+        self.assertRaises(ValueError, aws_utils.move_s3_keys_from_to_location, BUCKET_NAME, keys_from_to())
+        self.assertEqual([], self.fake_aws.s3.list_keys(BUCKET_NAME, DELIVERED_PREFIX))
+        self.assertEqual(5, len(self.fake_aws.s3.list_keys(BUCKET_NAME, 'DataLakeV1/ArrivalHub/PendingValidations/')))
+
+    def test_lambda_handler_duplicate_event(self):
+        object_keys = self.seed_delivered('Jenji', 5)
+        event = s3_event(object_keys, self.fake_aws)
+        lambda_function.lambda_handler(event, None)
+        self.assertIn(PENDING_SELECTION_PREFIX + 'Jenji/20230503_085417_0.json',
+                      self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX))
+        self.fake_aws.reset_calls()
+
+        # The duplicate stops at the ledger lookup, without any S3 call
+        self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(event, None))
+        self.assertEqual(0, self.fake_aws.get_call_count('s3.'))
+        self.assertEqual(5, len(self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX)))
+
+    def test_lambda_handler_reupload_identical_content(self):
+        object_keys = self.seed_delivered('Jenji', 1)
+        event = s3_event(object_keys, self.fake_aws, sequencer='0055AED6DCD90281E5')
+        lambda_function.lambda_handler(event, None)
+
+        # The same content uploaded again: same ETag, new sequencer, moved again
+        self.seed_delivered('Jenji', 1)
+        reupload_event = s3_event(object_keys, self.fake_aws, '2023-05-04T10:00:00.000Z', '0055AED6DCD90281F7')
+        self.assertEqual(event['Records'][0]['s3']['object']['eTag'],
+                         reupload_event['Records'][0]['s3']['object']['eTag'])
+        self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(reupload_event, None))
+        self.assertEqual([], self.fake_aws.s3.list_keys(BUCKET_NAME, DELIVERED_PREFIX))
+        self.assertEqual([PENDING_SELECTION_PREFIX + 'Jenji/20230503_085417_0.json',
+                          PENDING_SELECTION_PREFIX + 'Jenji/20230504_100000_0.json'],
+                         sorted(self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX)))
+
+        # A duplicate of the re-upload event is still skipped, and logged
+        self.fake_aws.reset_calls()
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            lambda_function.lambda_handler(reupload_event, None)
+        self.assertEqual(0, self.fake_aws.get_call_count('s3.'))
+        self.assertIn(f'WARNING: Duplicate event skipped, {object_keys[0]}', stdout.getvalue())
+        self.assertIn('0055AED6DCD90281F7', stdout.getvalue())
+
+    def test_lambda_handler_duplicate_event_other_container(self):
+        object_keys = self.seed_delivered('Jenji', 1)
+        event = s3_event(object_keys, self.fake_aws)
+        lambda_function.lambda_handler(event, None)
+        aws_utils.clear_processed_keys()  # e.g. handled by another container without ledger table
+
+        # The deterministic target is found once the source is missing, no retry loop
+        self.fake_aws.reset_calls()
+        self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(event, None))
+        self.assertEqual({'s3.GetObjectTagging': 1, 's3.HeadObject': 1},
+                         {operation: count for operation, count in self.fake_aws.calls.items()
+                          if operation.startswith('s3.')})
+        self.assertEqual(1, len(self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX)))
+
+    def test_lambda_handler_replaced_version(self):
+        object_keys = self.seed_delivered('Jenji', 1)
+        event = s3_event(object_keys, self.fake_aws)
+        self.fake_aws.s3.seed_object(BUCKET_NAME, object_keys[0], body=b'{"version": 2}')
+
+        # The event of the first version does not move the second one
+        self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(event, None))
+        self.assertEqual(object_keys, self.fake_aws.s3.list_keys(BUCKET_NAME, DELIVERED_PREFIX))
+        self.assertEqual(1, self.fake_aws.calls['s3.CopyObject'])
+
+    def test_lambda_handler_replaced_version_between_copy_and_delete(self):
+        object_keys = self.seed_delivered('Jenji', 1)
+        event = s3_event(object_keys, self.fake_aws)
+        copy_object = self.fake_aws.s3.copy_object
+
+        def copy_object_then_deliver(params):
+            response = copy_object(params)
+            self.fake_aws.s3.seed_object(BUCKET_NAME, object_keys[0], body=b'{"version": 2}')
+            return response
+
+        # The first version is moved, the second one delivered meanwhile is not deleted
+        with patch.object(self.fake_aws.s3, 'copy_object', copy_object_then_deliver):
+            self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(event, None))
+        self.assertEqual(object_keys, self.fake_aws.s3.list_keys(BUCKET_NAME, DELIVERED_PREFIX))
+        self.assertEqual(b'{"version": 2}', self.fake_aws.s3.objects[(BUCKET_NAME, object_keys[0])]['Body'])
+        self.assertEqual(1, len(self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX)))
+
+        # Its own event moves it
+        self.assertEqual({'batchItemFailures': []},
+                         lambda_function.lambda_handler(s3_event(object_keys, self.fake_aws,
+                                                                 '2023-05-03T08:54:18.000Z'), None))
+        self.assertEqual([], self.fake_aws.s3.list_keys(BUCKET_NAME, DELIVERED_PREFIX))
+        self.assertEqual(2, len(self.fake_aws.s3.list_keys(BUCKET_NAME, PENDING_SELECTION_PREFIX)))
+
+    def test_lambda_handler_ledger_table(self):
+        self.fake_aws.dynamodb.seed_table('ledger')
+        aws_utils.set_aws_client('dynamodb', self.fake_aws.client('dynamodb'))
+        object_keys = self.seed_delivered('Jenji', 2)
+        event = s3_event(object_keys, self.fake_aws)
+        with patch.object(aws_utils, 'PROCESSED_KEY_TABLE', 'ledger'):
+            lambda_function.lambda_handler(event, None)
+            aws_utils.clear_processed_keys()  # e.g. a cold start
+            self.fake_aws.reset_calls()
+            lambda_function.lambda_handler(event, None)
+
+        self.assertEqual({'dynamodb.GetItem': 2}, dict(self.fake_aws.calls))
+        self.assertEqual(2, len(self.fake_aws.dynamodb.items))
@@ -0,0 +1,108 @@
+import io
+import json
+import contextlib
+import unittest
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from scripts import aws_metrics, aws_utils
+from fake_aws import FakeAWS
+
+BUCKET_NAME = 'bucket_name'
+
+
+# -----------------------------------------------------------------------------
+class TestAWSMetrics(unittest.TestCase):
+
+    def setUp(self):
+        aws_utils.clear_aws_clients()
+        aws_utils.clear_s3_tag_sets()
+        aws_metrics.reset_api_metrics()
+        self.fake_aws = FakeAWS()
+        aws_utils.set_aws_client('s3', self.fake_aws.client('s3'))
+
+    def tearDown(self):
+        aws_utils.clear_aws_clients()
+        aws_utils.clear_s3_tag_sets()
+        aws_metrics.reset_api_metrics()
+
+    def test_record_call_histogram_percentiles(self):
+        api_metrics = aws_metrics.ApiMetrics()
+        for latency_ms in [1] * 98 + [30, 7000]:
+            api_metrics.record_call('s3.CopyObject', latency_ms)
+        api_metrics.record_call('s3.CopyObject', 2, error_code='SlowDown', retries=2)
+
+        summary = api_metrics.get_summary()['s3.CopyObject']
+        self.assertEqual((101, 2, {'SlowDown': 1}), (summary['Calls'], summary['Retries'], summary['Errors']))
+        self.assertEqual(99, summary['Histogram'][0])
+        self.assertEqual(5.0, api_metrics.get_latency_percentile('s3.CopyObject', 50))
+        self.assertEqual(50.0, api_metrics.get_latency_percentile('s3.CopyObject', 99))
+        self.assertEqual(7000, api_metrics.get_latency_percentile('s3.CopyObject', 100))
+        self.assertEqual(0.0, api_metrics.get_latency_percentile('s3.DeleteObject', 50))
+
+    def test_instrumented_client_call_budget(self):
+        for idx in range(5):
+            self.fake_aws.s3.seed_object(BUCKET_NAME, f'Delivered/Jenji/{idx}.json', body=b'12345')
+        moved_keys, _ = aws_utils.move_s3_keys_from_to_location(
+            BUCKET_NAME, [(f'Delivered/Jenji/{idx}.json', f'Pending/Jenji/{idx}.json', 5) for idx in range(5)])
+
+        api_metrics = aws_metrics.get_api_metrics()
+        self.assertEqual(5, len(moved_keys))
+        self.assertEqual(dict(self.fake_aws.calls), {operation_name: operation['Calls'] for operation_name, operation
+                                                     in api_metrics.get_summary().items()})
+        self.assertEqual(6, api_metrics.get_call_count('s3.'))
+        self.assertEqual(25, api_metrics.get_summary()['s3.CopyObject']['Bytes'])
+
+    def test_instrumented_client_errors(self):
+        self.assertRaises(ClientError, aws_utils.get_aws_client('s3').head_object, Bucket=BUCKET_NAME, Key='missing')
+        self.assertEqual({'NoSuchKey': 1}, aws_metrics.get_api_metrics().get_summary()['s3.HeadObject']['Errors'])
+
+    def test_instrument_client_once(self):
+        aws_utils.set_aws_client('s3', self.fake_aws.client('s3'))  # Instrumented again
+        self.fake_aws.s3.seed_object(BUCKET_NAME, 'key.json')
+        aws_utils.get_aws_client('s3').head_object(Bucket=BUCKET_NAME, Key='key.json')
+        self.assertEqual(1, aws_metrics.get_api_metrics().get_call_count())
+
+    def test_emit_api_metrics(self):
+        self.fake_aws.s3.seed_object(BUCKET_NAME, 'key.json')
+        aws_utils.get_aws_client('s3').head_object(Bucket=BUCKET_NAME, Key='key.json')
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            documents = aws_metrics.emit_api_metrics({'FunctionName': 'ThisValue'}, namespace='ThisNamespace')
+
+        self.assertEqual(documents, [json.loads(line) for line in stdout.getvalue().splitlines()])
+        operation_document, total_document = documents
+        self.assertEqual([['FunctionName', 'Operation']],
+                         operation_document['_aws']['CloudWatchMetrics'][0]['Dimensions'])
+        self.assertEqual('ThisNamespace', operation_document['_aws']['CloudWatchMetrics'][0]['Namespace'])
+        self.assertEqual(('ThisValue', 's3.HeadObject', 1),
+                         (operation_document['FunctionName'], operation_document['Operation'],
+                          operation_document['ApiCalls']))
+        self.assertEqual([['FunctionName']], total_document['_aws']['CloudWatchMetrics'][0]['Dimensions'])
+        self.assertEqual(1, total_document['ApiCalls'])
+        self.assertEqual(0, aws_metrics.get_api_metrics().get_call_count())
+
+    def test_put_api_metrics(self):
+        self.fake_aws.s3.seed_object(BUCKET_NAME, 'key.json')
+        aws_utils.get_aws_client('s3').head_object(Bucket=BUCKET_NAME, Key='key.json')
+        mock_cloudwatch = MagicMock()
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            metric_data = aws_metrics.put_api_metrics(mock_cloudwatch, {'JobName': 'ThisValue'},
+                                                      namespace='ThisNamespace')
+
+        # No EMF line, the metrics of the operation and the total are published
+        self.assertNotIn('_aws', stdout.getvalue())
+        mock_cloudwatch.put_metric_data.assert_called_once_with(Namespace='ThisNamespace', MetricData=metric_data)
+        self.assertEqual(7 + 4, len(metric_data))
+        self.assertIn({'MetricName': 'ApiCalls', 'Value': 1, 'Unit': 'Count',
+                       'Dimensions': [{'Name': 'JobName', 'Value': 'ThisValue'},
+                                      {'Name': 'Operation', 'Value': 's3.HeadObject'}]}, metric_data)
+        self.assertIn({'MetricName': 'ApiCalls', 'Value': 1, 'Unit': 'Count',
+                       'Dimensions': [{'Name': 'JobName', 'Value': 'ThisValue'}]}, metric_data)
+        self.assertEqual(0, aws_metrics.get_api_metrics().get_call_count())
+
+    def test_put_api_metrics_error(self):
+        mock_cloudwatch = MagicMock()
+        mock_cloudwatch.put_metric_data.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}}, 'PutMetricData')
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            aws_metrics.put_api_metrics(mock_cloudwatch, {'JobName': 'ThisValue'})
+        self.assertIn('WARNING: Cannot publish the API metrics', stdout.getvalue())
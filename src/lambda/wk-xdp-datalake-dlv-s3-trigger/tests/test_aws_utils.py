@@ -1,6 +1,7 @@
 import os
 import datetime
 import boto3
+from botocore.exceptions import ClientError
 from scripts import aws_utils
 import unittest
 from unittest.mock import MagicMock, patch
@@ -10,6 +11,16 @@ from freezegun import freeze_time
 # -----------------------------------------------------------------------------
 class TestAWSUtils(unittest.TestCase):
 
+    def setUp(self):
+        aws_utils.clear_aws_clients()
+        aws_utils.clear_ssm_parameters()
+        aws_utils.clear_s3_tag_sets()
+
+    def tearDown(self):
+        aws_utils.clear_aws_clients()
+        aws_utils.clear_ssm_parameters()
+        aws_utils.clear_s3_tag_sets()
+
     @patch.dict(os.environ, {'AWS_REGION': 'ThisValue', 'AWS_DEFAULT_REGION': ''})
     def test_get_current_region_name_os_env1_ok(self):
         expected = 'ThisValue'
@@ -85,6 +96,31 @@ class TestAWSUtils(unittest.TestCase):
             bt3_session_mock.region_name = None
             self.assertEqual(expected, aws_utils.get_current_region_name())
 
+    @patch.dict(os.environ, {'AWS_REGION': 'ThisValue'})
+    def test_get_current_region_name_no_session(self):
+        with patch('boto3.Session') as boto3_session:
+            self.assertEqual('ThisValue', aws_utils.get_current_region_name())
+        boto3_session.assert_not_called()
+
+    @patch.dict(os.environ, {'AWS_REGION': 'ThisValue', 'AWS_LAMBDA_FUNCTION_NAME': 'ThisValue'})
+    def test_get_current_names_cached(self):
+        aws_utils.clear_current_names()
+        self.assertEqual('ThisValue', aws_utils.get_current_region_name(use_cache=True))
+        self.assertEqual('ThisValue', aws_utils.get_current_lambda_function_name(use_cache=True))
+        with patch.dict(os.environ, {'AWS_REGION': 'OtherValue', 'AWS_LAMBDA_FUNCTION_NAME': 'OtherValue'}):
+            self.assertEqual('ThisValue', aws_utils.get_current_region_name(use_cache=True))
+            self.assertEqual('ThisValue', aws_utils.get_current_lambda_function_name(use_cache=True))
+            self.assertEqual('OtherValue', aws_utils.get_current_region_name())
+        aws_utils.clear_current_names()
+
+    @patch('boto3.client')
+    def test_prewarm_aws_clients(self, mock_boto):
+        mock_boto.side_effect = lambda *args, **kwargs: MagicMock()
+        aws_clients = aws_utils.prewarm_aws_clients(region_name='eu-west-1')
+        self.assertIs(aws_clients[0], aws_utils.get_aws_client('s3'))
+        self.assertIs(aws_clients[1], aws_utils.get_aws_client('ssm', region_name='eu-west-1'))
+        self.assertEqual(2, mock_boto.call_count)
+
     @patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_NAME': 'ThisValue'})
     def test_get_current_lambda_function_name_os_env_ok(self):
         expected = 'ThisValue'
@@ -130,6 +166,27 @@ class TestAWSUtils(unittest.TestCase):
         object_name = 'name.txt'
         self.assertEqual(expected, aws_utils.prefix_object_name(object_name, sep='#', iso_dt=True, iso_tm=True, uu_id=True))
 
+    def test_prefix_object_name_deterministic_ok(self):
+        expected = '20230503_085417_name.txt'
+        utc_dtm = datetime.datetime(2023, 5, 3, 8, 54, 17, tzinfo=datetime.timezone.utc)
+        self.assertEqual(expected, aws_utils.prefix_object_name('name.txt', iso_dt=True, iso_tm=True, utc_dtm=utc_dtm))
+        self.assertEqual(aws_utils.prefix_object_name('name.txt', uu_id=True, uuid_name='bucket/key#etag'),
+                         aws_utils.prefix_object_name('name.txt', uu_id=True, uuid_name='bucket/key#etag'))
+
+    def test_processed_key_ledger(self):
+        aws_utils.clear_processed_keys()
+        self.assertIsNone(aws_utils.get_processed_key('bucket_name', 'key.json', 'abcd'))
+        aws_utils.put_processed_key('bucket_name', 'key.json', '"abcd"', 'target.json', 'PendingSelection')
+        self.assertEqual('target.json', aws_utils.get_processed_key('bucket_name', 'key.json', 'abcd')['Target'])
+        self.assertIsNone(aws_utils.get_processed_key('bucket_name', 'key.json', 'efgh'))
+
+        # Identical content re-uploaded: same ETag, another version
+        aws_utils.put_processed_key('bucket_name', 'key.json', 'abcd', 'target_1.json', 'PendingSelection', '0001')
+        self.assertEqual('target_1.json',
+                         aws_utils.get_processed_key('bucket_name', 'key.json', 'abcd', '0001')['Target'])
+        self.assertIsNone(aws_utils.get_processed_key('bucket_name', 'key.json', 'abcd', '0002'))
+        aws_utils.clear_processed_keys()
+
     def test_exec_func_with_max_retries_one_ok(self):
         expected = 0
         result = aws_utils.exec_func_with_max_retries(lambda: print('Forza Lazio'))
@@ -157,6 +214,158 @@ class TestAWSUtils(unittest.TestCase):
             sleep_sec=1)
         self.assertEqual(expected, retries)
 
+    @patch('time.sleep')
+    def test_exec_func_with_max_retries_fatal_error(self, mock_sleep):
+        func_to_exec = MagicMock(side_effect=ClientError(
+            {'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'CopyObject'))
+        self.assertRaises(ClientError, aws_utils.exec_func_with_max_retries, func_to_exec)
+        self.assertEqual(1, func_to_exec.call_count)
+        mock_sleep.assert_not_called()
+
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    @patch('time.sleep')
+    def test_exec_func_with_max_retries_backoff(self, mock_sleep, mock_uniform):
+        func_to_exec = MagicMock(side_effect=[ClientError({'Error': {'Code': 'SlowDown'}}, 'CopyObject'),
+                                              ClientError({'Error': {'Code': 'InternalError'}}, 'CopyObject'),
+                                              None])
+        retry_policy = aws_utils.RetryPolicy(max_tries=4, base_sleep_sec=0.5,
+                                             token_bucket=aws_utils.RetryTokenBucket(100))
+        self.assertEqual(2, aws_utils.exec_func_with_max_retries(func_to_exec, retry_policy=retry_policy))
+        self.assertEqual([0.5, 1.0], [call_args[0][0] for call_args in mock_sleep.call_args_list])
+        self.assertEqual(100 - 10 - 5 + 5, retry_policy.token_bucket.tokens)
+
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    @patch('time.sleep')
+    def test_exec_func_with_max_retries_lambda_deadline(self, mock_sleep, mock_uniform):
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = (aws_utils.RETRY_DEADLINE_MARGIN_SEC + 0.5) * 1000
+        aws_utils.set_lambda_context(context)
+        try:
+            func_to_exec = MagicMock(side_effect=ValueError)
+            self.assertRaises(ValueError, aws_utils.exec_func_with_max_retries, func_to_exec, sleep_sec=1)
+        finally:
+            aws_utils.set_lambda_context(None)
+        self.assertEqual(1, func_to_exec.call_count)
+        mock_sleep.assert_not_called()
+
+    @patch('time.sleep')
+    def test_exec_func_with_max_retries_quota_exhausted(self, mock_sleep):
+        token_bucket = aws_utils.RetryTokenBucket(aws_utils.RETRY_COST)
+        func_to_exec = MagicMock(side_effect=ValueError)
+        self.assertRaises(ValueError, aws_utils.exec_func_with_max_retries, func_to_exec,
+                          retry_policy=aws_utils.RetryPolicy(max_tries=5, token_bucket=token_bucket))
+        self.assertEqual((2, 0), (func_to_exec.call_count, token_bucket.tokens))
+
+    def test_classify_retry_error(self):
+        self.assertEqual('throttling', aws_utils.classify_retry_error(
+            ClientError({'Error': {'Code': 'ThrottlingException'}}, 'GetParameters')))
+        self.assertEqual('transient', aws_utils.classify_retry_error(
+            ClientError({'Error': {'Code': 'Unknown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'CopyObject')))
+        self.assertEqual('fatal', aws_utils.classify_retry_error(
+            ClientError({'Error': {'Code': 'AccessDenied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}}, 'CopyObject')))
+        self.assertEqual('transient', aws_utils.classify_retry_error(ValueError()))
+
+    @patch('boto3.client')
+    def test_get_aws_client_cached(self, mock_boto):
+        mock_boto.side_effect = lambda *args, **kwargs: MagicMock()
+        s3_client = aws_utils.get_aws_client('s3')
+        self.assertIs(s3_client, aws_utils.get_aws_client('s3'))
+        self.assertIsNot(s3_client, aws_utils.get_aws_client('s3', region_name='eu-west-1'))
+        self.assertIsNot(s3_client, aws_utils.get_aws_client('s3', max_pool_connections=10))
+        self.assertEqual(3, mock_boto.call_count)
+        client_config = mock_boto.call_args_list[0][1]['config']
+        self.assertEqual(aws_utils.AWS_CLIENT_MAX_POOL_CONNECTIONS, client_config.max_pool_connections)
+        self.assertEqual(aws_utils.AWS_CLIENT_TCP_KEEPALIVE, client_config.tcp_keepalive)
+
+    @patch('boto3.client')
+    def test_set_aws_client_stub(self, mock_boto):
+        mock_s3 = MagicMock()
+        aws_utils.set_aws_client('s3', mock_s3)
+        self.assertIs(mock_s3, aws_utils.get_aws_client('s3', region_name='eu-west-1'))
+        aws_utils.set_aws_client('s3', None)
+        self.assertIsNot(mock_s3, aws_utils.get_aws_client('s3'))
+        mock_boto.assert_called_once()
+
+    def test_get_ssm_parameter_cached(self):
+        mock_ssm = MagicMock()
+        mock_ssm.get_parameters.return_value = {
+            'Parameters': [{'Name': '/p/source_id-list', 'Value': 'Jenji', 'Version': 1}],
+            'InvalidParameters': []}
+        aws_utils.set_aws_client('ssm', mock_ssm)
+        self.assertEqual('Jenji', aws_utils.get_ssm_parameter('/p/source_id-list'))
+        self.assertEqual('Jenji', aws_utils.get_ssm_parameter('/p/source_id-list'))
+        mock_ssm.get_parameters.assert_called_once_with(
+            Names=['/p/source_id-list'], WithDecryption=True)
+        aws_utils.get_ssm_parameter('/p/source_id-list', ttl_sec=0)
+        self.assertEqual(2, mock_ssm.get_parameters.call_count)
+
+    def test_get_ssm_parameters_batched(self):
+        mock_ssm = MagicMock()
+        mock_ssm.get_parameters.side_effect = lambda Names, WithDecryption: {
+            'Parameters': [{'Name': name, 'Value': name.upper()} for name in Names
+                           if name != 'missing'],
+            'InvalidParameters': [name for name in Names if name == 'missing']}
+        aws_utils.set_aws_client('ssm', mock_ssm)
+        names = [f'p{idx}' for idx in range(12)] + ['missing']
+        result = aws_utils.get_ssm_parameters(names)
+        self.assertEqual(2, mock_ssm.get_parameters.call_count)
+        self.assertEqual(12, len(result))
+        self.assertEqual('P11', result['p11'])
+        self.assertRaises(Exception, aws_utils.get_ssm_parameter, 'missing')
+
+    def test_get_ssm_parameter_throttled_stale(self):
+        mock_ssm = MagicMock()
+        mock_ssm.get_parameters.return_value = {
+            'Parameters': [{'Name': 'name', 'Value': 'OldValue'}]}
+        aws_utils.set_aws_client('ssm', mock_ssm)
+        aws_utils.get_ssm_parameter('name')
+        mock_ssm.get_parameters.side_effect = ClientError(
+            {'Error': {'Code': 'ThrottlingException'}}, 'GetParameters')
+        self.assertEqual('OldValue', aws_utils.get_ssm_parameter('name', ttl_sec=0))
+        self.assertRaises(ClientError, aws_utils.get_ssm_parameter, 'other')
+
+    def test_get_ssm_parameters_by_path(self):
+        mock_ssm = MagicMock()
+        mock_ssm.get_paginator.return_value.paginate.return_value = [
+            {'Parameters': [{'Name': '/p/a', 'Value': 'A'}]},
+            {'Parameters': [{'Name': '/p/b', 'Value': 'B'}]}]
+        aws_utils.set_aws_client('ssm', mock_ssm)
+        self.assertEqual({'/p/a': 'A', '/p/b': 'B'}, aws_utils.get_ssm_parameters_by_path('/p/'))
+        self.assertEqual('B', aws_utils.get_ssm_parameter('/p/b'))
+        aws_utils.get_ssm_parameters_by_path('/p/')
+        mock_ssm.get_paginator.assert_called_once_with('get_parameters_by_path')
+        mock_ssm.get_parameters.assert_not_called()
+
+    def test_parse_source_id_list_exact_match(self):
+        allow_list = aws_utils.parse_source_id_list('Jenji, SourceB;SourceC')
+        self.assertEqual(3, len(allow_list))
+        self.assertIn('Jenji', allow_list)
+        self.assertNotIn('Jen', allow_list)
+        self.assertTrue(allow_list.is_allowed('Jenji', 'file.json'))
+        self.assertFalse(allow_list.is_allowed('Jenji', 'file.csv'))
+        self.assertFalse(allow_list.is_allowed('Jen', 'file.json'))
+
+    def test_parse_source_id_list_json_metadata(self):
+        allow_list = aws_utils.parse_source_id_list(
+            '{"Jenji": {"extensions": [".json", ".csv"], "target_prefix": "JenjiV2"}, "SourceB": null}')
+        self.assertTrue(allow_list.is_allowed('Jenji', 'file.csv'))
+        self.assertEqual('JenjiV2', allow_list.get_target_prefix('Jenji'))
+        self.assertEqual('SourceB', allow_list.get_target_prefix('SourceB'))
+        self.assertEqual(('.json',), allow_list.get_extensions('SourceB'))
+
+    def test_get_source_allow_list_per_version(self):
+        mock_ssm = MagicMock()
+        mock_ssm.get_parameters.return_value = {
+            'Parameters': [{'Name': aws_utils.SOURCE_ID_LIST_PARAMETER, 'Value': 'Jenji', 'Version': 1}]}
+        aws_utils.set_aws_client('ssm', mock_ssm)
+        allow_list = aws_utils.get_source_allow_list()
+        self.assertIs(allow_list, aws_utils.get_source_allow_list(ttl_sec=0))
+        mock_ssm.get_parameters.return_value = {
+            'Parameters': [{'Name': aws_utils.SOURCE_ID_LIST_PARAMETER, 'Value': 'Jenji,B', 'Version': 2}]}
+        new_allow_list = aws_utils.get_source_allow_list(ttl_sec=0)
+        self.assertIsNot(allow_list, new_allow_list)
+        self.assertIn('B', new_allow_list)
+
     def test_move_s3_key_from_to_location(self):
         mock_s3_client = MagicMock()
         mock_s3_object = MagicMock()
@@ -165,10 +374,132 @@ class TestAWSUtils(unittest.TestCase):
         with patch('boto3.client') as boto3_client:
             boto3_client.return_value = mock_s3_client
             aws_utils.move_s3_key_from_to_location('bucket_name', 'object_key_from', 'object_key_to')
-            boto3_client.assert_called_once_with('s3')
+            boto3_client.assert_called_once()
+            self.assertEqual('s3', boto3_client.call_args[0][0])
             mock_s3_client.copy_object.assert_called_once()
             mock_s3_client.delete_object.assert_called_once()
 
+    def test_move_s3_key_from_to_location_tag_updates(self):
+        mock_s3 = MagicMock()
+        mock_s3.get_object_tagging.return_value = {'TagSet': [{'Key': 'App', 'Value': 'DL'}]}
+        aws_utils.set_aws_client('s3', mock_s3)
+        aws_utils.move_s3_key_from_to_location('bucket_name', 'key_from', 'key_to',
+                                               tag_updates={'ProcessStatus': 'Pending Selection'})
+        mock_s3.copy_object.assert_called_once_with(
+            Bucket='bucket_name', CopySource={'Bucket': 'bucket_name', 'Key': 'key_from'},
+            Key='key_to', MetadataDirective='COPY', TaggingDirective='REPLACE',
+            Tagging='App=DL&ProcessStatus=Pending+Selection')
+        mock_s3.put_object_tagging.assert_not_called()
+        mock_s3.delete_object.assert_called_once_with(Bucket='bucket_name', Key='key_from')
+
+    def test_move_s3_key_from_to_location_multipart(self):
+        mock_s3 = MagicMock()
+        mock_s3.head_object.return_value = {'ContentLength': 10, 'ETag': '"etag"',
+                                            'ContentType': 'application/json', 'Metadata': {}}
+        mock_s3.get_object_tagging.return_value = {'TagSet': []}
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload_id'}
+        mock_s3.upload_part_copy.side_effect = lambda **kwargs: {
+            'CopyPartResult': {'ETag': kwargs['CopySourceRange']}}
+        aws_utils.set_aws_client('s3', mock_s3)
+        with patch('scripts.aws_utils.S3_MULTIPART_COPY_THRESHOLD', 5):
+            aws_utils.move_s3_key_from_to_location('bucket_name', 'key_from', 'key_to',
+                                                   object_size=10, part_size=4)
+        mock_s3.copy_object.assert_not_called()
+        mock_s3.create_multipart_upload.assert_called_once_with(
+            Bucket='bucket_name', Key='key_to', ContentType='application/json', Metadata={})
+        expected = {'Parts': [{'PartNumber': 1, 'ETag': 'bytes=0-3'},
+                              {'PartNumber': 2, 'ETag': 'bytes=4-7'},
+                              {'PartNumber': 3, 'ETag': 'bytes=8-9'}]}
+        mock_s3.complete_multipart_upload.assert_called_once_with(
+            Bucket='bucket_name', Key='key_to', UploadId='upload_id', MultipartUpload=expected)
+        mock_s3.delete_object.assert_called_once()
+
+    def test_copy_s3_key_from_to_location_over_single_copy_size(self):
+        mock_s3 = MagicMock()
+        mock_s3.head_object.return_value = {'ContentLength': 10, 'ETag': '"etag"'}
+        mock_s3.get_object_tagging.return_value = {'TagSet': []}
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload_id'}
+        mock_s3.upload_part_copy.return_value = {'CopyPartResult': {'ETag': '"part"'}}
+        aws_utils.set_aws_client('s3', mock_s3)
+        with patch('scripts.aws_utils.S3_MULTIPART_COPY_THRESHOLD', 100), \
+                patch('scripts.aws_utils.S3_MAX_SINGLE_COPY_SIZE', 5):
+            aws_utils.copy_s3_key_from_to_location('bucket_name', 'key_from', 'key_to', object_size=10)
+        mock_s3.copy_object.assert_not_called()
+        mock_s3.complete_multipart_upload.assert_called_once()
+
+    def test_move_s3_key_from_to_location_multipart_abort(self):
+        mock_s3 = MagicMock()
+        mock_s3.head_object.return_value = {'ContentLength': 10, 'ETag': '"etag"'}
+        mock_s3.get_object_tagging.return_value = {'TagSet': []}
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload_id'}
+        mock_s3.upload_part_copy.side_effect = ValueError
+        mock_s3.copy_object.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidRequest'}}, 'CopyObject')
+        aws_utils.set_aws_client('s3', mock_s3)
+        self.assertRaises(ValueError, aws_utils.move_s3_key_from_to_location,
+                          'bucket_name', 'key_from', 'key_to')
+        mock_s3.abort_multipart_upload.assert_called_once_with(
+            Bucket='bucket_name', Key='key_to', UploadId='upload_id')
+        mock_s3.delete_object.assert_not_called()
+
+    def test_delete_s3_keys_batched_and_retried(self):
+        mock_s3 = MagicMock()
+        mock_s3.delete_objects.side_effect = [
+            {'Errors': [{'Key': 'k3', 'Code': 'SlowDown', 'Message': 'Reduce your request rate'}]},
+            {},
+            {},
+        ]
+        aws_utils.set_aws_client('s3', mock_s3)
+        with patch('scripts.aws_utils.S3_DELETE_OBJECTS_MAX_KEYS', 3):
+            failed_keys = aws_utils.delete_s3_keys('bucket_name', ['k1', 'k2', 'k3', 'k4'],
+                                                   sleep_sec=0)
+        self.assertEqual({}, failed_keys)
+        self.assertEqual(3, mock_s3.delete_objects.call_count)
+        mock_s3.delete_objects.assert_called_with(
+            Bucket='bucket_name', Delete={'Objects': [{'Key': 'k3'}], 'Quiet': True})
+
+    def test_delete_s3_keys_max_tries(self):
+        mock_s3 = MagicMock()
+        mock_s3.delete_objects.return_value = {
+            'Errors': [{'Key': 'k1', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]}
+        aws_utils.set_aws_client('s3', mock_s3)
+        failed_keys = aws_utils.delete_s3_keys('bucket_name', ['k1', 'k2'], max_tries=2, sleep_sec=0)
+        self.assertEqual({'k1': 'AccessDenied: Access Denied'}, failed_keys)
+        self.assertEqual(2, mock_s3.delete_objects.call_count)
+
+    def test_move_s3_keys_from_to_location(self):
+        mock_s3 = MagicMock()
+        def copy_object(**kwargs):
+            if kwargs['Key'] == 'to2':
+                raise ValueError
+        mock_s3.copy_object.side_effect = copy_object
+        mock_s3.delete_objects.return_value = {}
+        aws_utils.set_aws_client('s3', mock_s3)
+        moved_keys, failed_keys = aws_utils.move_s3_keys_from_to_location(
+            'bucket_name', [('from1', 'to1', 10), ('from2', 'to2', 10), ('from3', 'to3', None)])
+        self.assertEqual(['from1', 'from3'], sorted(moved_keys))
+        self.assertEqual(['from2'], list(failed_keys))
+        mock_s3.delete_objects.assert_called_once()
+        deleted = mock_s3.delete_objects.call_args[1]['Delete']['Objects']
+        self.assertEqual([{'Key': 'from1'}, {'Key': 'from3'}], sorted(deleted, key=lambda obj: obj['Key']))
+        mock_s3.delete_object.assert_not_called()
+
+    def test_move_s3_keys_from_to_location_streaming(self):
+        mock_s3 = MagicMock()
+        mock_s3.delete_objects.return_value = {}
+        aws_utils.set_aws_client('s3', mock_s3)
+        keys_from_to = ((f'from{idx}', f'to{idx}', None) for idx in range(25))
+        with patch('scripts.aws_utils.S3_DELETE_OBJECTS_MAX_KEYS', 10):
+            moved_keys, failed_keys = aws_utils.move_s3_keys_from_to_location(
+                'bucket_name', keys_from_to, max_workers=2)
+        self.assertEqual(25, len(set(moved_keys)))
+        self.assertEqual({}, failed_keys)
+        self.assertEqual(25, mock_s3.copy_object.call_count)
+        deleted = [obj['Key'] for call in mock_s3.delete_objects.call_args_list
+                   for obj in call[1]['Delete']['Objects']]
+        self.assertEqual(sorted(moved_keys), sorted(deleted))
+        self.assertLessEqual(3, mock_s3.delete_objects.call_count)
+
     @patch('boto3.client')
     def test_get_s3_key_tag(self, mock_boto):
         mock_s3 = MagicMock()
@@ -187,7 +518,8 @@ class TestAWSUtils(unittest.TestCase):
 
         # Assertions
         expected = 'TagVal2'
-        mock_boto.assert_called_once_with('s3')
+        mock_boto.assert_called_once()
+        self.assertEqual('s3', mock_boto.call_args[0][0])
         mock_get_object_tagging.assert_called_once_with(Bucket='bucket_name', Key='object_key')
         self.assertEqual(expected, result)
 
@@ -219,7 +551,8 @@ class TestAWSUtils(unittest.TestCase):
                 {'Key': 'TagKey2', 'Value': 'NewValue'},
                 {'Key': 'TagKey3', 'Value': 'TagVal3'},
             ]}
-        mock_boto.assert_called_once_with('s3')
+        mock_boto.assert_called_once()
+        self.assertEqual('s3', mock_boto.call_args[0][0])
         mock_put_object_tagging.assert_called_once_with(
             Bucket='bucket_name',
             Key='object_key',
@@ -254,7 +587,7 @@ class TestAWSUtils(unittest.TestCase):
                 {'Key': 'TagKey2', 'Value': 'NewValue'},
                 {'Key': 'TagKey3', 'Value': 'TagVal3'},
             ]}
-        mock_boto.assert_called_with('s3')
+        self.assertEqual('s3', mock_boto.call_args[0][0])
         mock_put_object_tagging.assert_called_once_with(
             Bucket='bucket_name',
             Key='object_key',
@@ -283,5 +616,148 @@ class TestAWSUtils(unittest.TestCase):
         aws_utils.put_s3_key_tag('bucket_name', 'object_key', 'TagKey2', 'NewValue', if_tag_value='NotFound')
 
         # Assertions
-        mock_boto.assert_called_with('s3')
+        self.assertEqual('s3', mock_boto.call_args[0][0])
         mock_put_object_tagging.assert_not_called()
+
+    def test_iter_s3_key_older_than(self):
+        utc_dtm = datetime.datetime(2023, 5, 3, 9, 0, 0, tzinfo=datetime.timezone.utc)
+        old_dtm = datetime.datetime(2023, 5, 3, 8, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        mock_s3 = MagicMock()
+        mock_s3.get_paginator.return_value.paginate.return_value = iter([
+            {'Contents': [{'Key': 'p/', 'LastModified': old_dtm, 'Size': 0},
+                          {'Key': 'p/a.json', 'LastModified': old_dtm, 'Size': 1,
+                           'StorageClass': 'STANDARD'}]},
+            {'Contents': [{'Key': 'p/b.json', 'LastModified': utc_dtm, 'Size': 2}]},
+            {},
+        ])
+        aws_utils.set_aws_client('s3', mock_s3)
+        s3_keys = aws_utils.iter_s3_key_older_than('bucket_name', 'p/', utc_dtm=utc_dtm,
+                                                   minutes_ago=10, start_after='p/0')
+        self.assertEqual({'Key': 'p/a.json', 'LastModified': old_dtm, 'Size': 1,
+                          'StorageClass': 'STANDARD'}, next(s3_keys))
+        self.assertEqual([], list(s3_keys))
+        mock_s3.get_paginator.assert_called_once_with('list_objects_v2')
+        mock_s3.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='bucket_name', Prefix='p/', StartAfter='p/0')
+
+    def test_iter_s3_key_older_than_listing_state(self):
+        utc_dtm = datetime.datetime(2023, 5, 3, 9, 0, 0, tzinfo=datetime.timezone.utc)
+        old_dtm = datetime.datetime(2023, 5, 3, 8, 0, 0, tzinfo=datetime.timezone.utc)
+        mock_s3 = MagicMock()
+        mock_s3.get_paginator.return_value.paginate.return_value = iter([
+            {'Contents': [{'Key': 'p/a.json', 'LastModified': old_dtm, 'Size': 1}],
+             'IsTruncated': True, 'NextContinuationToken': 'token-2'},
+            {'Contents': [{'Key': 'p/b.json', 'LastModified': old_dtm, 'Size': 2}], 'IsTruncated': False},
+        ])
+        aws_utils.set_aws_client('s3', mock_s3)
+        listing_state = {}
+        s3_keys = aws_utils.iter_s3_key_older_than('bucket_name', 'p/', utc_dtm=utc_dtm, minutes_ago=10,
+                                                   continuation_token='token-1', listing_state=listing_state)
+        self.assertEqual('p/a.json', next(s3_keys)['Key'])
+        self.assertEqual({}, listing_state)  # The page may not be processed yet
+        self.assertEqual('p/b.json', next(s3_keys)['Key'])
+        self.assertEqual({'NextContinuationToken': 'token-2'}, listing_state)
+        self.assertEqual([], list(s3_keys))
+        self.assertEqual({'NextContinuationToken': None}, listing_state)
+        mock_s3.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='bucket_name', Prefix='p/', ContinuationToken='token-1')
+
+    def test_list_s3_key_older_than_iso(self):
+        utc_dtm = datetime.datetime(2023, 5, 3, 9, 0, 0, tzinfo=datetime.timezone.utc)
+        old_dtm = datetime.datetime(2023, 5, 3, 8, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        mock_s3 = MagicMock()
+        mock_s3.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'p/a.json', 'LastModified': old_dtm, 'Size': 1,
+                           'StorageClass': 'STANDARD'}]}]
+        aws_utils.set_aws_client('s3', mock_s3)
+        expected = [{'Key': 'p/a.json', 'LastModified': '2023-05-03T08:00:00.123Z', 'Size': 1,
+                     'StorageClass': 'STANDARD'}]
+        self.assertEqual(expected, aws_utils.list_s3_key_older_than('bucket_name', 'p/', utc_dtm=utc_dtm))
+        mock_s3.get_paginator.return_value.paginate.side_effect = ValueError
+        self.assertEqual([], aws_utils.list_s3_key_older_than('bucket_name', 'p/', utc_dtm=utc_dtm))
+
+    def test_iter_s3_key_older_than_by_prefix(self):
+        old_dtm = datetime.datetime(2023, 5, 3, 8, 0, 0, tzinfo=datetime.timezone.utc)
+        pages = {
+            None: [{'CommonPrefixes': [{'Prefix': 'p/A/'}, {'Prefix': 'p/B/'}],
+                    'Contents': [{'Key': 'p/x.json', 'LastModified': old_dtm, 'Size': 1}]}],
+            'p/A/': [{'Contents': [{'Key': f'p/A/a{idx}.json', 'LastModified': old_dtm, 'Size': 1}
+                                   for idx in range(10)]}],
+            'p/B/': [{'Contents': [{'Key': 'p/B/b0.json', 'LastModified': old_dtm, 'Size': 1}]}],
+        }
+        mock_s3 = MagicMock()
+        mock_s3.get_paginator.return_value.paginate.side_effect = \
+            lambda **kwargs: pages[None if 'Delimiter' in kwargs else kwargs['Prefix']]
+        aws_utils.set_aws_client('s3', mock_s3)
+        s3_keys = list(aws_utils.iter_s3_key_older_than_by_prefix(
+            'bucket_name', 'p/', max_workers=2, max_keys_per_prefix=3))
+        expected = ['p/A/a0.json', 'p/A/a1.json', 'p/A/a2.json', 'p/B/b0.json', 'p/x.json']
+        self.assertEqual(expected, sorted(s3_key['Key'] for s3_key in s3_keys))
+
+    def test_iter_s3_key_older_than_by_prefix_stopped_early(self):
+        old_dtm = datetime.datetime(2023, 5, 3, 8, 0, 0, tzinfo=datetime.timezone.utc)
+        sub_prefixes = [f'p/S{idx}/' for idx in range(20)]
+        pages = {None: [{'CommonPrefixes': [{'Prefix': sub_prefix} for sub_prefix in sub_prefixes]}]}
+        for sub_prefix in sub_prefixes:
+            pages[sub_prefix] = [{'Contents': [{'Key': f'{sub_prefix}{idx}.json', 'LastModified': old_dtm,
+                                                'Size': 1} for idx in range(2)]}]
+        mock_s3 = MagicMock()
+        mock_s3.get_paginator.return_value.paginate.side_effect = \
+            lambda **kwargs: pages[None if 'Delimiter' in kwargs else kwargs['Prefix']]
+        aws_utils.set_aws_client('s3', mock_s3)
+
+        # One key read: only the 2 sub-prefixes being listed are, the queued ones are not
+        with patch.object(aws_utils, 'S3_LIST_QUEUE_SIZE', 1):
+            s3_keys = aws_utils.iter_s3_key_older_than_by_prefix('bucket_name', 'p/', max_workers=2)
+            next(s3_keys)
+            s3_keys.close()
+        self.assertEqual(1 + 2, mock_s3.get_paginator.return_value.paginate.call_count)
+
+    def test_iter_s3_key_older_than_by_prefix_error(self):
+        def paginate(**kwargs):
+            if 'Delimiter' in kwargs:
+                return [{'CommonPrefixes': [{'Prefix': 'p/A/'}]}]
+            raise ValueError
+        mock_s3 = MagicMock()
+        mock_s3.get_paginator.return_value.paginate.side_effect = paginate
+        aws_utils.set_aws_client('s3', mock_s3)
+        self.assertRaises(ValueError, list, aws_utils.iter_s3_key_older_than_by_prefix('bucket_name', 'p/'))
+
+    def test_put_s3_key_tag_one_get_one_put(self):
+        mock_s3 = MagicMock()
+        mock_s3.get_object_tagging.return_value = {'TagSet': [{'Key': 'TagKey1', 'Value': 'TagVal1'}]}
+        aws_utils.set_aws_client('s3', mock_s3)
+        self.assertTrue(aws_utils.put_s3_key_tag('bucket_name', 'object_key', 'TagKey1', 'NewValue',
+                                                 if_tag_value='TagVal1'))
+        mock_s3.get_object_tagging.assert_called_once()
+        mock_s3.put_object_tagging.assert_called_once()
+        # The tag set written is cached for the rest of the run
+        self.assertEqual('NewValue', aws_utils.get_s3_key_tag('bucket_name', 'object_key', 'TagKey1'))
+        self.assertFalse(aws_utils.put_s3_key_tag('bucket_name', 'object_key', 'TagKey1', 'NewValue'))
+        mock_s3.get_object_tagging.assert_called_once()
+        mock_s3.put_object_tagging.assert_called_once()
+
+    def test_put_s3_key_tag_given_tag_set(self):
+        mock_s3 = MagicMock()
+        aws_utils.set_aws_client('s3', mock_s3)
+        aws_utils.put_s3_key_tag('bucket_name', 'object_key', 'TagKey2', 'NewValue',
+                                 tag_set=[{'Key': 'TagKey1', 'Value': 'TagVal1'}])
+        mock_s3.get_object_tagging.assert_not_called()
+        mock_s3.put_object_tagging.assert_called_once_with(
+            Bucket='bucket_name', Key='object_key',
+            Tagging={'TagSet': [{'Key': 'TagKey1', 'Value': 'TagVal1'},
+                                {'Key': 'TagKey2', 'Value': 'NewValue'}]})
+
+    def test_put_s3_keys_tag(self):
+        mock_s3 = MagicMock()
+        mock_s3.get_object_tagging.return_value = {'TagSet': []}
+        def put_object_tagging(**kwargs):
+            if kwargs['Key'] == 'k2':
+                raise ValueError('AccessDenied')
+        mock_s3.put_object_tagging.side_effect = put_object_tagging
+        aws_utils.set_aws_client('s3', mock_s3)
+        failed_keys = aws_utils.put_s3_keys_tag('bucket_name', ['k1', 'k2', 'k3'], 'TagKey', 'Value',
+                                                tag_sets={'k1': []})
+        self.assertEqual({'k2': 'AccessDenied'}, failed_keys)
+        self.assertEqual(2, mock_s3.get_object_tagging.call_count)
+        self.assertEqual(3, mock_s3.put_object_tagging.call_count)
@@ -0,0 +1,73 @@
+import os
+import json
+import lambda_function
+import unittest
+from unittest.mock import patch
+
+
+def s3_record(object_key, bucket_name='bucket_name'):
+    return {'eventSource': 'aws:s3',
+            's3': {'bucket': {'name': bucket_name}, 'object': {'key': object_key}}}
+
+
+def sqs_record(message_id, object_keys):
+    return {'eventSource': 'aws:sqs', 'messageId': message_id,
+            'body': json.dumps({'Records': [s3_record(key) for key in object_keys]})}
+
+
+# -----------------------------------------------------------------------------
+@patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_NAME': 'ThisValue', 'AWS_REGION': 'ThisRegion'})
+class TestLambdaFunction(unittest.TestCase):
+
+    def test_get_s3_objects_from_record_unquote(self):
+        expected = [('bucket_name', 'DL/ArrivalHub/Delivered/Jenji/my file.json', None, None, None)]
+        record = s3_record('DL/ArrivalHub/Delivered/Jenji/my+file.json')
+        self.assertEqual(expected, lambda_function.get_s3_objects_from_record(record))
+
+    def test_get_s3_objects_from_record_sqs_test_event(self):
+        record = {'eventSource': 'aws:sqs', 'messageId': 'm1',
+                  'body': json.dumps({'Event': 's3:TestEvent'})}
+        self.assertEqual([], lambda_function.get_s3_objects_from_record(record))
+
+    def test_get_s3_objects_from_record_etag(self):
+        record = dict(s3_record('DL/ArrivalHub/Delivered/Jenji/1.json'), eventTime='2023-05-03T08:54:17.123Z')
+        record['s3']['object']['eTag'] = 'abcd1234'
+        expected = [('bucket_name', 'DL/ArrivalHub/Delivered/Jenji/1.json', 'abcd1234', '2023-05-03T08:54:17.123Z',
+                     None)]
+        self.assertEqual(expected, lambda_function.get_s3_objects_from_record(record))
+
+    def test_get_s3_objects_from_record_version(self):
+        record = s3_record('DL/ArrivalHub/Delivered/Jenji/1.json')
+        record['s3']['object']['sequencer'] = '0055AED6DCD90281E5'
+        self.assertEqual('0055AED6DCD90281E5', lambda_function.get_s3_objects_from_record(record)[0][4])
+        record['s3']['object']['versionId'] = '3HL4kqtJlcpXroDTDmjVBH40Nrjfkd'  # Versioned bucket
+        self.assertEqual('3HL4kqtJlcpXroDTDmjVBH40Nrjfkd', lambda_function.get_s3_objects_from_record(record)[0][4])
+
+    @patch('lambda_function.validation_incoming_source_delivery')
+    def test_lambda_handler_all_s3_records(self, mock_validation):
+        event = {'Records': [s3_record(f'DL/ArrivalHub/Delivered/Jenji/{idx}.json')
+                             for idx in range(5)] + [s3_record('DL/Other/x.json')]}
+        self.assertEqual({'batchItemFailures': []}, lambda_function.lambda_handler(event, None))
+        self.assertEqual(5, mock_validation.call_count)
+
+    @patch('lambda_function.validation_incoming_source_delivery')
+    def test_lambda_handler_s3_record_failed(self, mock_validation):
+        mock_validation.side_effect = ValueError
+        event = {'Records': [s3_record('DL/ArrivalHub/Delivered/Jenji/1.json')]}
+        self.assertRaises(ValueError, lambda_function.lambda_handler, event, None)
+
+    @patch('lambda_function.validation_incoming_source_delivery')
+    def test_lambda_handler_sqs_partial_batch_failure(self, mock_validation):
+        def validation(bucket_name, object_key, object_etag, event_time, object_version=None):
+            if object_key.endswith('bad.json'):
+                raise ValueError
+        mock_validation.side_effect = validation
+        event = {'Records': [
+            sqs_record('m1', ['DL/ArrivalHub/Delivered/Jenji/1.json']),
+            sqs_record('m2', ['DL/ArrivalHub/Delivered/Jenji/2.json',
+                              'DL/ArrivalHub/Delivered/Jenji/bad.json']),
+            sqs_record('m3', ['DL/ArrivalHub/Delivered/Jenji/3.json']),
+        ]}
+        expected = {'batchItemFailures': [{'itemIdentifier': 'm2'}]}
+        self.assertEqual(expected, lambda_function.lambda_handler(event, None))
+        self.assertEqual(4, mock_validation.call_count)